@@ -162,14 +162,60 @@ Version in 0.7.1
 # TODO: color stderr
 # TODO: simplify javascript using ,ore than 1 class in the class attribute?
 
+import argparse
+import array
+import asyncio
+import collections
+import contextlib
+import contextvars
+import ctypes
 import datetime
+import faulthandler
+import fnmatch
+import gc
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import inspect
 import io
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.util
+import operator
 import time
+import traceback
+import warnings
+import zlib
 import unittest
 from xml.sax import saxutils
 import sys
 import os
 import re
+import shutil
+import signal
+import sqlite3
+import struct
+import subprocess
+import tarfile
+import tempfile
+import threading
+
+try:
+    # 可选依赖：装了 Pillow 就用它生成缩略图和压缩截图，没装则用标准库的 PNG 编解码
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    # 可选依赖：装了 coverage.py 时，没有 sys.monitoring 的 Python（3.12 以下）用它的 C 跟踪函数记录覆盖，比纯 Python 的 settrace 快
+    import coverage as coverage_py
+except ImportError:
+    coverage_py = None
 
 
 # 全局变量      -- Gelomen
@@ -224,6 +270,63 @@ class OutputRedirector(object):
 stdout_redirector = OutputRedirector(sys.stdout)
 stderr_redirector = OutputRedirector(sys.stderr)
 
+# 异步模式下，同一事件循环里并发执行的每个用例任务各自持有一个输出缓冲，
+# 通过 ContextVar 区分当前写输出的是哪个任务
+_async_output = contextvars.ContextVar("_async_output", default=None)
+
+
+class AsyncOutputRedirector(OutputRedirector):
+    """ 按 asyncio 任务分流 stdout 或 stderr，不在任务内的输出仍写入 fp """
+
+    def write(self, s):
+        buffer = _async_output.get()
+        if buffer is None:
+            self.fp.write(s)
+        else:
+            buffer.write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+# 异步模式下每个用例任务各自的日志记录列表
+_async_logs = contextvars.ContextVar("_async_logs", default=None)
+
+# 异步模式下每个用例任务各自的阶段时间 [(阶段, 开始, 结束)]
+_async_phases = contextvars.ContextVar("_async_phases", default=None)
+
+
+# 日志捕获：运行期间挂在根 logger 上，把 LogRecord 原样存进当前用例，生成报告时才格式化
+class _LogCapture(logging.Handler):
+    """
+    Route LogRecords emitted while a test runs to that test.
+
+    Records are kept unformatted; _TestResult drops the ones below
+    `keep_level` when the test does not fail, so DEBUG logging of passing
+    tests is never formatted. Loggers with propagate=False are not seen.
+    """
+
+    def __init__(self, level=logging.DEBUG, keep_level=logging.WARNING, fmt=None):
+        logging.Handler.__init__(self, level)
+        self.keep_level = keep_level
+        self.setFormatter(logging.Formatter(fmt))
+        # 当前用例的记录列表，由 _TestResult.startTest 设置
+        self.records = None
+
+    def emit(self, record):
+        records = _async_logs.get()
+        if records is None:
+            records = self.records
+        if records is not None:
+            records.append(record)
+
+    def format(self, record):
+        try:
+            return logging.Handler.format(self, record)
+        except Exception:
+            return "%s 日志格式化失败：%r %% %r" % (record.levelname, record.msg, record.args)
+
 # ----------------------------------------------------------------------
 # Template
 
@@ -272,8 +375,38 @@ class Template_mixin(object):
         0: '通过',
         1: '失败',
         2: '错误',
+        3: '不稳定',
+        4: '跳过/未执行',
+    }
+
+    STATUS_STYLE = {
+        0: 'passCase',
+        1: 'failCase',
+        2: 'errorCase',
+        3: 'flakyCase',
+        4: 'notRunCase',
+    }
+
+    STATUS_BUTTON = {
+        0: '',
+        1: 'btn-danger',
+        2: 'btn-warning',
+        3: 'btn-info',
+        4: 'btn-default',
+    }
+
+    # 没有输出的用例行用标签显示结果
+    STATUS_LABEL = {
+        0: 'label-success',
+        1: 'label-danger',
+        2: 'label-warning',
+        3: 'label-info',
+        4: 'label-default',
     }
 
+    # 饼图的颜色和顺序：通过、失败、错误、不稳定、未执行
+    CHART_COLORS = ('#81ca9d', '#f16d7e', '#fdc68c', '#8fd3e8', '#cccccc')
+
     DEFAULT_TITLE = '测试报告'
     DEFAULT_DESCRIPTION = ''
     DEFAULT_TESTER = 'QA'
@@ -289,31 +422,15 @@ class Template_mixin(object):
     <meta name="generator" content="%(generator)s"/>
     <meta http-equiv="Content-Type" content="text/html; charset=UTF-8"/>
     <link href="http://libs.baidu.com/bootstrap/3.0.3/css/bootstrap.min.css" rel="stylesheet">
-    <script src="http://libs.baidu.com/jquery/2.0.0/jquery.min.js"></script>
-    <script src="http://libs.baidu.com/bootstrap/3.0.3/js/bootstrap.min.js"></script>
-    <script src="https://img.hcharts.cn/highcharts/highcharts.js"></script>
-    <script src="https://img.hcharts.cn/highcharts/modules/exporting.js"></script>
+    <script defer="defer" src="http://libs.baidu.com/jquery/2.0.0/jquery.min.js"></script>
+    <script defer="defer" src="http://libs.baidu.com/bootstrap/3.0.3/js/bootstrap.min.js"></script>
     %(stylesheet)s
 </head>
 <body >
 <script language="javascript" type="text/javascript">
 
-    $(function(){
-        // 修改 失败 和 错误 用例里对应按钮的颜色ClassName为动态加载 -- Gelomen
-    	$("button").each(function () {
-    	    var text = $(this).text();
-    	    if(text == "失败"){
-    	        $(this).addClass("btn-danger")
-            }else if(text == "错误") {
-                $(this).addClass("btn-warning")
-            }
-        });
-
-        // 给失败和错误合集加样式 -- Gelomen
-        var p_attribute = $("p.attribute");
-        p_attribute.eq(4).addClass("failCollection");
-        p_attribute.eq(5).addClass("errorCollection");
-
+    // 统计、饼图和按钮颜色在生成报告时已经写好，jQuery 和 bootstrap 延迟加载，只用于交互
+    document.addEventListener("DOMContentLoaded", function(){
         // 打开截图，放大，点击任何位置可以关闭图片  -- Gelomen
         $(".screenshot").click(function(){
             var img = $(this).attr("img");
@@ -374,77 +491,6 @@ class Template_mixin(object):
             $("html,body").animate({"scrollTop":0}, 700)
         })
         
-        // 增加饼状图  -- Gelomen
-        $('#container').highcharts({
-            chart: {
-                plotBackgroundColor: null,
-                plotBorderWidth: null,
-                plotShadow: false,
-                spacing : [0, 0, 0, 0]
-            },
-            credits: {
-                enabled: false
-            },
-            navigation: {
-                buttonOptions: {
-                    enabled: false
-                }
-            },
-            title: {
-                floating:true,
-                text: '测试结果占比'
-            },
-            tooltip: {
-                pointFormat: '{series.name}: <b>{point.percentage:.1f}%%</b>'
-            },
-            plotOptions: {
-                pie: {
-                    allowPointSelect: true,
-                    cursor: 'pointer',
-                    colors: ['#81ca9d', '#f16d7e', '#fdc68c'],
-                    dataLabels: {
-                        enabled: true,
-                        format: '<b>{point.name}</b>: {point.percentage:.1f} %%',
-                        style: {
-                            color: (Highcharts.theme && Highcharts.theme.contrastTextColor) || 'black'
-                        }
-                    },
-                    point: {
-                        events: {
-                            mouseOver: function(e) {  // 鼠标滑过时动态更新标题
-                                chart.setTitle({
-                                    text: e.target.name+ '\t'+ e.target.y + ' 个'
-                                });
-                            }
-                        }
-                    }
-                }
-            },
-            series: [{
-                type: 'pie',
-                innerSize: '80%%',
-                name: '比例',
-                data: [
-                    ['通过', %(Pass)s],
-                    {
-                        name: '失败',
-                        y: %(fail)s,
-                        sliced: true,
-                        selected: true
-                    },
-                    ['错误', %(error)s]
-                ]
-            }]
-        }, function(c) {
-            // 环形图圆心
-            var centerY = c.series[0].center[1],
-                titleHeight = parseInt(c.title.styles.fontSize);
-            c.setTitle({
-                y:centerY + titleHeight/2
-            });
-            chart = c;
-        });
-        
         // 查看 失败 和 错误 合集链接文字切换  -- Gelomen
         $(".showDetail").click(function () {
             if($(this).html() == "点击查看"){
@@ -464,6 +510,8 @@ output_list = Array();
 2:Pass    //pt none, ft&et hiddenRow
 3:Error   //pt&ft hiddenRow, et none
 4:All     //all none
+5:Flaky   //rt none, others hiddenRow (通过 也会显示 rt)
+6:NotRun  //nt none, others hiddenRow
 */
 function showCase(level) {
     trs = document.getElementsByTagName("tr");
@@ -471,7 +519,7 @@ function showCase(level) {
         tr = trs[i];
         id = tr.id;
         if (id.substr(0,2) == 'ft') {
-            if (level == 2 || level == 0 || level == 3) {
+            if (level == 2 || level == 0 || level == 3 || level == 5 || level == 6) {
                 tr.className = 'hiddenRow';
             }
             else {
@@ -482,7 +530,7 @@ function showCase(level) {
             }
         }
         if (id.substr(0,2) == 'pt') {
-            if (level == 1 || level == 0 || level == 3) {
+            if (level == 1 || level == 0 || level == 3 || level == 5 || level == 6) {
                 tr.className = 'hiddenRow';
             }
             else {
@@ -493,7 +541,7 @@ function showCase(level) {
             }
         }
         if (id.substr(0,2) == 'et') {
-            if (level == 1 || level == 0 || level == 2) {
+            if (level == 1 || level == 0 || level == 2 || level == 5 || level == 6) {
                 tr.className = 'hiddenRow';
             }
             else {
@@ -503,6 +551,26 @@ function showCase(level) {
                 $("div[id^='div_et']").attr("class", "collapse");
             }
         }
+        // 重试后通过的不稳定用例，在 通过、不稳定 和 所有 里显示
+        if (id.substr(0,2) == 'rt') {
+            if (level == 1 || level == 0 || level == 3 || level == 6) {
+                tr.className = 'hiddenRow';
+            }
+            else {
+                tr.className = '';
+                $("div[id^='div_rt']").attr("class", "collapse");
+            }
+        }
+        // 提前终止后没有执行的用例，只在 跳过/未执行 和 所有 里显示
+        if (id.substr(0,2) == 'nt') {
+            if (level == 4 || level == 6) {
+                tr.className = '';
+                $("div[id^='div_nt']").attr("class", "collapse");
+            }
+            else {
+                tr.className = 'hiddenRow';
+            }
+        }
     }
 
     //加入【详细】切换文字变化 --Findyou
@@ -534,6 +602,14 @@ function showClassDetail(cid, count) {
             if (!tr) {
                 tid = 'e' + tid0;
                 tr = document.getElementById(tid);
+                if (!tr) {
+                    tid = 'r' + tid0;
+                    tr = document.getElementById(tid);
+                    if (!tr) {
+                        tid = 'n' + tid0;
+                        tr = document.getElementById(tid);
+                    }
+                }
             }
         }
         id_list[i] = tid;
@@ -555,6 +631,122 @@ function showClassDetail(cid, count) {
     }
 }
 
+// 子测试的失败参数表格在第一次点击时生成，每次最多追加 100 行，避免一次创建上万个节点
+function showSubTests(tid) {
+    var div = document.getElementById('subtests_' + tid);
+    if (div.rendered) {
+        div.style.display = (div.style.display == 'none') ? '' : 'none';
+        return;
+    }
+    div.innerHTML = "<table class='table table-condensed table-bordered'><tbody><tr class='active'>"
+        + "<td>参数</td><td>结果</td><td>耗时</td><td>信息</td></tr></tbody></table>"
+        + "<a href=\"javascript:appendSubTests('" + tid + "')\">显示更多</a>";
+    div.rendered = true;
+    div.shown = 0;
+    appendSubTests(tid);
+}
+
+function appendSubTests(tid) {
+    var div = document.getElementById('subtests_' + tid);
+    var rows = subtest_data[tid] || [];
+    var end = Math.min(div.shown + 100, rows.length);
+    var html = [];
+    for (var i = div.shown; i < end; i++) {
+        var row = rows[i];
+        html.push("<tr class='" + (row[1] == 2 ? "errorCase" : "failCase") + "'><td>" + html_escape(row[0])
+            + "</td><td>" + (row[1] == 2 ? "错误" : "失败") + "</td><td>" + row[2] + "秒</td><td>"
+            + html_escape(row[3]) + "</td></tr>");
+    }
+    div.getElementsByTagName('tbody')[0].insertAdjacentHTML('beforeend', html.join(''));
+    div.shown = end;
+    div.getElementsByTagName('a')[0].style.display = (end < rows.length) ? '' : 'none';
+}
+
+// 聚类里重复的异常信息只保存一份，点击时才填进页面
+function showTraceback(tid, key) {
+    var div = document.getElementById('tb_' + tid);
+    if (!div.filled) {
+        div.textContent = traceback_data[key];
+        div.filled = true;
+    }
+    div.style.display = (div.style.display == 'none') ? '' : 'none';
+}
+
+function showTestRow(tid) {
+    var tr = document.getElementById(tid);
+    tr.className = '';
+    tr.scrollIntoView();
+}
+
+// 搜索：在生成报告时建好的 search_index 里按前缀查找每个词，取交集，不遍历页面元素
+var SEARCH_TOKEN = /[a-z0-9]+|[^\x00-\x7f\s\u3000-\u303f\uff00-\uffef]/g;
+var search_matches = [];
+
+function searchPrefix(token) {
+    var keys = search_index.keys;
+    var lo = 0, hi = keys.length;
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1;
+        if (keys[mid] < token) { lo = mid + 1; } else { hi = mid; }
+    }
+    var found = {};
+    for (var i = lo; i < keys.length && keys[i].lastIndexOf(token, 0) == 0; i++) {
+        // postings 是 [间隔, 连续行数, ...]，间隔从上一段的末尾算起
+        var runs = search_index.postings[i], doc = 0;
+        for (var j = 0; j < runs.length; j += 2) {
+            doc += runs[j];
+            for (var k = 0; k < runs[j + 1]; k++) {
+                found[doc++] = true;
+            }
+        }
+    }
+    return found;
+}
+
+function searchCases(query) {
+    var div = document.getElementById('search_result');
+    var tokens = (typeof search_index == 'undefined') ? null : query.toLowerCase().match(SEARCH_TOKEN);
+    search_matches = [];
+    if (!tokens) {
+        div.innerHTML = '';
+        return;
+    }
+    var result = searchPrefix(tokens[0]);
+    for (var i = 1; i < tokens.length; i++) {
+        var next = searchPrefix(tokens[i]), both = {};
+        for (var doc in result) {
+            if (next[doc]) { both[doc] = true; }
+        }
+        result = both;
+    }
+    for (var doc in result) {
+        search_matches.push(parseInt(doc));
+    }
+    search_matches.sort(function (a, b) { return a - b; });
+    var html = ["<p>找到 " + search_matches.length + " 个用例"
+        + (search_matches.length ? "，<a href='javascript:filterSearch()'>只显示这些用例</a>" : "") + "</p>"];
+    for (var i = 0; i < search_matches.length && i < 50; i++) {
+        var entry = search_index.docs[search_matches[i]];
+        html.push("<a href=\"javascript:showTestRow('" + entry[0] + "')\">" + html_escape(entry[1]) + "</a> ");
+    }
+    div.innerHTML = html.join('');
+}
+
+function filterSearch() {
+    showCase(0);
+    for (var i = 0; i < search_matches.length; i++) {
+        document.getElementById(search_index.docs[search_matches[i]][0]).className = '';
+    }
+}
+
+// 按级别过滤用例日志，只显示不低于所选级别的行
+function filterLogs(level) {
+    var lines = document.getElementsByClassName('logLine');
+    for (var i = 0; i < lines.length; i++) {
+        lines[i].style.display = (parseInt(lines[i].getAttribute('data-level')) >= parseInt(level)) ? '' : 'none';
+    }
+}
+
 function html_escape(s) {
     s = s.replace(/&/g,'&amp;');
     s = s.replace(/</g,'&lt;');
@@ -591,7 +783,7 @@ table       { font-size: 100%; }
 }
 
 /* --- 失败和错误合集样式 -- Gelomen --- */
-.failCollection, .errorCollection {
+.failCollection, .errorCollection, .slowCollection {
     width: 100px;
     float: left;
 }
@@ -601,6 +793,9 @@ table       { font-size: 100%; }
 #errorCaseOl li {
     color: orange
 }
+#slowCaseOl li {
+    color: #8a6d3b
+}
 
 /* --- 打开截图特效样式 -- Gelomen --- */
 .data-img{
@@ -661,12 +856,33 @@ table       { font-size: 100%; }
 .passCase   { color: #5cb85c; }
 .failCase   { color: #d9534f; font-weight: bold; }
 .errorCase  { color: #f0ad4e; font-weight: bold; }
+.flakyCase  { color: #5bc0de; font-weight: bold; }
+.notRunCase { color: #999; }
+.flakeRate  { color: #5bc0de; }
+.slowBadge  { margin-left: 5px; }
+.slowInfo   { color: #8a6d3b; }
+.leaseInfo  { color: #777; }
 .hiddenRow  { display: none; }
 .testcase   { margin-left: 2em; }
 .screenshot:link { text-decoration: none;color: deeppink; }
 .screenshot:visited { text-decoration: none;color: deeppink; }
 .screenshot:hover { text-decoration: none;color: darkcyan; }
 .screenshot:active { text-decoration: none;color: deeppink; }
+.thumb      { display: block; max-width: 160px; margin-top: 3px; border: 1px solid #ddd; cursor: pointer; }
+.subtests   { text-align: left; margin-top: 5px; }
+.subtests table { margin-top: 5px; margin-bottom: 5px; }
+.benchmarks { clear: both; }
+.timeline   { clear: both; overflow-x: auto; }
+.clusters   { clear: both; }
+.diffSection { clear: both; }
+.clusterMembers { text-align: left; margin-top: 5px; }
+#search_box { width: 400px; }
+#search_result { margin-bottom: 10px; }
+.tracebackRef { text-align: left; font-family: monospace; white-space: pre-wrap; }
+.logs       { text-align: left; margin-top: 5px; font-family: monospace; font-size: 90%; white-space: pre-wrap; }
+.logDEBUG   { color: #999; }
+.logWARNING { color: #f0ad4e; }
+.logERROR, .logCRITICAL { color: #d9534f; }
 </style>
 """
 
@@ -675,34 +891,68 @@ table       { font-size: 100%; }
     #
 
     # 添加显示截图 和 饼状图 的div  -- Gelomen
-    HEADING_TMPL = """<div class='pic_looper'></div> <div class='pic_show'><div class='pic_box'><img src=''/></div> </div>
+    HEADING_TMPL = """<div class='pic_looper'></div> <div class='pic_show'><div class='pic_box'><img/></div> </div>
 <div class='heading'>
 <div style="width: 650px; float: left;">
     <h1 style="font-family: Microsoft YaHei">%(title)s</h1>
     %(parameters)s
     <p class='description'>%(description)s</p>
 </div>
-<div id="container"></div>
+<div id="container">%(chart)s</div>
 </div>
 
-"""  # variables: (title, parameters, description)
+"""  # variables: (title, parameters, description, chart)
 
     HEADING_ATTRIBUTE_TMPL = """<p class='attribute'><strong>%(name)s : </strong> %(value)s</p>
 """  # variables: (name, value)
 
+    # 失败、错误、变慢用例合集，样式类在生成时写好，不再由 JS 按位置添加
+    HEADING_COLLECTION_TMPL = """<p class='attribute %(Class)s'><strong>%(name)s : </strong> %(value)s</p>
+"""  # variables: (Class, name, value)
+
+    # 测试结果占比的环形图，生成报告时直接画成 SVG，不依赖 JS
+    CHART_TMPL = """<svg xmlns="http://www.w3.org/2000/svg" width="450" height="300" viewBox="0 0 450 300">
+<circle cx="150" cy="150" r="%(radius)s" fill="none" stroke="#eee" stroke-width="36"/>
+%(slices)s
+<text x="150" y="142" text-anchor="middle" font-size="15">测试结果占比</text>
+<text x="150" y="170" text-anchor="middle" font-size="22" font-weight="bold">%(passrate)s</text>
+%(legend)s
+</svg>"""  # variables: (radius, slices, passrate, legend)
+
+    CHART_SLICE_TMPL = """<circle cx="150" cy="150" r="%(radius)s" fill="none" stroke="%(color)s" stroke-width="36" stroke-dasharray="%(length).2f %(gap).2f" stroke-dashoffset="%(offset).2f" transform="rotate(-90 150 150)"><title>%(name)s %(count)s 个（%(percent).1f%%）</title></circle>
+"""  # variables: (radius, color, length, gap, offset, name, count, percent)
+
+    CHART_LEGEND_TMPL = """<rect x="300" y="%(y)s" width="14" height="14" fill="%(color)s"/><text x="322" y="%(text_y)s" font-size="14">%(name)s %(count)s 个（%(percent).1f%%）</text>
+"""  # variables: (y, text_y, color, name, count, percent)
+
     # ------------------------------------------------------------------------
     # Report
     #
     # 汉化,加美化效果 --Findyou
     REPORT_TMPL = """
-<div style="width: 500px; clear: both;">
+<div style="width: 600px; clear: both;">
 <p id='show_detail_line'>
 <a class="btn btn-primary" href='javascript:showCase(0)'>概要{ %(passrate)s }</a>
 <a class="btn btn-success" href='javascript:showCase(2)'>通过{ %(Pass)s }</a>
 <a class="btn btn-danger" href='javascript:showCase(1)'>失败{ %(fail)s }</a>
 <a class="btn btn-warning" href='javascript:showCase(3)'>错误{ %(error)s }</a>
+<a class="btn btn-default" href='javascript:showCase(5)'>不稳定{ %(flaky)s }</a>
+<a class="btn btn-default" href='javascript:showCase(6)'>跳过/未执行{ %(not_run)s }</a>
 <a class="btn btn-info" href='javascript:showCase(4)'>所有{ %(count)s }</a>
 </p>
+<p id='log_level_line'>日志级别：
+<select id='log_level' onchange='filterLogs(this.value)'>
+<option value='10'>DEBUG</option>
+<option value='20'>INFO</option>
+<option value='30'>WARNING</option>
+<option value='40'>ERROR</option>
+<option value='50'>CRITICAL</option>
+</select>
+</p>
+<p id='search_line'>
+<input id='search_box' type='text' class='form-control' placeholder='搜索用例名、说明、错误信息' oninput='searchCases(this.value)'/>
+</p>
+<div id='search_result'></div>
 </div>
 <table id='result_table' class="table table-condensed table-bordered table-hover">
 <colgroup>
@@ -736,7 +986,7 @@ table       { font-size: 100%; }
     <td>通过率：%(passrate)s</td>
 </tr>
 </table>
-"""  # variables: (test_list, count, Pass, fail, error ,passrate)
+"""  # variables: (test_list, count, Pass, fail, error, flaky, not_run, passrate)
 
     REPORT_CLASS_TMPL = r"""
 <tr class='%(style)s warning'>
@@ -762,12 +1012,14 @@ table       { font-size: 100%; }
     <div id='div_%(tid)s' class="collapse">  -->
 
     <!-- 默认展开错误信息 -Findyou /  修复失败按钮的颜色 -- Gelomen -->
-    <button id='btn_%(tid)s' type="button"  class="btn btn-xs" data-toggle="collapse" data-target='#div_%(tid)s,#div_%(tid)s_screenshot'>%(status)s</button>
+    <button id='btn_%(tid)s' type="button"  class="btn btn-xs %(button)s" data-toggle="collapse" data-target='#div_%(tid)s,#div_%(tid)s_screenshot'>%(status)s</button>
     <div id='div_%(tid)s' class="collapse in">
     <pre style="text-align:left">
     %(script)s
     </pre>
     </div>
+    %(subtests)s
+    %(logs)s
     </td>
     <td class="text-center" style="vertical-align: middle"><div id='div_%(tid)s_screenshot' class="collapse in">浏览器版本：<div style="color: brown;">%(browser)s</div></br>截图：%(screenshot)s</div></td>
 </tr>
@@ -784,12 +1036,14 @@ table       { font-size: 100%; }
         <div id='div_%(tid)s' class="collapse">  -->
 
         <!-- 默认展开错误信息 -Findyou /  修复失败按钮的颜色 -- Gelomen -->
-        <button id='btn_%(tid)s' type="button"  class="btn btn-xs" data-toggle="collapse" data-target='#div_%(tid)s'>%(status)s</button>
+        <button id='btn_%(tid)s' type="button"  class="btn btn-xs %(button)s" data-toggle="collapse" data-target='#div_%(tid)s'>%(status)s</button>
         <div id='div_%(tid)s' class="collapse in">
         <pre style="text-align:left">
         %(script)s
         </pre>
         </div>
+        %(subtests)s
+        %(logs)s
         </td>
         <td class='%(style)s' style="vertical-align: middle"></td>
     </tr>
@@ -800,15 +1054,188 @@ table       { font-size: 100%; }
 <tr id='%(tid)s' class='%(Class)s'>
     <td class='%(style)s' style="vertical-align: middle"><div class='testcase'>%(name)s</div></td>
     <td style="vertical-align: left">%(doc)s</td>
-    <td colspan='5' align='center'><span class="label label-success success">%(status)s</span></td>
+    <td colspan='5' align='center'><span class="label %(label)s">%(status)s</span>%(subtests)s%(logs)s</td>
     <td class='%(style)s' style="vertical-align: middle"></td>
 </tr>
-"""  # variables: (tid, Class, style, desc, status)
+"""  # variables: (tid, Class, style, desc, status, label)
 
     REPORT_TEST_OUTPUT_TMPL = r"""
 %(id)s: %(output)s
 """  # variables: (id, output)
 
+    # 子测试汇总：只显示计数，失败参数表格在点击时才由 showSubTests() 生成
+    REPORT_SUBTEST_TMPL = r"""
+<div class='subtests'>子测试：共 %(count)s，<span class='passCase'>通过 %(Pass)s</span>，<span class='failCase'>失败 %(fail)s</span>，<span class='errorCase'>错误 %(error)s</span>，耗时 %(time_usage)s秒
+%(toggle)s
+<div id='subtests_%(tid)s'></div>
+</div>
+"""  # variables: (tid, count, Pass, fail, error, time_usage, toggle)
+
+    # 失败聚类：每个原因一行，展开后显示一份异常信息和所有用例的链接
+    REPORT_CLUSTER_TMPL = r"""
+<div class='clusters'>
+<h3>失败聚类</h3>
+<table id='cluster_table' class="table table-condensed table-bordered">
+<tr class="text-center success" style="font-weight: bold;font-size: 14px;">
+    <td>#</td>
+    <td>原因</td>
+    <td>结果</td>
+    <td>用例数</td>
+    <td>详细</td>
+</tr>
+%(rows)s
+</table>
+</div>
+"""  # variables: (rows)
+
+    REPORT_CLUSTER_ROW_TMPL = r"""
+<tr id='cluster_%(cid)s' class="text-center">
+    <td>%(cid)s</td>
+    <td class='text-left %(style)s'>%(title)s</td>
+    <td>%(status)s</td>
+    <td>%(count)s</td>
+    <td><a data-toggle="collapse" href='#cluster_detail_%(cid)s'>展开</a></td>
+</tr>
+<tr id='cluster_detail_%(cid)s' class='collapse'>
+    <td colspan='5'>%(traceback)s<div class='clusterMembers'>%(members)s</div></td>
+</tr>
+"""  # variables: (cid, style, title, status, count, traceback, members)
+
+    REPORT_CLUSTER_MEMBER_TMPL = r"""<a href="javascript:showTestRow('%(tid)s')">%(name)s</a> """  # variables: (tid, name)
+
+    REPORT_TRACEBACK_REF_TMPL = r"""<a href="javascript:showTraceback('%(tid)s','%(key)s')" class="tracebackToggle">查看异常信息（失败聚类 #%(cid)s）</a><div id='tb_%(tid)s' class='tracebackRef' style="display: none"></div>"""  # variables: (tid, key, cid)
+
+    REPORT_SEARCH_DATA_TMPL = r"""
+<script type="text/javascript">
+search_index = %(data)s;
+</script>
+"""  # variables: (data)
+
+    REPORT_TRACEBACK_DATA_TMPL = r"""
+<script type="text/javascript">
+traceback_data = %(data)s;
+</script>
+"""  # variables: (data)
+
+    # 差异报告：每个分类一个表格
+    DIFF_SECTION_TMPL = r"""
+<div class='diffSection'>
+<h3>%(name)s（%(count)s）</h3>
+<table class="table table-condensed table-bordered table-hover">
+<tr class="text-center success" style="font-weight: bold;font-size: 14px;">
+    <td>测试用例</td>
+    <td>说明</td>
+    <td>旧结果</td>
+    <td>新结果</td>
+    <td>旧耗时</td>
+    <td>新耗时</td>
+    <td>变化</td>
+    <td>错误信息</td>
+</tr>
+%(rows)s
+</table>
+</div>
+"""  # variables: (name, count, rows)
+
+    DIFF_ROW_TMPL = r"""
+<tr>
+    <td class='%(style)s'>%(name)s</td>
+    <td>%(doc)s</td>
+    <td class="text-center">%(old)s</td>
+    <td class="text-center">%(new)s</td>
+    <td class="text-center">%(old_time)s</td>
+    <td class="text-center">%(new_time)s</td>
+    <td class="text-center">%(change)s</td>
+    <td>%(error)s</td>
+</tr>
+"""  # variables: (style, name, doc, old, new, old_time, new_time, change, error)
+
+    # 用例日志：每行带级别，由 filterLogs() 按所选级别显示或隐藏
+    REPORT_LOG_TMPL = r"""<div class='logs'>%(lines)s</div>"""  # variables: (lines)
+
+    REPORT_LOG_LINE_TMPL = r"""<div class='logLine log%(levelname)s' data-level='%(level)s'>%(text)s</div>"""  # variables: (level, levelname, text)
+
+    REPORT_SUBTEST_TOGGLE_TMPL = r"""<a href="javascript:showSubTests('%(tid)s')" class="subtestToggle">查看失败参数</a>"""
+
+    REPORT_SUBTEST_DATA_TMPL = r"""
+<script type="text/javascript">
+subtest_data = %(data)s;
+</script>
+"""  # variables: (data)
+
+    # 时间线：每个进程或异步并发的通道一行，关键路径的用例加黑边，下方是同时执行的用例数
+    REPORT_TIMELINE_TMPL = r"""
+<div class='timeline'>
+<h3>执行时间线</h3>
+<p>总耗时 %(makespan)s秒，用例累计耗时 %(busy)s秒，平均并发 %(parallelism)s，最大并发 %(peak)s；关键路径（黑边）%(critical_count)s 个用例 %(critical)s秒，其中空闲 %(idle)s秒</p>
+<svg xmlns="http://www.w3.org/2000/svg" width="960" height="%(height)s">
+%(ticks)s
+%(labels)s
+%(bars)s
+<line x1="100" y1="%(base)s" x2="%(right)s" y2="%(base)s" stroke="#999"/>
+<text x="95" y="%(peak_y)s" text-anchor="end" font-size="11">%(peak)s</text>
+<text x="95" y="%(base)s" text-anchor="end" font-size="11">并发</text>
+<polyline points="%(points)s" fill="none" stroke="#5bc0de" stroke-width="1.5"/>
+</svg>
+</div>
+"""  # variables: (makespan, busy, parallelism, peak, critical, critical_count, idle, height, labels, ticks, bars, points, base, peak_y, right)
+
+    TIMELINE_LABEL_TMPL = """<text x="95" y="%(y)s" text-anchor="end" font-size="11">%(name)s</text>
+"""  # variables: (y, name)
+
+    TIMELINE_TICK_TMPL = """<line x1="%(x).1f" y1="12" x2="%(x).1f" y2="%(y2)s" stroke="#eee"/><text x="%(text_x).1f" y="10" font-size="10" fill="#777">%(label)s</text>
+"""  # variables: (x, text_x, y2, label)
+
+    TIMELINE_BAR_TMPL = """<rect x="%(x).1f" y="%(y)s" width="%(width).1f" height="12" fill="%(color)s"%(stroke)s><title>%(title)s</title></rect>
+"""  # variables: (x, y, width, color, stroke, title)
+
+    # 性能：benchmark() 的统计及与基线的比较
+    BENCHMARK_STYLE = {'通过': 'passCase', '回退': 'failCase', '变快': 'flakyCase'}
+
+    REPORT_BENCHMARK_TMPL = r"""
+<div class='benchmarks'>
+<h3>性能</h3>
+<table id='benchmark_table' class="table table-condensed table-bordered table-hover">
+<tr class="text-center success" style="font-weight: bold;font-size: 14px;">
+    <td>测试用例</td>
+    <td>名称</td>
+    <td>轮数 × 次数</td>
+    <td>平均</td>
+    <td>标准差</td>
+    <td>最小</td>
+    <td>中位数</td>
+    <td>P90</td>
+    <td>P99</td>
+    <td>ops/s</td>
+    <td>基线平均</td>
+    <td>变化</td>
+    <td>p 值</td>
+    <td>状态</td>
+</tr>
+%(rows)s
+</table>
+</div>
+"""  # variables: (rows)
+
+    REPORT_BENCHMARK_ROW_TMPL = r"""
+<tr class="text-center">
+    <td class="text-left">%(test)s</td>
+    <td>%(name)s</td>
+    <td>%(rounds)s</td>
+    <td>%(mean)s</td>
+    <td>%(stdev)s</td>
+    <td>%(min)s</td>
+    <td>%(median)s</td>
+    <td>%(p90)s</td>
+    <td>%(p99)s</td>
+    <td>%(ops)s</td>
+    <td>%(baseline)s</td>
+    <td>%(change)s</td>
+    <td>%(p)s</td>
+    <td class='%(style)s'>%(status)s</td>
+</tr>
+"""  # variables: (style, test, name, rounds, mean, stdev, min, median, p90, p99, ops, baseline, change, p, status)
+
     # ------------------------------------------------------------------------
     # ENDING
     #
@@ -819,12 +1246,492 @@ table       { font-size: 100%; }
     </span></a></div>
     """
 
+    def _generate_chart(self, Pass, fail, error, flaky, not_run=0, radius=100):
+        Pass, fail, error, flaky, not_run = int(Pass), int(fail), int(error), int(flaky), int(not_run)
+        total = Pass + fail + error + flaky + not_run
+        circumference = 2 * math.pi * radius
+        slices, legend, offset = [], [], 0.0
+        parts = [('通过', Pass), ('失败', fail), ('错误', error), ('不稳定', flaky)]
+        # 只有提前终止的运行才显示 未执行
+        if not_run:
+            parts.append(('未执行', not_run))
+        for i, (name, count) in enumerate(parts):
+            percent = total and count * 100.0 / total or 0.0
+            values = dict(radius=radius, color=self.CHART_COLORS[i], name=name, count=count, percent=percent)
+            if count:
+                length = circumference * count / total
+                slices.append(self.CHART_SLICE_TMPL % dict(values, length=length, gap=circumference - length,
+                                                           offset=-offset))
+                offset += length
+            legend.append(self.CHART_LEGEND_TMPL % dict(values, y=95 + i * 30, text_y=107 + i * 30))
+        # 重试后通过的不稳定用例也算通过，未执行的不计入，和 通过率 的算法一致
+        total -= not_run
+        passrate = total and "%.2f%%" % ((Pass + flaky) * 100.0 / total) or "0.00%"
+        return self.CHART_TMPL % dict(radius=radius, slices=''.join(slices), passrate=passrate, legend=''.join(legend))
+
 # -------------------- The end of the Template class -------------------
 
 
 TestResult = unittest.TestResult
 
 
+# 数据驱动的用例可能有上万个子测试，按列保存，失败的才额外保存异常信息
+class _SubTestTable(object):
+    """ Columnar record of the subtests of one test: parameters, status and duration. """
+
+    def __init__(self):
+        self.params = []
+        self.status = bytearray()
+        self.durations = array.array("d")
+        # 下标 -> 异常信息，只保存失败和错误的子测试
+        self.errors = {}
+
+    def add(self, params, n, duration, exc_str=None):
+        if exc_str is not None:
+            self.errors[len(self.status)] = exc_str
+        self.params.append(params)
+        self.status.append(n)
+        self.durations.append(duration)
+
+    def counts(self):
+        """ 返回 (通过, 失败, 错误) 的个数 """
+        return self.status.count(0), self.status.count(1), self.status.count(2)
+
+    def summary(self):
+        np, nf, ne = self.counts()
+        lines = ["子测试：共 %s 个，通过 %s，失败 %s，错误 %s" % (len(self.status), np, nf, ne)]
+        if self.errors:
+            first = min(self.errors)
+            lines.append("首个失败的子测试 %s：" % self.params[first])
+            lines.append(self.errors[first])
+        return "\n".join(lines)
+
+    def failed_rows(self):
+        """ 失败和错误的子测试：[参数, 状态, 耗时, 异常信息的最后一行] """
+        rows = []
+        for i in sorted(self.errors):
+            lines = [line for line in self.errors[i].splitlines() if line.strip()]
+            rows.append([self.params[i], self.status[i], round(self.durations[i], 3), lines and lines[-1] or ""])
+        return rows
+
+
+def _format_seconds(seconds):
+    """ 按数量级选择单位显示耗时 """
+    if seconds >= 1:
+        return "%.3fs" % seconds
+    if seconds >= 1e-3:
+        return "%.3fms" % (seconds * 1e3)
+    if seconds >= 1e-6:
+        return "%.3fµs" % (seconds * 1e6)
+    return "%.1fns" % (seconds * 1e9)
+
+
+class TestTimeoutError(Exception):
+    """ 用例执行超过了超时预算，由看门狗在卡住的位置抛出 """
+
+    message = ""
+
+    def __str__(self):
+        return self.args and str(self.args[0]) or self.message
+
+
+def timeout(seconds):
+    """
+    Set the timeout budget in seconds of one test (decorating a test method)
+    or of every test of a class (decorating the class).
+    """
+    def decorator(obj):
+        obj.__test_timeout__ = seconds
+        return obj
+    return decorator
+
+
+def class_timeout(seconds):
+    """ Set the total timeout budget in seconds of all tests of a class. """
+    def decorator(cls):
+        cls.__class_timeout__ = seconds
+        return cls
+    return decorator
+
+
+def resources(*names):
+    """
+    Declare the shared resources (e.g. "browser", "db") a test method or
+    every test of a class uses. The runner's resource_limits caps how many
+    tests holding each resource run at the same time.
+    """
+    def decorator(obj):
+        obj.__test_resources__ = tuple(sorted(set(getattr(obj, "__test_resources__", ())) | set(names)))
+        return obj
+    return decorator
+
+
+def _test_resources(test):
+    """ 用例声明的资源：类上的 __test_resources__ 和测试方法上的合并 """
+    method = getattr(test, getattr(test, "_testMethodName", ""), None)
+    names = set(getattr(test.__class__, "__test_resources__", ())) | set(getattr(method, "__test_resources__", ()))
+    return tuple(sorted(names))
+
+
+def _check_resource_limits(limits):
+    for name, limit in (limits or {}).items():
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError("resource limit of %r must be a positive integer, got %r" % (name, limit))
+    return dict(limits or {})
+
+
+# 提前终止：环境坏掉时不必等所有用例各自超时
+class _AbortPolicy(object):
+    """
+    Decide when a run should stop early: after `max_failures` failures and
+    errors in total, or once more than `max_failure_rate` (0-1) of the last
+    `window` tests failed. record() returns the reason when a limit is hit.
+    """
+
+    def __init__(self, max_failures=None, max_failure_rate=None, window=20):
+        self.max_failures = max_failures
+        self.max_failure_rate = max_failure_rate
+        self.window = max(1, window)
+        self.failures = 0
+        self.recent = collections.deque(maxlen=self.window)
+
+    def record(self, n):
+        failed = n in (1, 2)
+        self.failures += failed
+        self.recent.append(failed)
+        if self.max_failures and self.failures >= self.max_failures:
+            return "失败和错误的用例达到 %s 个，提前终止" % self.failures
+        if self.max_failure_rate is not None and len(self.recent) == self.window:
+            rate = float(sum(self.recent)) / self.window
+            if rate > self.max_failure_rate:
+                return "最近 %s 个用例中失败和错误占 %.0f%%，超过 %.0f%%，提前终止" % (
+                    self.window, rate * 100, self.max_failure_rate * 100)
+        return None
+
+
+def _test_budget(test, timeout=None, class_timeout=None, class_used=0):
+    """
+    Return (seconds, reason) for one test: its own budget (@timeout or the
+    default `timeout`) or what is left of its class budget after
+    `class_used` seconds, whichever is smaller; (None, "") without a budget.
+    """
+    cls = test.__class__
+    method = getattr(test, getattr(test, "_testMethodName", ""), None)
+    seconds = getattr(method, "__test_timeout__", None) or getattr(cls, "__test_timeout__", None) or timeout
+    reason = seconds and "用例执行超过 %s 秒" % seconds or ""
+    class_seconds = getattr(cls, "__class_timeout__", None) or class_timeout
+    if class_seconds:
+        remaining = class_seconds - class_used
+        if seconds is None or remaining < seconds:
+            # 预算已经用完时也要给一个很小的值，setitimer(0) 表示取消
+            seconds = max(remaining, 0.001)
+            reason = "用例类 %s 的超时预算 %s 秒已用完" % (cls.__name__, class_seconds)
+    return seconds, reason
+
+
+# 超时看门狗：主线程里用 SIGALRM 打断卡住的用例，没有 SIGALRM（Windows）或不在主线程时改用线程异步抛异常
+class _Watchdog(object):
+    """
+    Per-test and per-class timeout budgets.
+
+    start() arms a one-shot timer for the remaining budget of the test; when
+    it fires, TestTimeoutError is raised in the stuck frame, so unittest
+    records an error whose traceback ends where the test hung, runs tearDown
+    and goes on with the next test. The error is only raised while setUp,
+    the test method or tearDown is running, where unittest catches it, never
+    in unittest's own result handling. While the test has not stopped, the
+    timer is re-armed for `grace` seconds so a hung tearDown is interrupted
+    as well.
+
+    Interrupting relies on TestCase._callSetUp, _callTestMethod and
+    _callTearDown (Python 3.8+); without them a RuntimeWarning is issued and
+    tests are not interrupted.
+
+    The thread fallback (no SIGALRM, or not in the main thread) is best
+    effort: PyThreadState_SetAsyncExc is only checked between Python
+    bytecodes, so a test blocked in C (a socket read without a timeout, a
+    lock, a sleep) is interrupted only when that call returns, if it ever
+    does. Use worker mode for such tests: a stuck worker is killed.
+    """
+
+    def __init__(self, timeout=None, class_timeout=None, grace=5.0, dump_file=None):
+        self.timeout = timeout
+        self.class_timeout = class_timeout
+        self.grace = grace
+        # 工作进程里使用：超过预算还没结束时由 faulthandler 把调用栈写进这个文件，供主进程读取
+        self.dump_file = dump_file
+        self.class_spent = {}
+        self.test = None
+        self.start_time = None
+        self.reason = ""
+        self.timer = None
+        self.thread_id = None
+        self.use_signal = False
+        # 是否正处在 setUp/测试方法/tearDown 里，只有这时抛出的异常会被 unittest 记为错误
+        self.in_part = False
+        # 线程方式下 stop() 与计时器线程之间的锁
+        self.lock = threading.Lock()
+        # 缺少 GUARDED_PARTS 时只警告一次
+        self.warned = False
+
+    @staticmethod
+    def needed(timeout, class_timeout, tests=()):
+        """ 是否需要看门狗：设置了默认预算，或有用例用 @timeout/@class_timeout 设置了预算 """
+        return bool(timeout or class_timeout or any(_test_budget(t)[0] for t in tests))
+
+    def budget(self, test):
+        """ 返回 (秒数, 原因)，没有预算时返回 (None, "") """
+        return _test_budget(test, self.timeout, self.class_timeout, self.class_spent.get(test.__class__, 0))
+
+    # 只在这些方法里打断；doCleanups 自己在多个清理函数之间不受 unittest 保护
+    GUARDED_PARTS = ("_callSetUp", "_callTestMethod", "_callTearDown")
+    # 到点时不在这些方法里（例如刚进入 startTest），隔这么久再看一次
+    RETRY_DELAY = 0.05
+
+    def start(self, test):
+        seconds, self.reason = self.budget(test)
+        self.test = test
+        self.start_time = time.time()
+        self.in_part = False
+        self.use_signal = False
+        if not seconds:
+            return None
+        if self.dump_file is not None:
+            self.dump_file.seek(0)
+            self.dump_file.truncate()
+            faulthandler.dump_traceback_later(seconds + self.grace / 2, file=self.dump_file)
+        if isinstance(test, unittest.TestCase):
+            missing = [attr for attr in self.GUARDED_PARTS if not hasattr(test, attr)]
+            if missing:
+                # 没有这些方法时无法判断是否能安全地抛出异常，只计时不打断（工作进程仍会被主进程终止）
+                if not self.warned:
+                    self.warned = True
+                    warnings.warn("TestCase 没有 %s（需要 Python 3.8+），超时的用例不会被打断" % ", ".join(missing),
+                                  RuntimeWarning)
+                return seconds
+            for attr in self.GUARDED_PARTS:
+                setattr(test, attr, self._guarded(getattr(test, attr)))
+        self.use_signal = hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+        if self.use_signal:
+            signal.signal(signal.SIGALRM, self._on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, seconds)
+        else:
+            self.thread_id = threading.get_ident()
+            self._start_timer(seconds)
+        return seconds
+
+    def stop(self, test):
+        if self.test is None:
+            return
+        # 先清掉 self.test，之后到达的信号或计时器都不会再打断或重新计时
+        with self.lock:
+            self.test = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if self.use_signal:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        for attr in self.GUARDED_PARTS:
+            test.__dict__.pop(attr, None)
+        if self.dump_file is not None:
+            faulthandler.cancel_dump_traceback_later()
+        cls = test.__class__
+        self.class_spent[cls] = self.class_spent.get(cls, 0) + time.time() - self.start_time
+
+    def _guarded(self, function):
+        def wrapper(*args, **kwargs):
+            self.in_part = True
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.in_part = False
+        return wrapper
+
+    def _on_alarm(self, signum, frame):
+        if self.test is None:
+            return
+        if not self.in_part:
+            signal.setitimer(signal.ITIMER_REAL, self.RETRY_DELAY)
+            return
+        signal.setitimer(signal.ITIMER_REAL, self.grace)
+        raise TestTimeoutError(self.reason)
+
+    def _start_timer(self, seconds):
+        timer = threading.Timer(seconds, lambda: self._interrupt(timer))
+        timer.daemon = True
+        self.timer = timer
+        timer.start()
+
+    def _interrupt(self, timer):
+        with self.lock:
+            # stop() 已经执行，或者这是被替换掉的旧计时器
+            if self.test is None or self.timer is not timer:
+                return
+            if not self.in_part:
+                self._start_timer(self.RETRY_DELAY)
+                return
+            frame = sys._current_frames().get(self.thread_id)
+            stack = frame and "".join(traceback.format_stack(frame)) or ""
+            # PyThreadState_SetAsyncExc 只能传异常类，用一个带消息的子类
+            exc_type = type("TestTimeoutError", (TestTimeoutError,),
+                            {"message": "%s，卡住时的调用栈：\n%s" % (self.reason, stack)})
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self.thread_id), ctypes.py_object(exc_type))
+            self._start_timer(self.grace)
+
+
+# 性能用例：在用例里调用 benchmark(self, func)，结果挂在用例上，由 _TestResult.stopTest 收集进报告的“性能”部分
+def benchmark(test, func, args=(), kwargs=None, name=None, warmup=3, rounds=20, min_round_time=0.0002):
+    """
+    Time `func(*args, **kwargs)` inside a running test and return its
+    statistics as a dict (seconds): mean, stdev, min, max, median, p90, p99
+    and ops (calls per second).
+
+    After `warmup` untimed calls, the number of calls per round is doubled
+    until a round takes at least `min_round_time`, then `rounds` rounds are
+    timed with the garbage collector disabled, like timeit does. The result
+    is reported in the "性能" section and compared with the baseline given
+    to HTMLTestRunner(benchmark_baseline=...).
+    """
+    kwargs = kwargs or {}
+    for _ in range(warmup):
+        func(*args, **kwargs)
+    number = 1
+    while True:
+        elapsed = _time_calls(func, args, kwargs, number)
+        if elapsed >= min_round_time or number >= 1 << 20:
+            break
+        number *= 2
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        samples = [_time_calls(func, args, kwargs, number) / number for _ in range(rounds)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    stats = _benchmark_stats(samples)
+    stats.update(name=name or getattr(func, "__name__", "benchmark"), rounds=rounds, number=number)
+    if not hasattr(test, "_benchmarks"):
+        test._benchmarks = []
+    test._benchmarks.append(stats)
+    return stats
+
+
+def _time_calls(func, args, kwargs, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def _percentile(ordered, q):
+    """ 线性插值的百分位数，ordered 已排序 """
+    position = (len(ordered) - 1) * q / 100.0
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _benchmark_stats(samples):
+    ordered = sorted(samples)
+    n = len(ordered)
+    mean = sum(ordered) / n
+    stdev = n > 1 and math.sqrt(sum((x - mean) ** 2 for x in ordered) / (n - 1)) or 0.0
+    return {
+        "mean": mean,
+        "stdev": stdev,
+        "min": ordered[0],
+        "max": ordered[-1],
+        "median": _percentile(ordered, 50),
+        "p90": _percentile(ordered, 90),
+        "p99": _percentile(ordered, 99),
+        "ops": mean > 0 and 1.0 / mean or 0.0,
+        "samples": n,
+    }
+
+
+def _betainc(a, b, x):
+    """ 正则化不完全 Beta 函数 I_x(a, b)，连分式展开（Numerical Recipes betacf） """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        return 1.0 - _betainc(b, a, 1 - x)
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (abs(d) < tiny and tiny or d)
+    h = d
+    for m in range(1, 200):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (abs(d) < tiny and tiny or d)
+            c = 1.0 + numerator / c
+            c = abs(c) < tiny and tiny or c
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return front * h / a
+
+
+def _welch_test(current, baseline):
+    """ Welch t 检验，返回双侧 p 值；current 和 baseline 是含 mean、stdev、samples 的 dict """
+    n1, n2 = current["samples"], baseline["samples"]
+    v1 = current["stdev"] ** 2 / n1
+    v2 = baseline["stdev"] ** 2 / n2
+    diff = current["mean"] - baseline["mean"]
+    if v1 + v2 == 0:
+        return 0.0 if diff else 1.0
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    t = diff / math.sqrt(v1 + v2)
+    df = (v1 + v2) ** 2 / ((v1 ** 2 / (n1 - 1) if v1 else 0) + (v2 ** 2 / (n2 - 1) if v2 else 0))
+    return _betainc(df / 2.0, 0.5, df / (df + t * t))
+
+
+class BenchmarkBaseline(object):
+    """
+    Benchmark statistics of a reference run in a JSON file, keyed by
+    "<test id>::<benchmark name>". A benchmark is a regression when it is
+    slower than its baseline by more than `threshold` (relative) and the
+    Welch t-test p-value is below `alpha`.
+    """
+
+    def __init__(self, path, alpha=0.05, threshold=0.05):
+        self.path = path
+        self.alpha = alpha
+        self.threshold = threshold
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def compare(self, key, stats):
+        """ 返回 (状态, 相对变化, p 值, 基线平均)；没有基线时只返回状态“新增” """
+        base = self.entries.get(key)
+        if base is None:
+            return "新增", None, None, None
+        change = base["mean"] and (stats["mean"] - base["mean"]) / base["mean"] or 0.0
+        p = _welch_test(stats, base)
+        if p < self.alpha and change > self.threshold:
+            status = "回退"
+        elif p < self.alpha and change < -self.threshold:
+            status = "变快"
+        else:
+            status = "通过"
+        return status, change, p, base["mean"]
+
+    def update(self, key, stats):
+        self.entries[key] = dict((k, stats[k]) for k in ("mean", "stdev", "min", "median", "samples"))
+
+    def save(self):
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.path)
+
+
 class _TestResult(TestResult):
     # note: _TestResult is a pure representation of results.
     # It lacks the output and reporting ability compares to unittest._TextTestResult.
@@ -836,7 +1743,15 @@ class _TestResult(TestResult):
         self.success_count = 0
         self.failure_count = 0
         self.error_count = 0
+        # 重试后才通过的不稳定用例
+        self.flaky_count = 0
+        # 提前终止后没有执行的用例
+        self.not_run_count = 0
         self.verbosity = verbosity
+        # setUpClass 等类级别的异常不会经过 startTest，这里先给出默认值
+        self.outputBuffer = io.StringIO()
+        self.test_start_time = round(time.time(), 2)
+        self.test_end_time = None
 
         # result is a list of result in 4 tuple
         # (
@@ -854,6 +1769,47 @@ class _TestResult(TestResult):
         # 增加错误用例合集
         self.errorCase = ""
 
+        # 子测试按所属用例的 id 保存为 _SubTestTable
+        self.subtests = {}
+        self._subtest_mark = None
+        self._records_at_start = 0
+
+        # 超时看门狗，由 HTMLTestRunner 设置
+        self.watchdog = None
+
+        # 失败重试时每次执行的记录 {用例 id: [(结果代码, 输出, 异常, 耗时), ...]}，以及历史不稳定率 {用例 id: (不稳定次数, 运行次数)}
+        self.attempts = {}
+        self.flake_rates = {}
+        # 耗时明显超过历史基线的用例 {用例 id: (本次耗时, 历史中位数, 历史 MAD)}
+        self.slow_tests = {}
+
+        # 性能用例的统计 {用例 id: [benchmark() 返回的 dict, ...]}
+        self.benchmarks = {}
+        # WebDriverPool 的租用记录 {用例 id: {"wait": 等待秒数, "lease": 租用秒数, "created": 是否新建, "recycled": 回收个数}}
+        self.webdriver_leases = {}
+
+        # 日志捕获，由 HTMLTestRunner 设置；logs 为 {用例 id: [LogRecord 或 (级别, 已格式化的文本)]}
+        self.log_handler = None
+        self.log_records = []
+        self.logs = {}
+
+        # 时间线 {用例 id: [{"start", "end", "worker", "status", "phases": [(阶段, 开始, 结束)]}, ...]}，重试的每次执行各占一项
+        self.timeline = {}
+        # 只在并发执行或需要导出 trace 时记录（由 HTMLTestRunner 设置），串行执行时报告里不显示时间线
+        self.record_timeline = False
+        self.worker_name = "主进程"
+        self._timeline_start = None
+        self._timeline_end = None
+        self._timeline_phases = []
+
+        # 提前终止的策略，由 HTMLTestRunner 设置；触发后 abort_reason 为原因
+        self.abort_policy = None
+        self.abort_reason = None
+
+        # 覆盖记录，由 HTMLTestRunner 设置；coverage 为 {用例 id: 执行过的源文件（相对路径）}
+        self.file_tracer = None
+        self.coverage = {}
+
     def startTest(self, test):
         stream = sys.stderr
         # stdout_content = " Testing: " + str(test)
@@ -870,13 +1826,32 @@ class _TestResult(TestResult):
         sys.stdout = stdout_redirector
         sys.stderr = stderr_redirector
         self.test_start_time = round(time.time(), 2)
+        self.test_end_time = None
+        self._subtest_mark = time.time()
+        self._records_at_start = len(self.result)
+        self.log_records = []
+        if self.log_handler is not None:
+            self.log_handler.records = self.log_records
+        self._timeline_start = time.time()
+        self._timeline_end = None
+        self._timeline_phases = []
+        if self.record_timeline and isinstance(test, unittest.TestCase):
+            for name, attr in _TEST_PHASES:
+                if hasattr(test, attr):
+                    setattr(test, attr, _timed_phase(self._timeline_phases, name, getattr(test, attr)))
+        if self.file_tracer is not None:
+            self.file_tracer.begin(test)
+        if self.watchdog is not None:
+            self.watchdog.start(test)
 
     def complete_output(self):
         """
         Disconnect output redirection and return buffer.
         Safe to call multiple times.
         """
-        self.test_end_time = round(time.time(), 2)
+        # 异步模式回放结果时会预先写入任务自己的结束时间，此时不覆盖
+        if self.test_end_time is None:
+            self.test_end_time = round(time.time(), 2)
         if self.stdout0:
             sys.stdout = self.stdout0
             sys.stderr = self.stderr0
@@ -888,7 +1863,72 @@ class _TestResult(TestResult):
         # Usually one of addSuccess, addError or addFailure would have been called.
         # But there are some path in unittest that would bypass this.
         # We must disconnect stdout in stopTest(), which is guaranteed to be called.
+        if self.watchdog is not None:
+            self.watchdog.stop(test)
+        if self.file_tracer is not None:
+            files = self.file_tracer.end(test)
+            if files is not None:
+                self.coverage[test.id()] = files
+        benchmarks = getattr(test, "_benchmarks", None)
+        if benchmarks:
+            self.benchmarks.setdefault(test.id(), []).extend(benchmarks)
+            del test._benchmarks
+        lease = getattr(test, "_webdriver_lease", None)
+        if lease is not None:
+            self.webdriver_leases[test.id()] = lease
+            del test._webdriver_lease
+        # 有子测试失败时 unittest 不会为用例本身调用 add*，这里补一条汇总记录
+        table = self.subtests.get(test.id())
+        if table is not None and len(self.result) == self._records_at_start:
+            output = self.complete_output()
+            np, nf, ne = table.counts()
+            n = ne and 2 or (nf and 1 or 0)
+            use_time = round(self.test_end_time - self.test_start_time, 2)
+            self._append_record(n, test, output, table.summary(), use_time)
         self.complete_output()
+        if self.log_handler is not None:
+            self.log_handler.records = None
+            self._keep_logs(test)
+        if self.record_timeline:
+            self._keep_timeline(test)
+
+    def _keep_timeline(self, test):
+        for _, attr in _TEST_PHASES:
+            test.__dict__.pop(attr, None)
+        status = None
+        if len(self.result) > self._records_at_start:
+            status = self.result[-1][0]
+        self.timeline.setdefault(test.id(), []).append({
+            "start": self._timeline_start,
+            "end": self._timeline_end or time.time(),
+            "worker": self.worker_name,
+            "status": status,
+            "phases": self._timeline_phases,
+        })
+
+    def _keep_logs(self, test):
+        """ 失败或错误的用例保留所有日志，其他用例只保留 keep_level 及以上的 """
+        records = self.log_records
+        self.log_records = []
+        failed = len(self.result) > self._records_at_start and self.result[-1][0] in (1, 2)
+        if not failed:
+            records = [r for r in records if r.levelno >= self.log_handler.keep_level]
+        if records:
+            self.logs[test.id()] = records
+
+    def addSubTest(self, test, subtest, err):
+        # 不调用 TestResult.addSubTest，避免每个失败的子测试都进入 failures/errors，由 stopTest 汇总
+        now = time.time()
+        duration = now - self._subtest_mark
+        self._subtest_mark = now
+        if err is None:
+            n, exc_str = 0, None
+        else:
+            n = issubclass(err[0], test.failureException) and 1 or 2
+            exc_str = self._exc_info_to_string(err, test)
+            if self.failfast:
+                self.stop()
+        self.subtests.setdefault(test.id(), _SubTestTable()).add(subtest._subDescription(), n, duration, exc_str)
 
     def addSuccess(self, test):
         self.success_count += 1
@@ -896,13 +1936,8 @@ class _TestResult(TestResult):
         output = self.complete_output()
         use_time = round(self.test_end_time - self.test_start_time, 2)
         self.result.append((0, test, output, '', use_time))
-        if self.verbosity > 1:
-            sys.stderr.write('  S  ')
-            sys.stderr.write(str(test))
-            sys.stderr.write('\n')
-        else:
-            sys.stderr.write('  S  ')
-            sys.stderr.write('\n')
+        self._print_status('S', test)
+        self._check_abort(0)
 
     def addError(self, test, err):
         self.error_count += 1
@@ -911,13 +1946,8 @@ class _TestResult(TestResult):
         output = self.complete_output()
         use_time = round(self.test_end_time - self.test_start_time, 2)
         self.result.append((2, test, output, _exc_str, use_time))
-        if self.verbosity > 1:
-            sys.stderr.write('  E  ')
-            sys.stderr.write(str(test))
-            sys.stderr.write('\n')
-        else:
-            sys.stderr.write('  E  ')
-            sys.stderr.write('\n')
+        self._print_status('E', test)
+        self._check_abort(2)
 
         # 添加收集错误用例名字 -- Gelomen
         self.errorCase += "<li>" + str(test) + "</li>"
@@ -929,103 +1959,1529 @@ class _TestResult(TestResult):
         output = self.complete_output()
         use_time = round(self.test_end_time - self.test_start_time, 2)
         self.result.append((1, test, output, _exc_str, use_time))
+        self._print_status('F', test)
+        self._check_abort(1)
+
+        # 添加收集失败用例名字 -- Gelomen
+        self.failCase += "<li>" + str(test) + "</li>"
+
+    def _print_status(self, flag, test):
         if self.verbosity > 1:
-            sys.stderr.write('  F  ')
+            sys.stderr.write('  %s  ' % flag)
             sys.stderr.write(str(test))
             sys.stderr.write('\n')
         else:
-            sys.stderr.write('  F  ')
+            sys.stderr.write('  %s  ' % flag)
             sys.stderr.write('\n')
 
-        # 添加收集失败用例名字 -- Gelomen
-        self.failCase += "<li>" + str(test) + "</li>"
-
+    def addRecord(self, n, test, output, exc_str, use_time):
+        """
+        Add a result that was produced somewhere else, e.g. in a worker
+        process, where only the formatted output and traceback are known.
+        """
+        self.testsRun += 1
+        self._append_record(n, test, output, exc_str, use_time)
 
-# 新增 need_screenshot 参数，-1为无需截图，否则需要截图  -- Gelomen
-class HTMLTestRunner(Template_mixin):
+    def _append_record(self, n, test, output, exc_str, use_time):
+        if n == 0:
+            self.success_count += 1
+        elif n == 1:
+            self.failure_count += 1
+            self.failures.append((test, exc_str))
+            self.failCase += "<li>" + str(test) + "</li>"
+        elif n == 2:
+            self.error_count += 1
+            self.errors.append((test, exc_str))
+            self.errorCase += "<li>" + str(test) + "</li>"
+        elif n == 3:
+            self.flaky_count += 1
+        self.result.append((n, test, output, exc_str, use_time))
+        self._print_status("SFER"[n], test)
+        self._check_abort(n)
+
+    def _check_abort(self, n):
+        if self.abort_policy is None or self.shouldStop:
+            return
+        reason = self.abort_policy.record(n)
+        if reason:
+            self.abort_reason = reason
+            self.stop()
+
+    def addNotRun(self, test, reason):
+        """ 提前终止后没有执行的用例，报告里显示为“跳过/未执行” """
+        self.not_run_count += 1
+        self.result.append((4, test, "", reason, 0))
+
+    def replaceRecord(self, index, n, output, exc_str, use_time):
+        """ 用重试后的结果替换 self.result[index]，同时修正计数、failures/errors 和用例合集 """
+        old_n, test = self.result[index][:2]
+        item = "<li>" + str(test) + "</li>"
+        if old_n == 0:
+            self.success_count -= 1
+        elif old_n == 1:
+            self.failure_count -= 1
+            self.failures = [f for f in self.failures if f[0] is not test]
+            self.failCase = self.failCase.replace(item, "", 1)
+        elif old_n == 2:
+            self.error_count -= 1
+            self.errors = [f for f in self.errors if f[0] is not test]
+            self.errorCase = self.errorCase.replace(item, "", 1)
+        elif old_n == 3:
+            self.flaky_count -= 1
+        self.result[index] = (n, test, output, exc_str, use_time)
+        if n == 0:
+            self.success_count += 1
+        elif n == 1:
+            self.failure_count += 1
+            self.failures.append((test, exc_str))
+            self.failCase += item
+        elif n == 2:
+            self.error_count += 1
+            self.errors.append((test, exc_str))
+            self.errorCase += item
+        elif n == 3:
+            self.flaky_count += 1
+
+
+# 失败聚类：去掉异常信息里每次都会变的部分（地址、数字、id），同一签名的失败归为同一个原因；只用于异常信息，不用于调用栈
+_TRACEBACK_NOISE = [
+    (re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"), "<uuid>"),
+    (re.compile(r"0x[0-9a-fA-F]+"), "0x?"),
+    (re.compile(r"\b[0-9a-fA-F]{16,}\b"), "<id>"),
+    (re.compile(r"\d+(\.\d+)?"), "N"),
+]
+
+# 签名只取最里面的几层调用栈，调用方不同但原因相同的失败也能归到一起
+_SIGNATURE_FRAMES = 5
+
+
+def _failure_signature(exc_str):
+    """ 返回 (签名哈希, 标题)；只看异常链的最后一段，调用栈的 File 行原样保留，异常信息去掉变化的值 """
+    text = re.split(r"\n(?:During handling of the above exception|The above exception was the direct cause)[^\n]*\n",
+                    exc_str)[-1]
+    frames = []
+    message = []
+    for line in text.splitlines():
+        if line.startswith("  File "):
+            frames.append(line.strip())
+            message = []
+        elif line and not line.startswith(" ") and not line.startswith("Traceback"):
+            message.append(line)
+    normalized = "\n".join(message)
+    for pattern, replacement in _TRACEBACK_NOISE:
+        normalized = pattern.sub(replacement, normalized)
+    signature = "\n".join(frames[-_SIGNATURE_FRAMES:] + [normalized])
+    title = message and message[0] or (exc_str.strip().splitlines() or [""])[-1]
+    return hashlib.sha1(signature.encode("utf-8")).hexdigest()[:12], title
+
+
+def _error_summary(exc_str):
+    """ 异常信息的第一行，例如 “AssertionError: 1 != 2”；不是标准 traceback 时取最后一个非空行 """
+    summary = ""
+    in_frames = False
+    for line in exc_str.splitlines():
+        if line.startswith("  File ") or line.startswith("Traceback"):
+            in_frames = True
+            summary = ""
+        elif in_frames and line and not line.startswith(" ") and not summary:
+            summary = line
+    return summary or (exc_str.strip().splitlines() or [""])[-1]
+
+
+def _cluster_failures(records):
     """
+    Group the failures and errors of `records` (report tuples) by traceback
+    signature. Returns clusters, largest first, as dicts with keys: cid,
+    n (1 failure / 2 error), title, members [(test, exc_str)].
+    """
+    clusters = {}
+    # 同一个异常信息常常出现在多个用例里，签名只算一次
+    signatures = {}
+    for n, t, o, e, s in records:
+        if n not in (1, 2) or not e:
+            continue
+        if e not in signatures:
+            signatures[e] = _failure_signature(e)
+        signature, title = signatures[e]
+        cluster = clusters.get((n, signature))
+        if cluster is None:
+            cluster = clusters[(n, signature)] = {"n": n, "title": title, "members": []}
+        cluster["members"].append((t, e))
+    ordered = sorted(clusters.values(), key=lambda c: -len(c["members"]))
+    for i, cluster in enumerate(ordered):
+        cluster["cid"] = i + 1
+    return ordered
+
+
+# 搜索索引的分词：连续的英文字母和数字为一个词，其他文字（如中文）每个字为一个词；页面里的 JS 使用同样的规则
+_SEARCH_TOKEN = re.compile(r"[a-z0-9]+|[^\x00-\x7f\s\u3000-\u303f\uff00-\uffef]")
+
+
+class _SearchIndex(object):
+    """
+    Search index embedded in the report. Rows are added in report order
+    with add(); text shared by a range of rows (module, class name, class
+    doc) is added once for the range with add_group().
+
+    data() returns the docs [[row id, label]], the sorted token list and,
+    for each token, the rows that contain it as runs of consecutive row
+    numbers, encoded as [gap, length, gap, length, ...] where each gap
+    counts from the end of the previous run. Rows are grouped by class, so
+    most tokens cover a few long runs. The page answers a query by
+    binary-searching the tokens for each query word as a prefix and
+    intersecting the rows.
     """
 
-    def __init__(self, stream=sys.stdout, verbosity=2, title=None, description=None, tester=None):
-        self.need_screenshot = 0
-        self.stream = stream
-        self.verbosity = verbosity
-        if title is None:
-            self.title = self.DEFAULT_TITLE
-        else:
-            self.title = title
-        if description is None:
-            self.description = self.DEFAULT_DESCRIPTION
-        else:
-            self.description = description
-        if tester is None:
-            self.tester = self.DEFAULT_TESTER
+    def __init__(self):
+        self.docs = []
+        # {文字: [开始, 结束, 开始, 结束, ...]}，同一段文字在很多行里重复，最后每段只分词一次
+        self.part_runs = {}
+
+    def add(self, tid, label, parts):
+        row = len(self.docs)
+        self.docs.append([tid, label])
+        self._mark(parts, row, row + 1)
+
+    def add_group(self, start, parts):
+        """ parts 属于从第 start 行到目前最后一行的所有行 """
+        self._mark(parts, start, len(self.docs))
+
+    def _mark(self, parts, start, end):
+        for part in parts:
+            runs = self.part_runs.get(part)
+            if runs is None:
+                self.part_runs[part] = [start, end]
+            elif runs[-1] == start:
+                runs[-1] = end
+            elif runs[-1] < start:
+                runs += (start, end)
+            else:
+                # 与前面的段重叠：同一行里重复的文字，或者整组的文字在组内各行之后加入
+                runs[:] = _merge_runs(sorted(list(zip(runs[::2], runs[1::2])) + [(start, end)]))
+
+    def data(self):
+        token_runs = {}
+        for part, runs in self.part_runs.items():
+            for token in set(_SEARCH_TOKEN.findall(part.lower())):
+                token_runs.setdefault(token, []).append(runs)
+        keys = sorted(token_runs)
+        postings = []
+        for key in keys:
+            lists = token_runs[key]
+            runs = lists[0]
+            if len(lists) > 1:
+                runs = _merge_runs(sorted(pair for flat in lists for pair in zip(flat[::2], flat[1::2])))
+            encoded = []
+            last = 0
+            for start, end in zip(runs[::2], runs[1::2]):
+                encoded += (start - last, end - start)
+                last = end
+            postings.append(encoded)
+        return {"docs": self.docs, "keys": keys, "postings": postings}
+
+
+def _merge_runs(pairs):
+    """ 按开始排好的 (开始, 结束) 合并成不重叠的 [开始, 结束, ...]，首尾相接的也合并 """
+    merged = []
+    for start, end in pairs:
+        if merged and start <= merged[-1]:
+            merged[-1] = max(merged[-1], end)
         else:
-            self.tester = tester
+            merged += (start, end)
+    return merged
 
-        self.startTime = datetime.datetime.now()
 
-    def run(self, test):
-        "Run the given test case or test suite."
-        result = _TestResult(self.verbosity)  # verbosity为1,只输出成功与否，为2会输出用例名称
-        test(result)
-        self.stopTime = datetime.datetime.now()
-        self.generateReport(test, result)
-        # 优化测试结束后打印蓝色提示文字 -- Gelomen
-        print("\n\033[36;0m--------------------- 测试结束 ---------------------\n"
-              "------------- 合计耗时: %s -------------\033[0m" % (self.stopTime - self.startTime), file=sys.stderr)
-        return result
+def _iter_tests(test):
+    """ 把（可能嵌套的）TestSuite 展开成按原顺序排列的用例列表 """
+    if isinstance(test, unittest.TestSuite):
+        for t in test:
+            for case in _iter_tests(t):
+                yield case
+    else:
+        yield test
 
-    def sortResult(self, result_list):
-        # unittest does not seems to run in any particular order.
-        # Here at least we want to group them together by class.
-        rmap = {}
-        classes = []
-        for n, t, o, e, s in result_list:
-            cls = t.__class__
-            if cls not in rmap:
-                rmap[cls] = []
-                classes.append(cls)
-            rmap[cls].append((n, t, o, e, s))
-        r = [(cls, rmap[cls]) for cls in classes]
-        return r
 
-    # 替换测试结果status为通过率 --Findyou
-    def getReportAttributes(self, result):
-        """
-        Return report attributes as a list of (name, value).
+# 异步模式：同一个类里的异步用例在共享的事件循环里并发执行，结果回放进同一个 _TestResult
+class _AsyncCaseRunner(object):
+    """
+    Run the test methods of IsolatedAsyncioTestCase classes concurrently
+    on one shared event loop.
+
+    Each test runs as its own task with its own output buffer. When a task
+    finishes, its outcome is replayed into the shared _TestResult, so the
+    records and the report rows are the same as for a serial run.
+
+    Module and class fixtures are run here for every class, the same way
+    TestSuite runs them. Timeouts of async tests are enforced inside their
+    tasks with asyncio.wait_for: the budget of a test is its own timeout or
+    what is left of its class budget, counted from the start of the class
+    because the tests of a class run at the same time.
+    """
+
+    def __init__(self, result, concurrency=10, resource_limits=None, timeout=None, class_timeout=None):
+        self.result = result
+        self.concurrency = max(1, concurrency)
+        # {资源名: 同时最多几个用例}，声明了该资源的用例先等资源再占并发名额
+        self.resource_limits = resource_limits or {}
+        self.timeout = timeout
+        self.class_timeout = class_timeout
+        self.loop = None
+
+    def run(self, test):
+        stdout0, stderr0 = sys.stdout, sys.stderr
+        sys.stdout = AsyncOutputRedirector(stdout0)
+        sys.stderr = AsyncOutputRedirector(stderr0)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        module, module_ok = None, False
+        try:
+            for cls, tests in self._group_by_class(_iter_tests(test)):
+                if self.result.shouldStop:
+                    break
+                name = cls is not None and cls.__module__ or None
+                if name != module:
+                    self._tear_down_module(module, module_ok)
+                    module, module_ok = name, self._set_up_module(name)
+                if not module_ok:
+                    continue
+                if cls is None:
+                    self._run_tests(tests)
+                else:
+                    self._run_class(cls, tests)
+            self._tear_down_module(module, module_ok)
+        finally:
+            try:
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            finally:
+                asyncio.set_event_loop(None)
+                self.loop.close()
+                sys.stdout, sys.stderr = stdout0, stderr0
+
+    @staticmethod
+    def _group_by_class(tests):
+        groups = []
+        for t in tests:
+            cls = t.__class__ if isinstance(t, unittest.TestCase) else None
+            if groups and groups[-1][0] is cls:
+                groups[-1][1].append(t)
+            else:
+                groups.append((cls, [t]))
+        return groups
+
+    def _run_tests(self, tests):
+        # 同步用例逐个调用 TestCase.run，类和模块夹具已经由这里处理
+        for t in tests:
+            if self.result.shouldStop:
+                break
+            t(self.result)
+
+    def _fixture_error(self, description, err):
+        self.result.addError(unittest.suite._ErrorHolder(description), err)
+
+    def _set_up_module(self, name):
+        """ 与 TestSuite 相同：setUpModule 失败时记一条错误，该模块的用例都不执行 """
+        module = sys.modules.get(name) if name else None
+        set_up = getattr(module, "setUpModule", None)
+        if set_up is None:
+            return True
+        try:
+            set_up()
+        except Exception:
+            self._fixture_error("setUpModule (%s)" % name, sys.exc_info())
+            self._call_module_cleanups(name)
+            return False
+        return True
+
+    def _tear_down_module(self, name, module_ok):
+        if not name or not module_ok:
+            return
+        tear_down = getattr(sys.modules.get(name), "tearDownModule", None)
+        if tear_down is not None:
+            try:
+                tear_down()
+            except Exception:
+                self._fixture_error("tearDownModule (%s)" % name, sys.exc_info())
+        self._call_module_cleanups(name)
+
+    def _call_module_cleanups(self, name):
+        try:
+            unittest.case.doModuleCleanups()
+        except Exception:
+            self._fixture_error("tearDownModule (%s)" % name, sys.exc_info())
+
+    def _run_class(self, cls, tests):
+        async_class = issubclass(cls, unittest.IsolatedAsyncioTestCase)
+        if getattr(cls, "__unittest_skip__", False):
+            # 跳过的类不执行 setUpClass，同步用例由 TestCase.run 自己记为跳过
+            if async_class:
+                reason = getattr(cls, "__unittest_skip_why__", "")
+                for t in tests:
+                    self._replay(t, "", [("skip", reason)], time.time(), time.time())
+            else:
+                self._run_tests(tests)
+            return
+
+        try:
+            cls.setUpClass()
+        except Exception:
+            err = sys.exc_info()
+            if async_class:
+                # setUpClass 失败时，该类下每个用例都记为错误，以便在报告里按类显示
+                now = time.time()
+                for t in tests:
+                    self._replay(t, "", [("error", err)], now, now)
+            else:
+                self._fixture_error("setUpClass (%s.%s)" % (cls.__module__, cls.__qualname__), err)
+            self._call_class_cleanups(cls, "setUpClass")
+            return
+
+        tracer = self.result.file_tracer
+        if async_class and tracer is not None:
+            tracer.hold = True
+        try:
+            if async_class:
+                self.loop.run_until_complete(self._gather(tests))
+            else:
+                self._run_tests(tests)
+        finally:
+            if async_class and tracer is not None:
+                tracer.release()
+            try:
+                cls.tearDownClass()
+            except Exception:
+                self._fixture_error("tearDownClass (%s.%s)" % (cls.__module__, cls.__qualname__), sys.exc_info())
+            self._call_class_cleanups(cls, "tearDownClass")
+
+    def _call_class_cleanups(self, cls, method_name):
+        cls.doClassCleanups()
+        for err in getattr(cls, "tearDown_exceptions", []):
+            self._fixture_error("%s (%s.%s)" % (method_name, cls.__module__, cls.__qualname__), err)
+        cls.tearDown_exceptions = []
+
+    async def _gather(self, tests):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = dict((name, asyncio.Semaphore(limit)) for name, limit in self.resource_limits.items())
+        # 类的超时预算从这里开始计算，同一类的用例是同时执行的
+        class_start = self.loop.time()
+        await asyncio.gather(*[self._run_task(t, semaphore, limits, class_start) for t in tests])
+
+    async def _run_task(self, test, semaphore, limits=None, class_start=None):
+        # 按名字顺序获取资源，不会互相等待；等资源时不占用并发名额，其他用例照常执行
+        held = [limits[name] for name in _test_resources(test) if limits and name in limits]
+        for resource in held:
+            await resource.acquire()
+        try:
+            await self._run_task_body(test, semaphore, class_start)
+        finally:
+            for resource in reversed(held):
+                resource.release()
+
+    async def _run_task_body(self, test, semaphore, class_start=None):
+        async with semaphore:
+            if self.result.shouldStop:
+                return
+            buffer = io.StringIO()
+            logs = []
+            phases = []
+            token = _async_output.set(buffer)
+            logs_token = _async_logs.set(logs)
+            phases_token = _async_phases.set(phases)
+            start_time = time.time()
+            try:
+                outcomes = await self._call_with_timeout(test, class_start)
+            finally:
+                end_time = time.time()
+                _async_output.reset(token)
+                _async_logs.reset(logs_token)
+                _async_phases.reset(phases_token)
+            self._replay(test, buffer.getvalue(), outcomes, start_time, end_time, logs, phases)
+
+    async def _call_with_timeout(self, test, class_start=None):
+        """ 在任务里用 wait_for 限时：超时后记下任务卡住处的调用栈，再取消任务 """
+        class_used = class_start is not None and self.loop.time() - class_start or 0
+        seconds, reason = _test_budget(test, self.timeout, self.class_timeout, class_used)
+        task = asyncio.ensure_future(self._call_test(test))
+        if not seconds:
+            return await task
+        try:
+            # shield 让超时时任务先不被取消，这样还能取到它卡住的位置
+            return await asyncio.wait_for(asyncio.shield(task), seconds)
+        except asyncio.TimeoutError:
+            pass
+        # 沿着 cr_await 找到真正卡住的协程，task 自己的栈只有最外层一帧
+        frames = []
+        coro = task.get_coro()
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is not None:
+                frames.append((frame, frame.f_lineno))
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        stack = "".join(traceback.format_list(traceback.StackSummary.extract(frames)))
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        try:
+            raise TestTimeoutError("%s，卡住时的调用栈：\n%s" % (reason, stack))
+        except TestTimeoutError:
+            return [("error", sys.exc_info())]
+
+    async def _call_test(self, test):
+        """ 按 TestCase.run 的顺序执行 setUp/测试方法/tearDown/cleanups，返回 (类型, 信息) 列表 """
+        method = getattr(test, test._testMethodName)
+        if getattr(test.__class__, "__unittest_skip__", False) or getattr(method, "__unittest_skip__", False):
+            reason = (getattr(test.__class__, "__unittest_skip_why__", "")
+                      or getattr(method, "__unittest_skip_why__", ""))
+            return [("skip", reason)]
+
+        expecting_failure = (getattr(method, "__unittest_expecting_failure__", False)
+                             or getattr(test, "__unittest_expecting_failure__", False))
+        outcomes = []
+        phases = _async_phases.get()
+        if phases is None:
+            phases = []
+        # test.subTest() 通过 _outcome 报告子测试，这里换成记进 outcomes 的版本
+        test._outcome = _AsyncSubTestOutcome(outcomes)
+        try:
+            start = time.time()
+            if await self._guard(test, outcomes, test.setUp) and await self._guard(test, outcomes, test.asyncSetUp):
+                phases.append(("setUp", start, time.time()))
+                start = time.time()
+                await self._guard(test, outcomes, method)
+                phases.append(("test", start, time.time()))
+                start = time.time()
+                await self._guard(test, outcomes, test.asyncTearDown)
+                await self._guard(test, outcomes, test.tearDown)
+                phases.append(("tearDown", start, time.time()))
+            else:
+                phases.append(("setUp", start, time.time()))
+            start = time.time()
+            while test._cleanups:
+                function, args, kwargs = test._cleanups.pop()
+                await self._guard(test, outcomes, function, *args, **kwargs)
+            phases.append(("cleanup", start, time.time()))
+        finally:
+            test._outcome = None
+
+        if expecting_failure:
+            errors = [info for kind, info in outcomes if kind in ("failure", "error")]
+            errors += [info[1] for kind, info in outcomes if kind == "subtest" and info[1] is not None]
+            if errors:
+                return [("expected_failure", errors[0])]
+            if not outcomes:
+                return [("unexpected_success", None)]
+        return outcomes
+
+    @staticmethod
+    async def _guard(test, outcomes, function, *args, **kwargs):
+        try:
+            ret = function(*args, **kwargs)
+            if inspect.isawaitable(ret):
+                await ret
+            return True
+        except KeyboardInterrupt:
+            raise
+        except unittest.SkipTest as e:
+            outcomes.append(("skip", str(e)))
+        except test.failureException:
+            outcomes.append(("failure", sys.exc_info()))
+        except Exception:
+            outcomes.append(("error", sys.exc_info()))
+        return False
+
+    def _replay(self, test, output, outcomes, start_time, end_time, logs=(), phases=()):
+        result = self.result
+        # 超时已经在任务里处理过，回放时不再让看门狗计时
+        watchdog, result.watchdog = result.watchdog, None
+        try:
+            self._replay_outcomes(test, output, outcomes, start_time, end_time, logs, phases)
+        finally:
+            result.watchdog = watchdog
+
+    def _replay_outcomes(self, test, output, outcomes, start_time, end_time, logs, phases):
+        result = self.result
+        result.startTest(test)
+        result.outputBuffer.write(output)
+        result.log_records.extend(logs)
+        # 使用任务自己的起止时间，而不是回放的时间
+        result.test_start_time = round(start_time, 2)
+        result.test_end_time = round(end_time, 2)
+        result._timeline_start = start_time
+        result._timeline_end = end_time
+        result._timeline_phases.extend(phases)
+        # 子测试都通过（或没有子测试）且没有其他结果时才算通过；有子测试失败时由 stopTest 汇总
+        if all(kind == "subtest" and info[1] is None for kind, info in outcomes):
+            outcomes = list(outcomes) + [("success", None)]
+        for kind, info in outcomes:
+            if kind == "success":
+                result.addSuccess(test)
+            elif kind == "subtest":
+                subtest, err, duration = info
+                result._subtest_mark = time.time() - duration
+                result.addSubTest(test, subtest, err)
+            elif kind == "subtest_skip":
+                result.addSkip(info[0], info[1])
+            elif kind == "skip":
+                result.addSkip(test, info)
+            elif kind == "failure":
+                result.addFailure(test, info)
+            elif kind == "error":
+                result.addError(test, info)
+            elif kind == "expected_failure":
+                result.addExpectedFailure(test, info)
+            elif kind == "unexpected_success":
+                result.addUnexpectedSuccess(test)
+        result.stopTest(test)
+
+
+class _AsyncSubTestOutcome(object):
+    """
+    What TestCase.subTest() needs from test._outcome, for async tests: the
+    result of each sub-test is kept in `outcomes` with its duration and
+    replayed into the result later, like the rest of the test.
+    """
+
+    result_supports_subtests = True
+    # subTest() 只在 result.failfast 或 expectedFailure 时抛 _ShouldStop，这里都不需要
+    result = None
+    expectedFailure = None
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.success = True
+
+    @contextlib.contextmanager
+    def testPartExecutor(self, test_case, subTest=False):
+        old_success = self.success
+        self.success = True
+        start = time.time()
+        try:
+            yield
+        except KeyboardInterrupt:
+            raise
+        except unittest.SkipTest as e:
+            self.success = False
+            self.outcomes.append(("subtest_skip", (test_case, str(e))))
+        except Exception:
+            self.success = False
+            self.outcomes.append(("subtest", (test_case, sys.exc_info(), time.time() - start)))
+        else:
+            self.outcomes.append(("subtest", (test_case, None, time.time() - start)))
+        finally:
+            self.success = self.success and old_success
+
+
+# 同步用例按阶段计时：在用例实例上临时包一层 TestCase 的内部方法，stopTest 时去掉
+_TEST_PHASES = (
+    ("setUp", "_callSetUp"),
+    ("test", "_callTestMethod"),
+    ("tearDown", "_callTearDown"),
+    ("cleanup", "doCleanups"),
+)
+
+
+def _timed_phase(phases, name, function):
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            phases.append((name, start, time.time()))
+    return wrapper
+
+
+def _describe_test(test):
+    """ 报告需要的用例信息，可以在进程之间传递 """
+    cls = test.__class__
+    return {
+        "id": test.id(),
+        "str": str(test),
+        "doc": test.shortDescription(),
+        "module": cls.__module__,
+        "class": cls.__name__,
+        "class_doc": cls.__doc__,
+    }
+
+
+def _loadable_by_name(test):
+    """ 工作进程能否通过 loadTestsFromName(test.id()) 重新加载该用例 """
+    if not isinstance(test, unittest.TestCase) or isinstance(test, unittest.loader._FailedTest):
+        return False
+    cls = test.__class__
+    module = sys.modules.get(cls.__module__)
+    return cls.__module__ != "__main__" and getattr(module, cls.__qualname__, None) is cls
+
+
+class _RemoteTest(object):
+    """
+    Stand-in for a test that ran in a worker process. It offers what the
+    report reads from a TestCase: id(), shortDescription(), str() and a
+    class whose __name__ and __doc__ match the original test class.
+    """
+
+    _classes = {}
+
+    def __init__(self, record):
+        self._id = record["id"]
+        self._str = record["str"]
+        self._doc = record["doc"]
+
+    @classmethod
+    def create(cls, record):
+        # 同一个用例类对应同一个替身类，sortResult 才能按类分组
+        key = (record["module"], record["class"])
+        remote_cls = cls._classes.get(key)
+        if remote_cls is None:
+            remote_cls = type(record["class"], (cls,), {"__doc__": record["class_doc"], "__module__": record["module"]})
+            cls._classes[key] = remote_cls
+        return remote_cls(record)
+
+    @classmethod
+    def from_id(cls, test_id):
+        """ 只知道用例 id 时（用例没有在任何进程里加载过）创建替身 """
+        key = test_id.rsplit(".", 1)[0]
+        return cls.create({"id": test_id, "str": test_id, "doc": None, "module": key.rsplit(".", 1)[0],
+                           "class": key.rsplit(".", 1)[-1], "class_doc": None})
+
+    def id(self):
+        return self._id
+
+    def shortDescription(self):
+        return self._doc
+
+    def __str__(self):
+        return self._str
+
+
+class _WorkerTestResult(_TestResult):
+    """ 工作进程里使用：每个用例开始和结束时把信息发回主进程 """
+
+    def __init__(self, conn, verbosity=1):
+        _TestResult.__init__(self, verbosity)
+        self.conn = conn
+        self.sent = 0
+
+    def startTest(self, test):
+        # 把超时预算一并发给主进程，工作进程卡死时由主进程终止它
+        budget = self.watchdog is not None and self.watchdog.budget(test)[0] or None
+        self.conn.send(("start", _describe_test(test), time.time(), budget))
+        _TestResult.startTest(self, test)
+
+    def stopTest(self, test):
+        _TestResult.stopTest(self, test)
+        self.flush()
+        # 主进程触发提前终止时会发来 ("stop",)，单元里剩下的用例不再执行
+        if self.conn.poll():
+            self.conn.recv()
+            self.stop()
+
+    def flush(self):
+        for n, t, o, e, s in self.result[self.sent:]:
+            record = _describe_test(t)
+            record.update(status=n, output=o, exc=e, use_time=s, subtests=self.subtests.pop(record["id"], None),
+                          benchmarks=self.benchmarks.pop(record["id"], None),
+                          webdriver_lease=self.webdriver_leases.pop(record["id"], None),
+                          logs=self._export_logs(record["id"]),
+                          timeline=self.timeline.pop(record["id"], None),
+                          coverage=self.coverage.pop(record["id"], None))
+            self.conn.send(("record", record))
+        self.sent = len(self.result)
+
+    def _export_logs(self, test_id):
+        # LogRecord 的参数不一定能 pickle，在工作进程里格式化好再发送
+        records = self.logs.pop(test_id, None)
+        if not records:
+            return None
+        return [(r.levelno, self.log_handler.format(r)) for r in records]
+
+    def addLoadError(self, name, exc_str):
+        record = {"id": name, "str": name, "doc": None, "module": name, "class": name.rsplit(".", 1)[-1],
+                  "class_doc": None, "status": 2, "output": "", "exc": exc_str, "use_time": 0}
+        self.conn.send(("record", record))
+
+    def _print_status(self, flag, test):
+        # 进度由主进程统一打印
+        pass
+
+
+def _worker_main(conn, global_values, options, dump_path):
+    """ 工作进程入口：先预热导入 preload 里的模块，然后循环接收并执行用例 """
+    # 报告文件夹等全局变量在 spawn 方式启动的进程里不会继承，需要传过来
+    _global_dict.update(global_values)
+    top_level_dir = options["top_level_dir"]
+    if top_level_dir and top_level_dir not in sys.path:
+        sys.path.insert(0, top_level_dir)
+    dump_file = open(dump_path, "w+")
+    # 设置了超时预算时才创建，类的已用时间在同一进程的各单元之间累计
+    watchdog = None
+    # fork 出来的进程会继承主进程挂在根 logger 上的 _LogCapture，先去掉
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if isinstance(handler, _LogCapture):
+            root_logger.removeHandler(handler)
+    log_handler = None
+    if options["log_level"] is not None:
+        log_handler = _LogCapture(options["log_level"], options["log_keep_level"], options["log_format"])
+        root_logger.addHandler(log_handler)
+    for module_name in options["preload"]:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            traceback.print_exc()
+    file_tracer = None
+    if options.get("coverage_root"):
+        file_tracer = _FileTracer(options["coverage_root"])
+        file_tracer.install()
+    conn.send(("ready",))
+    loader = unittest.TestLoader()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        if message[0] == "stop":
+            # 单元刚好执行完，停止请求来晚了
+            continue
+        result = _WorkerTestResult(conn)
+        result.record_timeline = True
+        result.log_handler = log_handler
+        result.worker_name = options["worker_name"]
+        result.file_tracer = file_tracer
+        suite = loader.suiteClass()
+        for name in message[1]:
+            try:
+                suite.addTests(loader.loadTestsFromName(name))
+            except Exception:
+                result.addLoadError(name, traceback.format_exc())
+        if watchdog is None and _Watchdog.needed(options["timeout"], options["class_timeout"], _iter_tests(suite)):
+            watchdog = _Watchdog(options["timeout"], options["class_timeout"], options["grace"], dump_file)
+        result.watchdog = watchdog
+        if options["async_mode"]:
+            # 主进程按单元分配的资源名额，见 _ParallelRunner._grant
+            _AsyncCaseRunner(result, options["async_concurrency"], len(message) > 2 and message[2] or {},
+                             options["timeout"], options["class_timeout"]).run(suite)
+        else:
+            suite(result)
+        result.flush()
+        if file_tracer is not None:
+            # coverage.py 记录的文件每个单元读一次
+            coverage = file_tracer.collect()
+            if coverage:
+                conn.send(("coverage", coverage))
+        conn.send(("idle",))
+    conn.close()
+    dump_file.close()
+
+
+class _Worker(object):
+
+    def __init__(self, wid, process, conn):
+        self.wid = wid
+        self.process = process
+        self.conn = conn
+        # 超时时 faulthandler 写调用栈的文件
+        self.dump_path = None
+        # 正在执行的单元 (key, [用例 id])、当前用例 (信息, 开始时间, 超时预算)，以及已经导入过的模块
+        self.unit = None
+        self.current = None
+        self.finished = set()
+        self.modules = set()
+        # 当前单元占用的受限资源 {资源名: 名额}
+        self.resources = {}
+
+
+# 多进程模式：用例按类分成单元，同一模块的单元优先分给已经导入过该模块的进程
+class _ParallelRunner(object):
+    """
+    Run tests in worker processes and collect their records into one
+    _TestResult.
+
+    Workers import their preload modules while starting, then receive units
+    (the test ids of one class) one at a time. Units of a module go to the
+    worker that already imported it, so each module is normally imported by
+    one worker only, and the imports of different modules happen at the same
+    time. A worker that dies is replaced and the rest of its unit requeued.
+
+    Timeouts are enforced inside the workers by their own _Watchdog. If a
+    worker is stuck where the signal cannot reach it, it is killed once the
+    test overruns its budget plus the grace period, and the stack dumped by
+    faulthandler goes into the error row.
+
+    Tests that declare resources are grouped into units per class and
+    resource set. A unit is only dispatched while every limited resource it
+    needs has a free slot; otherwise the worker takes the next unit that
+    fits, so the other workers stay busy while a resource is saturated.
+    In async mode a unit may hold several slots of a resource (see
+    _grant), which become the limits of the worker's _AsyncCaseRunner.
+    """
+
+    def __init__(self, result, workers, options, resource_limits=None, test_resources=None, ordered=False):
+        self.result = result
+        self.workers = workers
+        # top_level_dir, preload, async_mode, async_concurrency, timeout, class_timeout, grace
+        self.options = options
+        self.context = multiprocessing.get_context()
+        self.pending = []
+        self.requeued = set()
+        # {资源名: 上限}，{用例 id: (资源名, ...)}，以及正在使用的数量
+        self.resource_limits = resource_limits or {}
+        self.test_resources = dict(test_resources or {})
+        self.in_use = dict.fromkeys(self.resource_limits, 0)
+        # 用例已经按 TestOrder 排过序时，派发顺序优先于模块亲和
+        self.ordered = ordered
+        self.stopping = False
+
+    def run(self, test):
+        local_tests = []
+        entries = []
+        if isinstance(test, (list, tuple)):
+            entries = list(test)
+        else:
+            for t in _iter_tests(test):
+                if _loadable_by_name(t):
+                    entries.append(t.id())
+                    if self.resource_limits:
+                        self.test_resources.setdefault(t.id(), _test_resources(t))
+                else:
+                    local_tests.append(t)
+        self.pending = self._make_units(entries, self._limited_resources)
+        if self.pending:
+            self._run_workers()
+        # 无法在子进程里按名字重新加载的用例（例如定义在 __main__ 里的）在主进程执行
+        if local_tests:
+            unittest.TestSuite(local_tests)(self.result)
+
+    @staticmethod
+    def _make_units(entries, resources_of=None):
+        """ 同一个类的用例组成一个单元；声明了受限资源的用例按资源组合再分开，只占用真正需要的资源 """
+        units = []
+        index = {}
+        for entry in entries:
+            key = entry.rsplit(".", 1)[0]
+            group = (key, resources_of and resources_of(entry) or ())
+            if group not in index:
+                index[group] = len(units)
+                units.append((key, []))
+            units[index[group]][1].append(entry)
+        return units
+
+    def _limited_resources(self, entry):
+        return tuple(name for name in self.test_resources.get(entry, ()) if name in self.resource_limits)
+
+    def _unit_resources(self, unit):
+        return unit[1] and self._limited_resources(unit[1][0]) or ()
+
+    @staticmethod
+    def _module_of(key):
+        return key.rsplit(".", 1)[0]
+
+    def _start_worker(self, wid):
+        parent_conn, child_conn = self.context.Pipe()
+        fd, dump_path = tempfile.mkstemp(prefix="HTMLTestReportCN_worker_", suffix=".txt")
+        os.close(fd)
+        process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, dict(_global_dict), dict(self.options, worker_name="进程 %s" % (wid + 1)), dump_path),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(wid, process, parent_conn)
+        worker.dump_path = dump_path
+        return worker
+
+    def _run_workers(self):
+        workers = [self._start_worker(wid) for wid in range(min(self.workers, len(self.pending)))]
+        try:
+            while self.pending or any(w.unit for w in workers):
+                if self.result.shouldStop:
+                    self._stop_workers(workers)
+                for w in workers:
+                    if w.unit is None and self.pending:
+                        self._dispatch(w, workers)
+                busy = dict((w.conn, w) for w in workers if w.unit is not None)
+                for conn in multiprocessing.connection.wait(list(busy), timeout=0.5):
+                    w = busy[conn]
+                    try:
+                        message = conn.recv()
+                    except (EOFError, OSError):
+                        workers[workers.index(w)] = self._replace_worker(w)
+                        continue
+                    self._handle(w, message)
+                self._check_timeouts(workers)
+        finally:
+            for w in workers:
+                try:
+                    w.conn.send(None)
+                except (OSError, ValueError):
+                    pass
+            for w in workers:
+                w.process.join(timeout=5)
+                if w.process.is_alive():
+                    w.process.kill()
+                w.conn.close()
+                self._remove_dump(w)
+
+    def _stop_workers(self, workers):
+        """ 提前终止：不再派发新的单元，正在执行的进程执行完当前用例后停下 """
+        self.pending = []
+        if self.stopping:
+            return
+        self.stopping = True
+        for w in workers:
+            if w.unit is not None:
+                w.conn.send(("stop",))
+
+    def _check_timeouts(self, workers):
+        now = time.time()
+        for i, w in enumerate(workers):
+            if w.current is None or not w.current[2]:
+                continue
+            record, start_time, budget = w.current
+            if now > start_time + budget + self.options["grace"]:
+                w.process.kill()
+                with open(w.dump_path, encoding="utf-8", errors="replace") as f:
+                    stack = f.read()
+                message = "用例执行超过 %s 秒，工作进程已被终止。卡住时的调用栈：\n%s" % (round(budget, 2), stack)
+                workers[i] = self._replace_worker(w, message)
+
+    @staticmethod
+    def _remove_dump(worker):
+        try:
+            os.remove(worker.dump_path)
+        except OSError:
+            pass
+
+    def _dispatch(self, worker, workers):
+        claimed = set()
+        for w in workers:
+            if w is not worker:
+                claimed |= w.modules
+        # 资源已用满的单元先跳过；需要受限资源的单元优先，避免它们都挤到最后串行执行
+        # 其次：本进程已导入的模块 > 没有任何进程导入过的模块 > 剩下的第一个
+        best = None
+        for i, unit in enumerate(self.pending):
+            needed = self._unit_resources(unit)
+            if any(self.in_use[name] >= self.resource_limits[name] for name in needed):
+                continue
+            module = self._module_of(unit[0])
+            affinity = 0 if module in worker.modules else (1 if module not in claimed else 2)
+            rank = self.ordered and (not needed, i, affinity) or (not needed, affinity, i)
+            if best is None or rank < best[0]:
+                best = (rank, i)
+        if best is None:
+            return False
+        unit = self.pending.pop(best[1])
+        worker.resources = self._grant(unit)
+        for name, count in worker.resources.items():
+            self.in_use[name] += count
+        worker.modules.add(self._module_of(unit[0]))
+        worker.unit = unit
+        worker.current = None
+        worker.finished = set()
+        if self.options.get("async_mode"):
+            # 异步模式下单元里的用例会并发执行，把分到的名额一起发过去，作为工作进程里每种资源的上限
+            worker.conn.send(("run", unit[1], worker.resources))
+        else:
+            worker.conn.send(("run", unit[1]))
+        return True
+
+    def _grant(self, unit):
+        """
+        单元占用的名额 {资源名: 数量}。同步执行时单元里的用例一个接一个执行，每种资源占 1 个；
+        异步执行时最多占 上限 // 进程数 个（至少 1 个，不超过剩余名额和单元的用例数），
+        上限在各进程间分开，同时执行的用例总数仍不超过上限
+        """
+        needed = self._unit_resources(unit)
+        if not self.options.get("async_mode"):
+            return dict.fromkeys(needed, 1)
+        return dict((name, max(1, min(self.resource_limits[name] // self.workers,
+                                      self.resource_limits[name] - self.in_use[name], len(unit[1]))))
+                    for name in needed)
+
+    def _release(self, worker):
+        for name, count in worker.resources.items():
+            self.in_use[name] -= count
+        worker.resources = {}
+
+    def _handle(self, worker, message):
+        kind = message[0]
+        if kind == "start":
+            worker.current = (message[1], message[2], message[3])
+        elif kind == "record":
+            record = message[1]
+            if record.get("subtests") is not None:
+                self.result.subtests[record["id"]] = record["subtests"]
+            if record.get("benchmarks"):
+                self.result.benchmarks[record["id"]] = record["benchmarks"]
+            if record.get("webdriver_lease"):
+                self.result.webdriver_leases[record["id"]] = record["webdriver_lease"]
+            if record.get("logs"):
+                self.result.logs[record["id"]] = record["logs"]
+            if record.get("timeline"):
+                self.result.timeline.setdefault(record["id"], []).extend(record["timeline"])
+            if record.get("coverage") is not None:
+                self.result.coverage[record["id"]] = record["coverage"]
+            self.result.addRecord(record["status"], _RemoteTest.create(record),
+                                  record["output"], record["exc"], record["use_time"])
+            worker.finished.add(record["id"])
+            worker.current = None
+        elif kind == "coverage":
+            self.result.coverage.update(message[1])
+        elif kind == "idle":
+            worker.unit = None
+            self._release(worker)
+
+    def _replace_worker(self, worker, message=None):
+        """ 工作进程意外退出或被终止：当前用例记为错误，单元里还没执行的用例重新排队 """
+        worker.process.join(timeout=5)
+        exitcode = worker.process.exitcode
+        started = set()
+        if worker.current is not None:
+            record, start_time, _ = worker.current
+            started.add(record["id"])
+            record = dict(record, status=2, output="", use_time=round(time.time() - start_time, 2),
+                          exc=message or "工作进程意外退出 (exit code %s)\n" % exitcode)
+            self.result.addRecord(2, _RemoteTest.create(record), "", record["exc"], record["use_time"])
+        if worker.unit is not None:
+            key, entries = worker.unit
+            remaining = [e for e in entries if e not in worker.finished and e not in started]
+            retry = [e for e in remaining if e not in self.requeued]
+            for entry in remaining:
+                if entry in self.requeued:
+                    # 同一个条目已经重新排队过一次仍然导致进程退出，不再重试
+                    self.result.addRecord(2, _RemoteTest.from_id(entry), "",
+                                          "工作进程意外退出 (exit code %s)\n" % exitcode, 0)
+            self.requeued.update(retry)
+            if retry:
+                self.pending.insert(0, (key, retry))
+        self._release(worker)
+        worker.conn.close()
+        self._remove_dump(worker)
+        return self._start_worker(worker.wid)
+
+
+def _retryable(test):
+    """ 导入失败、类级别的 setUpClass/tearDownClass 错误等重试也没有意义 """
+    if isinstance(test, _RemoteTest):
+        return type(test).__name__ not in ("_ErrorHolder", "_FailedTest") and test.id().count(".") >= 2
+    return (isinstance(test, unittest.TestCase) and not isinstance(test, unittest.loader._FailedTest)
+            and getattr(test, "_retryable", True))
+
+
+# 新增 need_screenshot 参数，-1为无需截图，否则需要截图  -- Gelomen
+class HTMLTestRunner(Template_mixin):
+    """
+    """
+
+    def __init__(self, stream=sys.stdout, verbosity=2, title=None, description=None, tester=None,
+                 async_mode=False, async_concurrency=10, workers=0, preload=(), top_level_dir=None,
+                 timeout=None, class_timeout=None, timeout_grace=5.0,
+                 retries=0, retry_in_subprocess=False, history_path=None,
+                 benchmark_baseline=None, benchmark_alpha=0.05, benchmark_threshold=0.05,
+                 update_benchmark_baseline=False, slow_threshold=0.5, slow_min_runs=5,
+                 log_level=None, log_keep_level=logging.WARNING,
+                 log_format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+                 results_path=None, index_root=None, metrics_path=None, metrics_interval=None, metrics_labels=None,
+                 trace_path=None, resource_limits=None, test_resources=None, order=None,
+                 max_failures=None, max_failure_rate=None, failure_window=20,
+                 coverage_path=None, record_coverage=False, changed_files=None, diff_base=None):
+        self.need_screenshot = 0
+        self.stream = stream
+        self.verbosity = verbosity
+        # async_mode 为 True 时，同一类中的 IsolatedAsyncioTestCase 用例在共享事件循环里并发执行
+        self.async_mode = async_mode
+        self.async_concurrency = async_concurrency
+        # workers 大于 0 时用多个工作进程执行用例，preload 是每个进程启动时预先导入的模块（如 selenium）
+        self.workers = workers
+        self.preload = preload
+        self.top_level_dir = top_level_dir
+        # 每个用例 / 每个用例类的默认超时预算（秒），也可以用 @timeout、@class_timeout 单独设置
+        self.timeout = timeout
+        self.class_timeout = class_timeout
+        self.timeout_grace = timeout_grace
+        # 失败或错误的用例最多重试 retries 次，重试通过的记为“不稳定”；history_path 为 sqlite 文件，保存历次结果
+        self.retries = retries
+        self.retry_in_subprocess = retry_in_subprocess
+        self.history_path = history_path
+        # benchmark() 的结果与 benchmark_baseline（JSON 文件）比较，变慢超过 benchmark_threshold 且 p 值小于 benchmark_alpha 记为回退
+        self.benchmark_baseline = benchmark_baseline
+        self.benchmark_alpha = benchmark_alpha
+        self.benchmark_threshold = benchmark_threshold
+        self.update_benchmark_baseline = update_benchmark_baseline
+        # 有 history_path 时，耗时比历史中位数慢 slow_threshold（比例）以上且超出 3 倍 MAD 的用例标记为“变慢”
+        self.slow_threshold = slow_threshold
+        self.slow_min_runs = slow_min_runs
+        # 捕获 log_level 及以上的日志；通过的用例只保留 log_keep_level 及以上的，log_level 为 None（默认）时不捕获。
+        # 只设置自己的 handler 的级别，不改 logger 的级别，低于 logger 级别的日志不会被捕获
+        self.log_level = log_level
+        self.log_keep_level = log_keep_level
+        self.log_format = log_format
+        # 机器可读的结果文件（JSON Lines，以 .gz 结尾时压缩），用于比较两次运行
+        self.results_path = results_path
+        # 结果根目录，运行结束后在本次的文件夹里写 summary.json，并把本次运行加进根目录的 index.html
+        self.index_root = index_root
+        # OpenMetrics 文本文件（给 node_exporter 的 textfile collector），metrics_interval 秒数不为空时运行期间也定时刷新
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.metrics_labels = metrics_labels
+        # Chrome trace-event 格式的时间线（以 .gz 结尾时压缩），可以在 Perfetto 或 chrome://tracing 里打开
+        self.trace_path = trace_path
+        # {资源名: 同时最多几个用例}，例如 {"browser": 2}；只传用例 id 时由 test_resources（{用例 id: 资源}）提供各用例的资源
+        self.resource_limits = _check_resource_limits(resource_limits)
+        self.test_resources = test_resources
+        # 执行顺序，TestOrder.STRATEGIES 的子集，例如 ("failed", "changed", "duration")；需要 history_path 才知道上次的结果和耗时
+        self.order = order
+        self.order_summary = None
+        # 失败聚类，由 getReportAttributes 计算
+        self.clusters = []
+        # 提前终止：失败和错误累计 max_failures 个，或最近 failure_window 个用例的失败率超过 max_failure_rate（0~1）时停止，
+        # 没有执行的用例在报告里显示为“跳过/未执行”
+        self.max_failures = max_failures
+        self.max_failure_rate = max_failure_rate
+        self.failure_window = failure_window
+        # 覆盖索引文件：record_coverage 为 True 时记录每个用例执行过的源文件；
+        # 传入 changed_files（改动的文件列表）或 diff_base（git 分支，用 git diff 计算改动）时只执行受影响的用例
+        self.coverage_path = coverage_path
+        self.record_coverage = record_coverage
+        self.changed_files = changed_files
+        self.diff_base = diff_base
+        self.selection_summary = None
+        self.deselected = []
+        if title is None:
+            self.title = self.DEFAULT_TITLE
+        else:
+            self.title = title
+        if description is None:
+            self.description = self.DEFAULT_DESCRIPTION
+        else:
+            self.description = description
+        if tester is None:
+            self.tester = self.DEFAULT_TESTER
+        else:
+            self.tester = tester
+
+        self.startTime = datetime.datetime.now()
+
+    def run(self, test):
+        "Run the given test case or test suite, or a list of test ids."
+        result = _TestResult(self.verbosity)  # verbosity为1,只输出成功与否，为2会输出用例名称
+        result.record_timeline = bool(self.trace_path or self.workers > 0 or self.async_mode)
+        if self.log_level is not None:
+            result.log_handler = _LogCapture(self.log_level, self.log_keep_level, self.log_format)
+            logging.getLogger().addHandler(result.log_handler)
+        exporter = None
+        if self.metrics_path:
+            exporter = MetricsExporter(self.metrics_path, self.metrics_labels)
+            if self.metrics_interval:
+                exporter.start(result, self.startTime, self.metrics_interval)
+        try:
+            if isinstance(test, (list, tuple)) and self.workers <= 0:
+                test = unittest.TestLoader().loadTestsFromNames(test)
+            # 设置了超时预算时才创建；多进程模式下工作进程各自创建
+            if _Watchdog.needed(self.timeout, self.class_timeout, _iter_tests(test)):
+                result.watchdog = _Watchdog(self.timeout, self.class_timeout, self.timeout_grace)
+            if self.coverage_path and (self.changed_files is not None or self.diff_base):
+                test = self._select_changed(test)
+            if self.order:
+                test = self._order_tests(test)
+            if self.coverage_path and self.record_coverage and self.workers <= 0:
+                # 多进程模式下由各工作进程记录
+                result.file_tracer = _FileTracer(self._coverage_root())
+                result.file_tracer.install()
+            planned = ()
+            if self.max_failures or self.max_failure_rate is not None:
+                result.abort_policy = _AbortPolicy(self.max_failures, self.max_failure_rate, self.failure_window)
+                # TestSuite 执行完一个用例就把它从列表里去掉，先记下全部用例
+                planned = isinstance(test, (list, tuple)) and list(test) or list(_iter_tests(test))
+            if self.workers > 0:
+                _ParallelRunner(result, self.workers, self._worker_options(), self.resource_limits,
+                                self.test_resources, bool(self.order)).run(test)
+            elif self.async_mode:
+                _AsyncCaseRunner(result, self.async_concurrency, self.resource_limits,
+                                 self.timeout, self.class_timeout).run(test)
+            else:
+                test(result)
+            if result.file_tracer is not None:
+                result.coverage.update(result.file_tracer.collect())
+                result.file_tracer.uninstall()
+                result.file_tracer = None
+            if result.abort_reason:
+                # 环境已经坏掉，重试也没有意义
+                self._add_not_run(result, planned)
+            elif self.retries > 0:
+                self._retry_failures(result)
+            for t, reason in self.deselected:
+                result.addNotRun(isinstance(t, str) and _RemoteTest.from_id(t) or t, reason)
+        finally:
+            if result.file_tracer is not None:
+                result.file_tracer.uninstall()
+                result.file_tracer = None
+            if result.log_handler is not None:
+                logging.getLogger().removeHandler(result.log_handler)
+            if exporter is not None:
+                exporter.stop()
+        self.stopTime = datetime.datetime.now()
+        if self.history_path:
+            self._update_history(result)
+        if result.benchmarks:
+            self._compare_benchmarks(result)
+        if self.results_path:
+            RunResults.save(self.results_path, self._run_info(result), result.result)
+        if self.coverage_path and self.record_coverage and result.coverage:
+            coverage = CoverageMap(self.coverage_path, self._coverage_root())
+            coverage.update(result.coverage)
+            coverage.save()
+        if exporter is not None:
+            exporter.write(result, self.startTime)
+        if self.trace_path:
+            RunTimeline(result.timeline).save(self.trace_path, self.title)
+        dir_path = GlobalMsg.get_value("dir_path")
+        if dir_path:
+            make_missing_thumbnails(dir_path)
+        self.generateReport(test, result)
+        if self.index_root:
+            self._add_to_index(result)
+        # 优化测试结束后打印蓝色提示文字 -- Gelomen
+        print("\n\033[36;0m--------------------- 测试结束 ---------------------\n"
+              "------------- 合计耗时: %s -------------\033[0m" % (self.stopTime - self.startTime), file=sys.stderr)
+        return result
+
+    @staticmethod
+    def _add_not_run(result, planned):
+        executed = set(t.id() for n, t, o, e, s in result.result)
+        for t in planned:
+            if isinstance(t, str):
+                t = _RemoteTest.from_id(t)
+            if t.id() not in executed:
+                result.addNotRun(t, result.abort_reason)
+
+    def _coverage_root(self):
+        return os.path.abspath(self.top_level_dir or os.getcwd())
+
+    def _select_changed(self, test):
+        coverage = CoverageMap(self.coverage_path, self._coverage_root())
+        if not coverage.tests:
+            self.selection_summary = "没有覆盖记录（%s），执行全部用例" % self.coverage_path
+            return test
+        changed = self.changed_files
+        if changed is None:
+            try:
+                changed = coverage.git_changed_files(self.diff_base)
+            except (OSError, IndexError, subprocess.CalledProcessError):
+                self.selection_summary = "无法用 git 获取相对 %s 的改动，执行全部用例" % self.diff_base
+                return test
+        tests = isinstance(test, (list, tuple)) and list(test) or list(_iter_tests(test))
+        selected, self.deselected = coverage.select(tests, changed)
+        self.selection_summary = coverage.describe()
+        return isinstance(test, (list, tuple)) and selected or unittest.TestSuite(selected)
+
+    def _order_tests(self, test):
+        ordering = TestOrder(self.history_path, self.order)
+        if isinstance(test, (list, tuple)):
+            ordered = ordering.sort(list(test))
+        else:
+            ordered = unittest.TestSuite(ordering.sort(list(_iter_tests(test))))
+        self.order_summary = ordering.describe()
+        return ordered
+
+    def _retry_failures(self, result):
+        """ 只重试失败和错误的用例，每个用例的每次执行都记录在 result.attempts 里 """
+        for index, (n, t, o, e, s) in enumerate(list(result.result)):
+            if n not in (1, 2) or not _retryable(t) or t.id() in result.attempts:
+                continue
+            attempts = [(n, o, e, s)]
+            for _ in range(self.retries):
+                record = self._run_attempt(t, result)
+                if record is None:
+                    break
+                attempts.append(record)
+                if record[0] == 0:
+                    break
+            result.attempts[t.id()] = attempts
+            final = attempts[-1]
+            # 输出里保留每次执行的输出和之前各次的异常，异常只放最后一次的，失败聚类按最后一次的原因
+            history = self._format_attempts(attempts)
+            result.replaceRecord(index, 3 if final[0] == 0 else final[0], history, final[2], final[3])
+
+    def _run_attempt(self, test, result):
+        """ 重新执行一次用例，返回 (结果代码, 输出, 异常, 耗时)；子进程里的用例或 retry_in_subprocess 时在新进程里执行 """
+        attempt = _TestResult(self.verbosity)
+        if _Watchdog.needed(self.timeout, self.class_timeout, [test]):
+            attempt.watchdog = _Watchdog(self.timeout, self.class_timeout, self.timeout_grace)
+        attempt.record_timeline = result.record_timeline
+        attempt.log_handler = result.log_handler
+        if self.retry_in_subprocess or isinstance(test, _RemoteTest):
+            _ParallelRunner(attempt, 1, self._worker_options()).run([test.id()])
+        else:
+            # 放进 TestSuite 执行，setUpClass/setUpModule 才会被调用
+            unittest.TestSuite([test.__class__(test._testMethodName)])(attempt)
+        if not attempt.result:
+            return None
+        n, _, o, e, s = attempt.result[-1]
+        table = attempt.subtests.get(test.id())
+        if table is not None:
+            result.subtests[test.id()] = table
+        if test.id() in attempt.benchmarks:
+            result.benchmarks[test.id()] = attempt.benchmarks[test.id()]
+        if test.id() in attempt.logs:
+            result.logs[test.id()] = attempt.logs[test.id()]
+        for entry in attempt.timeline.get(test.id(), []):
+            result.timeline.setdefault(test.id(), []).append(dict(entry, retry=True))
+        return n, o, e, s
+
+    def _format_attempts(self, attempts):
+        lines = []
+        for i, (n, o, e, s) in enumerate(attempts):
+            lines.append("---------- 第 %s 次执行：%s（%s秒）----------" % (i + 1, self.STATUS[n], s))
+            if o:
+                lines.append(o.rstrip("\n"))
+            if e and i < len(attempts) - 1:
+                lines.append(e.rstrip("\n"))
+        return "\n".join(lines) + "\n"
+
+    def _update_history(self, result):
+        history = RunHistory(self.history_path)
+        try:
+            rows = [(t.id(), n, s, len(result.attempts.get(t.id(), ())) or 1) for n, t, o, e, s in result.result if n != 4]
+            # 基线取本次之前的运行
+            baselines = history.duration_baselines(self.slow_min_runs)
+            history.record_run(str(self.startTime), str(self.startTime), rows)
+            result.flake_rates = history.flake_rates()
+        finally:
+            history.close()
+        result.slow_tests = self._find_slow_tests(result, baselines)
+
+    # 耗时太短时 0.01 秒的计时精度就会造成很大的比例变化，不参与判断
+    SLOW_MIN_DURATION = 0.1
+    SLOW_MAD_FACTOR = 3.0
+
+    def _find_slow_tests(self, result, baselines):
+        slow = {}
+        for n, t, o, e, s in result.result:
+            if n not in (0, 3) or s < self.SLOW_MIN_DURATION or t.id() not in baselines:
+                continue
+            median, mad = baselines[t.id()]
+            # 1.4826 * MAD 是正态分布下标准差的稳健估计
+            if s > median * (1 + self.slow_threshold) and s > median + self.SLOW_MAD_FACTOR * 1.4826 * mad:
+                slow[t.id()] = (s, median, mad)
+        return slow
+
+    def _compare_benchmarks(self, result):
+        """ 把与基线比较的结果写进每条统计；基线里没有的项，以及 update_benchmark_baseline 时的所有项写回基线文件 """
+        if not self.benchmark_baseline:
+            return
+        baseline = BenchmarkBaseline(self.benchmark_baseline, self.benchmark_alpha, self.benchmark_threshold)
+        changed = False
+        for test_id, items in result.benchmarks.items():
+            for stats in items:
+                key = "%s::%s" % (test_id, stats["name"])
+                status, change, p, base_mean = baseline.compare(key, stats)
+                stats.update(status=status, change=change, p=p, baseline=base_mean)
+                if status == "新增" or self.update_benchmark_baseline:
+                    baseline.update(key, stats)
+                    changed = True
+        if changed:
+            baseline.save()
+
+    def _add_to_index(self, result):
+        # 报告文件夹由 DirAndFiles.create_dir 放进全局变量，没有时用报告文件所在的文件夹
+        report_path = GlobalMsg.get_value("report_path") or getattr(self.stream, "name", None)
+        if not isinstance(report_path, str):
+            return
+        RunIndex(self.index_root).add_run(os.path.dirname(report_path), report_path, self._run_info(result))
+
+    def _run_info(self, result):
+        total = len(result.result) - result.not_run_count
+        return {
+            "title": self.title,
+            "start_time": str(self.startTime)[:19],
+            "duration": round((self.stopTime - self.startTime).total_seconds(), 2),
+            "count": len(result.result),
+            "Pass": result.success_count,
+            "fail": result.failure_count,
+            "error": result.error_count,
+            "flaky": result.flaky_count,
+            "not_run": result.not_run_count,
+            "passrate": total and round((result.success_count + result.flaky_count) * 100.0 / total, 2) or 0,
+        }
+
+    def _worker_options(self):
+        return {
+            "top_level_dir": self.top_level_dir,
+            "preload": tuple(self.preload),
+            "async_mode": self.async_mode,
+            "async_concurrency": self.async_concurrency,
+            "timeout": self.timeout,
+            "class_timeout": self.class_timeout,
+            "grace": self.timeout_grace,
+            "log_level": self.log_level,
+            "log_keep_level": self.log_keep_level,
+            "log_format": self.log_format,
+            "resource_limits": self.resource_limits,
+            "coverage_root": self.coverage_path and self.record_coverage and self._coverage_root() or None,
+        }
+
+    def sortResult(self, result_list):
+        # unittest does not seems to run in any particular order.
+        # Here at least we want to group them together by class.
+        rmap = {}
+        classes = []
+        for n, t, o, e, s in result_list:
+            cls = t.__class__
+            if cls not in rmap:
+                rmap[cls] = []
+                classes.append(cls)
+            rmap[cls].append((n, t, o, e, s))
+        r = [(cls, rmap[cls]) for cls in classes]
+        return r
+
+    # 替换测试结果status为通过率 --Findyou
+    def getReportAttributes(self, result):
+        """
+        Return report attributes as a list of (name, value).
         Override this to add custom attributes.
         """
         startTime = str(self.startTime)[:19]
         duration = str(self.stopTime - self.startTime)
         status = []
-        status.append('共 %s' % (result.success_count + result.failure_count + result.error_count))
+        total = result.success_count + result.failure_count + result.error_count + result.flaky_count
+        status.append('共 %s' % total)
         if result.success_count:
             status.append('通过 %s' % result.success_count)
         if result.failure_count:
             status.append('失败 %s' % result.failure_count)
         if result.error_count:
             status.append('错误 %s' % result.error_count)
+        if result.flaky_count:
+            status.append('不稳定 %s' % result.flaky_count)
+        if result.not_run_count:
+            status.append('未执行 %s' % result.not_run_count)
         if status:
             status = '，'.join(status)
-            if (result.success_count + result.failure_count + result.error_count) > 0:
-                self.passrate = str("%.2f%%" % (float(result.success_count) / float(result.success_count + result.failure_count + result.error_count) * 100))
+            # 重试后通过的不稳定用例也算通过
+            if total > 0:
+                self.passrate = str("%.2f%%" % (float(result.success_count + result.flaky_count) / float(total) * 100))
             else:
                 self.passrate = "0.00 %"
         else:
             status = 'none'
 
+        # 同一原因的多个失败只列一行；没有经过 generateReport 聚类时按原样列出
         if len(result.failCase) > 0:
-            failCase = result.failCase
+            failCase = self._clustered_case_list(1) or result.failCase
         else:
             failCase = "无"
 
         if len(result.errorCase) > 0:
-            errorCase = result.errorCase
+            errorCase = self._clustered_case_list(2) or result.errorCase
         else:
             errorCase = "无"
 
-        return [
+        attrs = [
             ('测试人员', self.tester),
             ('开始时间', startTime),
             ('合计耗时', duration),
@@ -1033,61 +3489,119 @@ class HTMLTestRunner(Template_mixin):
             ('失败用例合集', failCase),
             ('错误用例合集', errorCase),
         ]
+        if self.order_summary:
+            attrs.append(('执行顺序', self.order_summary))
+        if self.selection_summary:
+            attrs.append(('按改动选择', self.selection_summary))
+        if result.abort_reason:
+            attrs.append(('提前终止', '%s，%s 个用例未执行' % (result.abort_reason, result.not_run_count)))
+        if result.webdriver_leases:
+            leases = list(result.webdriver_leases.values())
+            attrs.append(('浏览器会话池', '租用 %s 次，新建 %s 个，回收 %s 个，平均等待 %.2f秒，最长等待 %.2f秒，平均租用 %.2f秒' % (
+                len(leases),
+                sum(1 for lease in leases if lease["created"]),
+                sum(lease["recycled"] for lease in leases),
+                sum(lease["wait"] for lease in leases) / len(leases),
+                max(lease["wait"] for lease in leases),
+                sum(lease.get("lease", 0) for lease in leases) / len(leases))))
+        if self.history_path:
+            slowCase = "".join("<li>%s（%s秒，历史中位数 %s秒）</li>" % (saxutils.escape(str(t)), s, round(result.slow_tests[t.id()][1], 2))
+                               for n, t, o, e, s in result.result if t.id() in result.slow_tests)
+            attrs.append(('变慢用例合集', slowCase or "无"))
+        if result.benchmarks:
+            statuses = [stats.get("status") for items in result.benchmarks.values() for stats in items]
+            summary = ['共 %s' % len(statuses)]
+            for name in ("回退", "变快", "新增"):
+                if statuses.count(name):
+                    summary.append('%s %s' % (name, statuses.count(name)))
+            attrs.append(('性能', '，'.join(summary)))
+        return attrs
+
+    def _clustered_case_list(self, n):
+        items = []
+        for cluster in self.clusters:
+            if cluster["n"] != n:
+                continue
+            members = cluster["members"]
+            if len(members) == 1:
+                items.append("<li>" + str(members[0][0]) + "</li>")
+            else:
+                items.append("<li>%s 等 %s 个用例（失败聚类 #%s）</li>" % (members[0][0], len(members), cluster["cid"]))
+        return "".join(items)
 
     def generateReport(self, test, result):
+        # 报告属性和用例表格都要用到失败聚类，先算好
+        self.clusters = _cluster_failures(result.result)
         report_attrs = self.getReportAttributes(result)
         generator = 'HTMLTestRunner %s' % __version__
         stylesheet = self._generate_stylesheet()
         # 添加 通过、失败 和 错误 的统计，以用于饼图  -- Gelomen
-        Pass = self._generate_report(result)["Pass"]
-        fail = self._generate_report(result)["fail"]
-        error = self._generate_report(result)["error"]
+        report_data = self._generate_report(result)
 
-        heading = self._generate_heading(report_attrs)
-        report = self._generate_report(result)["report"]
+        chart = self._generate_chart(report_data["Pass"], report_data["fail"], report_data["error"], report_data["flaky"],
+                                     report_data["not_run"])
+        heading = self._generate_heading(report_attrs, chart)
         ending = self._generate_ending()
-        output = self.HTML_TMPL % dict(
+        values = dict(
             title=saxutils.escape(self.title),
             generator=generator,
             stylesheet=stylesheet,
-            Pass=Pass,
-            fail=fail,
-            error=error,
             heading=heading,
-            report=report,
             ending=ending,
         )
-        self.stream.write(output.encode('utf8'))
+        # 报告部分可能有十几 MB，分段写出，不再把它复制进整个页面
+        page_head, page_tail = self.HTML_TMPL.split("%(report)s")
+        self.stream.write((page_head % values).encode('utf8'))
+        self.stream.write(report_data["report"].encode('utf8'))
+        self.stream.write((page_tail % values).encode('utf8'))
 
     def _generate_stylesheet(self):
         return self.STYLESHEET_TMPL
 
     # 增加Tester显示 -Findyou
     # 增加 失败用例合集 和 错误用例合集 的显示  -- Gelomen
-    def _generate_heading(self, report_attrs):
+    def _generate_heading(self, report_attrs, chart=""):
         a_lines = []
         for name, value in report_attrs:
             # 如果是 失败用例 或 错误用例合集，则不进行转义 -- Gelomen
             if name == "失败用例合集":
                 if value == "无":
-                    line = self.HEADING_ATTRIBUTE_TMPL % dict(
+                    line = self.HEADING_COLLECTION_TMPL % dict(
+                        Class="failCollection",
                         name=name,
                         value="<ol style='float: left;'>" + value + "</ol>",
                     )
                 else:
-                    line = self.HEADING_ATTRIBUTE_TMPL % dict(
+                    line = self.HEADING_COLLECTION_TMPL % dict(
+                        Class="failCollection",
                         name=name,
                         value="<div class='panel-default' style='float: left;'><a class='showDetail' data-toggle='collapse' href='#failCaseOl' style='text-decoration: none;'>点击查看</a></div>"
                               "<ol id='failCaseOl' class='collapse' style='float: left;'>" + value + "</ol>",
                     )
+            elif name == "变慢用例合集":
+                if value == "无":
+                    line = self.HEADING_COLLECTION_TMPL % dict(
+                        Class="slowCollection",
+                        name=name,
+                        value="<ol style='float: left;'>" + value + "</ol>",
+                    )
+                else:
+                    line = self.HEADING_COLLECTION_TMPL % dict(
+                        Class="slowCollection",
+                        name=name,
+                        value="<div class='panel-default' style='float: left;'><a class='showDetail' data-toggle='collapse' href='#slowCaseOl' style='text-decoration: none;'>点击查看</a></div>"
+                              "<ol id='slowCaseOl' class='collapse' style='float: left;'>" + value + "</ol>",
+                    )
             elif name == "错误用例合集":
                 if value == "无":
-                    line = self.HEADING_ATTRIBUTE_TMPL % dict(
+                    line = self.HEADING_COLLECTION_TMPL % dict(
+                        Class="errorCollection",
                         name=name,
                         value="<ol style='float: left;'>" + value + "</ol>",
                     )
                 else:
-                    line = self.HEADING_ATTRIBUTE_TMPL % dict(
+                    line = self.HEADING_COLLECTION_TMPL % dict(
+                        Class="errorCollection",
                         name=name,
                         value="<div class='panel-default' style='float: left;'><a class='showDetail' data-toggle='collapse' href='#errorCaseOl' style='text-decoration: none;'>点击查看</a></div>"
                               "<ol id='errorCaseOl' class='collapse' style='float: left;'>" + value + "</ol>",
@@ -1103,6 +3617,7 @@ class HTMLTestRunner(Template_mixin):
             parameters=''.join(a_lines),
             description=saxutils.escape(self.description),
             tester=saxutils.escape(self.tester),
+            chart=chart,
         )
         return heading
 
@@ -1110,11 +3625,29 @@ class HTMLTestRunner(Template_mixin):
     def _generate_report(self, result):
         rows = []
         sortedResult = self.sortResult(result.result)
+        self.subtests = result.subtests
+        self.subtest_data = {}
+        self.flake_rates = result.flake_rates
+        self.slow_tests = result.slow_tests
+        self.webdriver_leases = result.webdriver_leases
+        self.logs = result.logs
+        self.log_handler = result.log_handler or _LogCapture(fmt=self.log_format)
+        # 多个用例共享的异常信息只保存一份 {哈希: 异常信息}，行里按哈希引用
+        self.cluster_of = {}
+        for cluster in self.clusters:
+            cluster["rows"] = []
+            for member, exc_str in cluster["members"]:
+                self.cluster_of[id(member)] = cluster
+        self.traceback_data = {}
+        self._traceback_keys = {}
+        self.search_index = _SearchIndex()
+        # 很多失败的异常信息相同，第一行只取一次
+        self._error_summaries = {}
         # 所有用例统计耗时初始化
         sum_ns = 0
         for cid, (cls, cls_results) in enumerate(sortedResult):
             # subtotal for a class
-            np = nf = ne = ns = 0
+            np = nf = ne = nr = nn = ns = 0
             for n, t, o, e, s in cls_results:
                 if n == 0:
                     np += 1
@@ -1122,6 +3655,10 @@ class HTMLTestRunner(Template_mixin):
                     nf += 1
                 elif n == 2:
                     ne += 1
+                elif n == 3:
+                    nr += 1
+                elif n == 4:
+                    nn += 1
                 ns += s  # 把单个class用例文件里面的多个def用例每次的耗时相加
             ns = round(ns, 2)
             sum_ns += ns  # 把所有用例的每次耗时相加
@@ -1138,8 +3675,9 @@ class HTMLTestRunner(Template_mixin):
                 style=ne > 0 and 'errorClass' or nf > 0 and 'failClass' or 'passClass',
                 name=name,
                 doc=doc,
-                count=np + nf + ne,
-                Pass=np,
+                count=np + nf + ne + nr + nn,
+                # 不稳定的用例最终通过，计入通过
+                Pass=np + nr,
                 fail=nf,
                 error=ne,
                 cid='c%s' % (cid + 1),
@@ -1147,38 +3685,78 @@ class HTMLTestRunner(Template_mixin):
             )
             rows.append(row)
 
+            # 搜索：模块名、类名和类说明对整个类的行只加一次，每行只加自己的名字、说明和异常信息
+            first_row = len(self.search_index.docs)
+            self._class_prefix = "%s.%s." % (cls.__module__, cls.__name__)
             for tid, (n, t, o, e, s) in enumerate(cls_results):
                 self._generate_report_test(rows, cid, tid, n, t, o, e)
+            self.search_index.add_group(first_row, cls.__module__.split('.') + [cls.__name__, doc])
         sum_ns = round(sum_ns, 2)
-        report = self.REPORT_TMPL % dict(
-            test_list=''.join(rows),
-            count=str(result.success_count + result.failure_count + result.error_count),
-            Pass=str(result.success_count),
+        values = dict(
+            count=str(result.success_count + result.failure_count + result.error_count + result.flaky_count
+                      + result.not_run_count),
+            Pass=str(result.success_count + result.flaky_count),
             fail=str(result.failure_count),
             error=str(result.error_count),
+            flaky=str(result.flaky_count),
+            not_run=str(result.not_run_count),
             time_usage=str(sum_ns) + "秒",  # 所有用例耗时
             passrate=self.passrate,
         )
+        # 报告可能有十几 MB：表格前后的部分单独格式化，和所有行一起放进列表最后拼接一次，避免反复复制整个字符串
+        table_head, table_tail = self.REPORT_TMPL.split("%(test_list)s")
+        parts = [table_head % values]
+        parts += rows
+        parts.append(table_tail % values)
+        if self.subtest_data:
+            data = json.dumps(self.subtest_data, ensure_ascii=False).replace("</", "<\\/")
+            parts.append(self.REPORT_SUBTEST_DATA_TMPL % dict(data=data))
+        if self.clusters:
+            parts.insert(0, self._generate_clusters())
+        if self.traceback_data:
+            data = json.dumps(self.traceback_data, ensure_ascii=False).replace("</", "<\\/")
+            parts.append(self.REPORT_TRACEBACK_DATA_TMPL % dict(data=data))
+        if self.search_index.docs:
+            data = json.dumps(self.search_index.data(), ensure_ascii=False, separators=(",", ":"))
+            parts.append(self.REPORT_SEARCH_DATA_TMPL % dict(data=data.replace("</", "<\\/")))
+        if result.benchmarks:
+            parts.append(self._generate_benchmarks(result))
+        parts.append(self._generate_timeline(result))
+        report = ''.join(parts)
 
         # 获取 通过、失败 和 错误 的统计并return，以用于饼图  -- Gelomen
         Pass = str(result.success_count)
         fail = str(result.failure_count)
         error = str(result.error_count)
-        return {"report": report, "Pass": Pass, "fail": fail, "error": error}
+        flaky = str(result.flaky_count)
+        not_run = str(result.not_run_count)
+        return {"report": report, "Pass": Pass, "fail": fail, "error": error, "flaky": flaky, "not_run": not_run}
 
-    def _generate_report_test(self, rows, cid, tid, n, t, o, e):
+    @staticmethod
+    def _row_id(cid, tid, n):
         # e.g. 'pt1_1', 'ft1_1', 'et1_1'etc
-        has_output = bool(o or e)
         # ID修改点为下划线,支持Bootstrap折叠展开特效 - Findyou
-        if n == 0:
-            tid_flag = 'p'
-        elif n == 1:
-            tid_flag = 'f'
-        elif n == 2:
-            tid_flag = 'e'
-        tid = tid_flag + 't%s_%s' % (cid + 1, tid + 1)
-        name = t.id().split('.')[-1]
+        return "pfern"[n] + 't%s_%s' % (cid + 1, tid + 1)
+
+    def _generate_report_test(self, rows, cid, tid, n, t, o, e):
+        has_output = bool(o or e)
+        tid = self._row_id(cid, tid, n)
+        test_id = t.id()
+        name = test_id.split('.')[-1]
         doc = t.shortDescription() or ""
+        self._add_search_doc(tid, test_id, name, doc, n, e)
+        # 显示历史不稳定率
+        if test_id in self.flake_rates:
+            flaky_runs, runs = self.flake_rates[test_id]
+            doc += "<div class='flakeRate'>历史不稳定率：%.1f%%（%s/%s 次运行）</div>" % (flaky_runs * 100.0 / runs, flaky_runs, runs)
+        if test_id in self.slow_tests:
+            duration, median, mad = self.slow_tests[test_id]
+            name += "<span class='label label-warning slowBadge'>变慢</span>"
+            doc += "<div class='slowInfo'>耗时 %s秒，历史中位数 %s秒（MAD %s秒）</div>" % (duration, round(median, 2), round(mad, 2))
+        if test_id in self.webdriver_leases:
+            lease = self.webdriver_leases[test_id]
+            doc += "<div class='leaseInfo'>浏览器会话：等待 %.2f秒，租用 %.2f秒%s</div>" % (
+                lease["wait"], lease.get("lease", 0), lease["created"] and "，新建" or "")
         # desc = doc and ('%s - %s' % (name, doc)) or name
 
         # utf-8 支持中文 - Findyou
@@ -1198,10 +3776,25 @@ class HTMLTestRunner(Template_mixin):
         else:
             ue = e
 
-        script = self.REPORT_TEST_OUTPUT_TMPL % dict(
-            id=tid,
-            output=saxutils.escape(uo + ue),
-        )
+        cluster = self.cluster_of.get(id(t))
+        if cluster is not None and len(cluster["members"]) > 1:
+            # 同一聚类的用例不重复写入异常信息，点击时从 traceback_data 里取
+            cluster["rows"].append((tid, name))
+            key = self._store_traceback(ue)
+            script = self.REPORT_TEST_OUTPUT_TMPL % dict(
+                id=tid,
+                output=saxutils.escape(uo),
+            ) + self.REPORT_TRACEBACK_REF_TMPL % dict(tid=tid, key=key, cid=cluster["cid"])
+        else:
+            if cluster is not None:
+                cluster["rows"].append((tid, name))
+            script = self.REPORT_TEST_OUTPUT_TMPL % dict(
+                id=tid,
+                output=saxutils.escape(uo + ue),
+            )
+
+        subtests = self._generate_subtests(tid, test_id)
+        logs = self._generate_logs(test_id)
 
         # 截图名字通过抛出异常存放在u，通过截取字段获得截图名字  -- Gelomen
         u = uo + ue
@@ -1213,46 +3806,1483 @@ class HTMLTestRunner(Template_mixin):
 
             row = tmpl % dict(
                 tid=tid,
-                Class=(n == 0 and 'hiddenRow' or 'none'),
-                style=n == 2 and 'errorCase' or (n == 1 and 'failCase' or 'passCase'),
+                Class=(n in (0, 4) and 'hiddenRow' or 'none'),
+                style=self.STATUS_STYLE[n],
                 name=name,
                 doc=doc,
                 script=script,
                 status=self.STATUS[n],
+                button=self.STATUS_BUTTON[n],
+                label=self.STATUS_LABEL[n],
+                subtests=subtests,
+                logs=logs,
             )
         else:
             tmpl = has_output and self.REPORT_TEST_WITH_OUTPUT_TMPL_1 or self.REPORT_TEST_NO_OUTPUT_TMPL
 
             screenshot_list = re.findall("errorImg\[(.*?)\]errorImg", u)
             screenshot = ""
+            dir_path = GlobalMsg.get_value("dir_path")
             for i in screenshot_list:
-                screenshot += "</br><a class=\"screenshot\" href=\"javascript:void(0)\" img=\"image/" + i + "\">img_" + i + "</a>"
+                # 有缩略图则显示懒加载的小图，点击再加载原图；旧结果没有缩略图时仍然显示链接
+                thumb = "image/thumb/" + thumbnail_name(i)
+                if dir_path and os.path.isfile(os.path.join(dir_path, thumb)):
+                    screenshot += "</br><img class=\"screenshot thumb\" loading=\"lazy\" src=\"" + thumb + "\" img=\"image/" + i + "\" alt=\"img_" + i + "\"/>"
+                else:
+                    screenshot += "</br><a class=\"screenshot\" href=\"javascript:void(0)\" img=\"image/" + i + "\">img_" + i + "</a>"
 
             # screenshot = u[u.find('errorImg[') + 9:u.find(']errorImg')]
             browser = u[u.find('browser[') + 8:u.find(']browser')]
 
             row = tmpl % dict(
                 tid=tid,
-                Class=(n == 0 and 'hiddenRow' or 'none'),
-                style=n == 2 and 'errorCase' or (n == 1 and 'failCase' or 'passCase'),
+                Class=(n in (0, 4) and 'hiddenRow' or 'none'),
+                style=self.STATUS_STYLE[n],
                 name=name,
                 doc=doc,
                 script=script,
                 status=self.STATUS[n],
+                button=self.STATUS_BUTTON[n],
+                label=self.STATUS_LABEL[n],
+                subtests=subtests,
+                logs=logs,
                 # 添加截图字段
                 screenshot=screenshot,
                 # 添加浏览器版本字段
                 browser=browser
             )
         rows.append(row)
+        return tid
+
+    def _add_search_doc(self, tid, test_id, name, doc, n, e):
+        """ 一行的搜索内容：用例名、说明和异常信息的第一行；id 不是 模块.类.方法 形式时（如 setUpClass 的错误）加上各段 """
+        parts = [name, doc]
+        if e and n in (1, 2):
+            summary = self._error_summaries.get(e)
+            if summary is None:
+                summary = self._error_summaries[e] = _error_summary(e)
+            parts.append(summary)
+        if not test_id.startswith(self._class_prefix):
+            parts += test_id.split('.')
+        self.search_index.add(tid, name, parts)
+
+    def _generate_subtests(self, tid, test_id):
+        table = self.subtests.get(test_id)
+        if table is None:
+            return ""
+        np, nf, ne = table.counts()
+        toggle = ""
+        if nf or ne:
+            self.subtest_data[tid] = table.failed_rows()
+            toggle = self.REPORT_SUBTEST_TOGGLE_TMPL % dict(tid=tid)
+        return self.REPORT_SUBTEST_TMPL % dict(
+            tid=tid,
+            count=len(table.status),
+            Pass=np,
+            fail=nf,
+            error=ne,
+            time_usage=round(sum(table.durations), 2),
+            toggle=toggle,
+        )
 
-        if not has_output:
-            return
+    def _store_traceback(self, exc_str):
+        key = self._traceback_keys.get(exc_str)
+        if key is None:
+            key = self._traceback_keys[exc_str] = hashlib.sha1(exc_str.encode("utf-8")).hexdigest()[:12]
+            self.traceback_data[key] = exc_str
+        return key
+
+    def _generate_clusters(self):
+        rows = []
+        for cluster in self.clusters:
+            members = cluster["members"]
+            if len(members) > 1:
+                traceback_html = self.REPORT_TRACEBACK_REF_TMPL % dict(
+                    tid="c%s" % cluster["cid"], key=self._store_traceback(members[0][1]), cid=cluster["cid"])
+            else:
+                traceback_html = "<pre style='text-align:left'>%s</pre>" % saxutils.escape(members[0][1])
+            rows.append(self.REPORT_CLUSTER_ROW_TMPL % dict(
+                cid=cluster["cid"],
+                style=self.STATUS_STYLE[cluster["n"]],
+                title=saxutils.escape(cluster["title"]),
+                status=self.STATUS[cluster["n"]],
+                count=len(members),
+                traceback=traceback_html,
+                members="".join(self.REPORT_CLUSTER_MEMBER_TMPL % dict(tid=tid, name=name)
+                                for tid, name in cluster["rows"]),
+            ))
+        return self.REPORT_CLUSTER_TMPL % dict(rows="".join(rows))
+
+    def _generate_logs(self, test_id):
+        records = self.logs.get(test_id)
+        if not records:
+            return ""
+        lines = []
+        for record in records:
+            # 工作进程发回的日志已经格式化
+            if isinstance(record, logging.LogRecord):
+                level, text = record.levelno, self.log_handler.format(record)
+            else:
+                level, text = record
+            lines.append(self.REPORT_LOG_LINE_TMPL % dict(
+                level=level,
+                levelname=logging.getLevelName(level),
+                text=saxutils.escape(text),
+            ))
+        return self.REPORT_LOG_TMPL % dict(lines=''.join(lines))
+
+    def _generate_benchmarks(self, result):
+        rows = []
+        for test_id, items in result.benchmarks.items():
+            for stats in items:
+                status = stats.get("status") or "未比较"
+                change = stats.get("change")
+                p = stats.get("p")
+                rows.append(self.REPORT_BENCHMARK_ROW_TMPL % dict(
+                    style=self.BENCHMARK_STYLE.get(status, ""),
+                    test=saxutils.escape(test_id.split(".", 1)[-1]),
+                    name=saxutils.escape(stats["name"]),
+                    rounds="%s × %s" % (stats["rounds"], stats["number"]),
+                    mean=_format_seconds(stats["mean"]),
+                    stdev=_format_seconds(stats["stdev"]),
+                    min=_format_seconds(stats["min"]),
+                    median=_format_seconds(stats["median"]),
+                    p90=_format_seconds(stats["p90"]),
+                    p99=_format_seconds(stats["p99"]),
+                    ops="%.1f" % stats["ops"],
+                    baseline=stats.get("baseline") is not None and _format_seconds(stats["baseline"]) or "-",
+                    change=change is not None and "%+.1f%%" % (change * 100) or "-",
+                    p=p is not None and "%.4f" % p or "-",
+                    status=status,
+                ))
+        return self.REPORT_BENCHMARK_TMPL % dict(rows=''.join(rows))
+
+    def _generate_timeline(self, result):
+        """ 有并发（多个进程或异步用例同时执行）时显示时间线：每个通道一行，下方是同时执行的用例数 """
+        timeline = RunTimeline(result.timeline)
+        if len(timeline.rows) < 2:
+            return ""
+        left, width, row_height = 100, 860, 14
+        t0, makespan = timeline.start, max(timeline.end - timeline.start, 1e-6)
+
+        def x(t):
+            return left + (t - t0) / makespan * width
+
+        rows = dict((row, i) for i, row in enumerate(timeline.rows))
+        top = 20
+        labels, bars = [], []
+        for i, (worker, lane) in enumerate(timeline.rows):
+            labels.append(self.TIMELINE_LABEL_TMPL % dict(y=top + i * row_height + 10, name=saxutils.escape(
+                lane and "%s #%s" % (worker, lane + 1) or worker)))
+        for entry in timeline.entries:
+            status = entry["status"]
+            bars.append(self.TIMELINE_BAR_TMPL % dict(
+                x=x(entry["start"]),
+                y=top + rows[(entry["worker"], entry["lane"])] * row_height + 1,
+                width=max(x(entry["end"]) - x(entry["start"]), 0.5),
+                color=status is not None and self.CHART_COLORS[status] or "#ccc",
+                stroke=entry.get("critical") and ' stroke="#333" stroke-width="1"' or "",
+                title=saxutils.escape("%s（%s，%s，%.2f秒%s）" % (
+                    entry["id"], entry["worker"], status is not None and self.STATUS[status] or "跳过",
+                    entry["end"] - entry["start"], entry.get("retry") and "，重试" or "")),
+            ))
+        ticks = []
+        for i in range(6):
+            t = t0 + makespan * i / 5
+            ticks.append(self.TIMELINE_TICK_TMPL % dict(x=x(t), text_x=x(t) + 2, y2=top + len(timeline.rows) * row_height,
+                                                         label=i and _format_seconds(t - t0) or "0"))
+        base = top + len(timeline.rows) * row_height + 70
+        steps = timeline.concurrency()
+        peak = max([c for _, c in steps] or [1]) or 1
+        points, level = ["%.1f,%.1f" % (x(t0), base)], 0
+        for t, level_next in steps:
+            points.append("%.1f,%.1f" % (x(t), base - level * 55.0 / peak))
+            points.append("%.1f,%.1f" % (x(t), base - level_next * 55.0 / peak))
+            level = level_next
+        points.append("%.1f,%.1f" % (x(timeline.end), base - level * 55.0 / peak))
+        summary = timeline.summary()
+        return self.REPORT_TIMELINE_TMPL % dict(
+            makespan="%.2f" % summary["makespan"],
+            busy="%.2f" % summary["busy"],
+            parallelism="%.2f" % summary["parallelism"],
+            peak=peak,
+            critical="%.2f" % summary["critical"],
+            critical_count=summary["critical_count"],
+            idle="%.2f" % summary["critical_idle"],
+            height=base + 10,
+            labels=''.join(labels),
+            ticks=''.join(ticks),
+            bars=''.join(bars),
+            points=" ".join(points),
+            base=base,
+            peak_y=base - 55,
+            right=left + width,
+        )
 
     def _generate_ending(self):
         return self.ENDING_TMPL
 
 
+# 历次运行的用例结果保存在 sqlite 里，用于统计不稳定率等
+class RunHistory(object):
+    """
+    Results of previous runs, one row per test per run, in a SQLite file.
+
+    Each run is recorded once at the end with record_run(); statistics such
+    as flake_rates() are computed over the most recent `window` runs.
+    """
+
+    def __init__(self, path, window=30):
+        self.path = path
+        self.window = window
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, start_time TEXT);
+            CREATE TABLE IF NOT EXISTS results (
+                run_id TEXT, test_id TEXT, status INTEGER, duration REAL, attempts INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS results_test ON results (test_id, run_id);
+        """)
+
+    def record_run(self, run_id, start_time, rows):
+        """ rows: [(用例 id, 结果代码, 耗时, 执行次数)] """
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (run_id, start_time))
+            self.conn.execute("DELETE FROM results WHERE run_id = ?", (run_id,))
+            self.conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?)",
+                                  [(run_id,) + tuple(row) for row in rows])
+
+    def _recent_runs(self):
+        return "SELECT run_id FROM runs ORDER BY start_time DESC LIMIT %d" % int(self.window)
+
+    def flake_rates(self):
+        """ 返回 {用例 id: (不稳定次数, 运行次数)}，只包含出现过不稳定的用例 """
+        rows = self.conn.execute(
+            "SELECT test_id, SUM(status = 3), COUNT(*) FROM results WHERE run_id IN (%s) "
+            "GROUP BY test_id HAVING SUM(status = 3) > 0" % self._recent_runs())
+        return dict((test_id, (flaky, runs)) for test_id, flaky, runs in rows)
+
+    def duration_baselines(self, min_runs=5):
+        """ 返回 {用例 id: (耗时中位数, 耗时 MAD)}，只统计通过的运行，少于 min_runs 次的用例不返回 """
+        durations = {}
+        rows = self.conn.execute(
+            "SELECT test_id, duration FROM results WHERE run_id IN (%s) AND status IN (0, 3)" % self._recent_runs())
+        for test_id, duration in rows:
+            durations.setdefault(test_id, []).append(duration)
+        baselines = {}
+        for test_id, values in durations.items():
+            if len(values) < min_runs:
+                continue
+            median = _median(values)
+            baselines[test_id] = (median, _median([abs(v - median) for v in values]))
+        return baselines
+
+    def last_run_time(self):
+        """ 最近一次运行的开始时间（datetime），没有记录时返回 None """
+        row = self.conn.execute("SELECT MAX(start_time) FROM runs").fetchone()
+        if not row or not row[0]:
+            return None
+        return datetime.datetime.fromisoformat(row[0])
+
+    def last_statuses(self):
+        """ 返回 {用例 id: 最近 window 次运行中该用例最后一次执行的结果代码}；只执行了部分用例的运行不会抹掉其他用例的结果 """
+        rows = self.conn.execute(
+            "SELECT results.test_id, results.status FROM results JOIN runs ON results.run_id = runs.run_id "
+            "WHERE results.run_id IN (%s) ORDER BY runs.start_time" % self._recent_runs())
+        return dict(rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+# 执行顺序：上次失败的用例先执行，其次是上次运行后改过的文件里的用例，其余按历史耗时从短到长
+class TestOrder(object):
+    """
+    Reorder tests so that a broken build fails early.
+
+    `strategies` are applied in turn: "failed" puts tests that failed or
+    errored the last time they ran (within the history window) first,
+    "changed" then puts tests whose module file was modified since the last
+    recorded run (newest first), and "duration" sorts the rest by their
+    median duration, shortest first. Tests stay grouped by class, and
+    classes by module, so setUpClass/tearDownClass and
+    setUpModule/tearDownModule still run once; a module is placed by its
+    most urgent test.
+    """
+
+    STRATEGIES = ("failed", "changed", "duration")
+    # 没有历史记录时，把最近多少小时内改过的文件视为改动
+    CHANGED_HOURS = 24
+
+    def __init__(self, history_path=None, strategies=STRATEGIES):
+        if isinstance(strategies, str):
+            strategies = [name.strip() for name in strategies.split(",") if name.strip()]
+        unknown = [name for name in strategies if name not in self.STRATEGIES]
+        if unknown:
+            raise ValueError("unknown test order %s, expected some of %s" % (", ".join(unknown), ", ".join(self.STRATEGIES)))
+        self.strategies = tuple(strategies)
+        self.statuses = {}
+        self.durations = {}
+        since = None
+        if history_path:
+            history = RunHistory(history_path)
+            try:
+                self.statuses = history.last_statuses()
+                self.durations = dict((test_id, median) for test_id, (median, _) in history.duration_baselines(1).items())
+                since = history.last_run_time()
+            finally:
+                history.close()
+        if since is None:
+            since = datetime.datetime.now() - datetime.timedelta(hours=self.CHANGED_HOURS)
+        self.changed_since = time.mktime(since.timetuple()) + since.microsecond / 1e6
+        self._mtimes = {}
+        # 排序后各类用例的数量，用于报告
+        self.counts = {}
+
+    def _module_mtime(self, module_name):
+        if module_name not in self._mtimes:
+            path = getattr(sys.modules.get(module_name), "__file__", None)
+            if path is None:
+                # 多进程模式下主进程没有导入用例模块，只查找文件位置
+                try:
+                    spec = importlib.util.find_spec(module_name)
+                    path = spec is not None and spec.origin or None
+                except (ImportError, ValueError):
+                    path = None
+            try:
+                self._mtimes[module_name] = path and os.path.getmtime(path) or 0.0
+            except OSError:
+                self._mtimes[module_name] = 0.0
+        return self._mtimes[module_name]
+
+    def key(self, test_id, module_name):
+        key = []
+        for name in self.strategies:
+            if name == "failed":
+                key.append(int(self.statuses.get(test_id) not in (1, 2)))
+            elif name == "changed":
+                mtime = self._module_mtime(module_name)
+                key.extend(mtime > self.changed_since and (0, -mtime) or (1, 0.0))
+            else:
+                key.append(self.durations.get(test_id, 0.0))
+        return tuple(key)
+
+    def sort(self, tests):
+        """ tests 是 TestCase 或用例 id 的列表，返回排好序的新列表 """
+        # {模块: {类: [(排序键, 原顺序, 用例 id, 用例)]}}
+        modules = {}
+        for index, test in enumerate(tests):
+            if isinstance(test, str):
+                test_id = test
+                class_key = test.rsplit(".", 1)[0]
+                module_name = class_key.rsplit(".", 1)[0]
+            else:
+                test_id = test.id()
+                class_key = (test.__class__.__module__, test.__class__.__qualname__)
+                module_name = test.__class__.__module__
+            modules.setdefault(module_name, {}).setdefault(class_key, []).append(
+                (self.key(test_id, module_name), index, test_id, test))
+        # 类内按排序键排，类按其中最靠前的用例排，模块按其中最靠前的类排；
+        # 不同模块的类不交错，setUpModule/tearDownModule 不会因为切换模块而重复执行
+        groups = []
+        for classes in modules.values():
+            for items in classes.values():
+                items.sort(key=lambda item: item[:2])
+            ranked = sorted(classes.values(), key=lambda items: items[0][:2])
+            groups.append((ranked[0][0][:2], ranked))
+        ordered = []
+        for _, ranked in sorted(groups, key=lambda group: group[0]):
+            for items in ranked:
+                ordered.extend(items)
+        self.counts = {
+            "failed": sum(1 for item in ordered if self.statuses.get(item[2]) in (1, 2)),
+            "changed": sum(1 for item in ordered if "changed" in self.strategies
+                           and self._changed(item[3])),
+        }
+        return [item[3] for item in ordered]
+
+    def _changed(self, test):
+        if isinstance(test, str):
+            module_name = test.rsplit(".", 2)[0]
+        else:
+            module_name = test.__class__.__module__
+        return self._module_mtime(module_name) > self.changed_since
+
+    def describe(self):
+        names = {"failed": "上次失败的 %s 个用例优先" % self.counts.get("failed", 0),
+                 "changed": "改动过的文件里的 %s 个用例优先" % self.counts.get("changed", 0),
+                 "duration": "其余按历史耗时从短到长"}
+        return "，".join(names[name] for name in self.strategies)
+
+
+# 按用例记录执行过的源文件：3.12 起用 sys.monitoring，每个函数只在第一次执行时回调一次；更早的版本用 sys.settrace 只跟踪函数调用
+class _FileTracer(object):
+    """
+    Record which source files under `root` each test executes. Only
+    function starts are watched, which is all file-level coverage needs.
+    Files touched between tests (setUpClass, setUpModule) are added to
+    every test of the class that starts next. While `hold` is set (async
+    classes, whose tests run interleaved) every test gets all files the
+    class has executed so far.
+
+    Python 3.12+ uses sys.monitoring. Older versions use coverage.py when it
+    is installed (its C tracer skips code outside `root` much faster) and
+    fall back to sys.settrace otherwise; both slow the tests down, so
+    recording is meant for scheduled full runs.
+
+    With coverage.py each test (and each stretch between tests) runs in its
+    own dynamic context via switch_context(); end() returns None and the
+    files of those tests come from collect(), which reads the coverage data
+    once (CoverageData.contexts_by_lineno) instead of stopping the tracer
+    around every test.
+    """
+
+    TOOL_NAME = "HTMLTestReportCN"
+    # coverage.py 在没有数据、文件无法解析等情况下的警告，对记录文件列表没有影响
+    COVERAGE_WARNINGS = ["no-data-collected", "module-not-measured", "module-not-imported", "couldnt-parse"]
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        # 标准库、site-packages 和本模块自己不算被测代码
+        self.excluded = tuple(set(os.path.join(os.path.abspath(prefix), "") for prefix in (sys.prefix, sys.base_prefix, sys.exec_prefix)
+                                  if os.path.abspath(prefix) != self.root))
+        self.own_file = os.path.abspath(__file__)
+        self.files = set()
+        self.class_files = {}
+        self.hold = False
+        self._known = {}
+        self._tool = None
+        self._coverage = None
+        # coverage.py：当前动态上下文的名字和编号，{类: [用例之间的上下文]}，{用例 id: [上下文]}，以及已经读出的 {上下文: 文件}
+        self._context = None
+        self._context_count = 0
+        self._hold_context = None
+        self.class_contexts = {}
+        self._deferred = {}
+        self._context_files = {}
+        self._previous = None
+        self._previous_thread = None
+
+    def install(self):
+        monitoring = getattr(sys, "monitoring", None)
+        if monitoring is not None:
+            try:
+                monitoring.use_tool_id(monitoring.COVERAGE_ID, self.TOOL_NAME)
+            except ValueError:
+                # coverage.py 等已经占用了覆盖工具的编号
+                monitoring = None
+        if monitoring is not None:
+            self._tool = monitoring.COVERAGE_ID
+            monitoring.register_callback(self._tool, monitoring.events.PY_START, self._on_start)
+            monitoring.set_events(self._tool, monitoring.events.PY_START)
+            return
+        # 两种方式都会替换 sys 和 threading 的跟踪函数，卸载时恢复原来的
+        self._previous = sys.gettrace()
+        self._previous_thread = getattr(threading, "gettrace", lambda: None)()
+        if coverage_py is not None:
+            self._coverage = coverage_py.Coverage(
+                data_file=None, config_file=False, include=[os.path.join(self.root, "*")],
+                omit=[self.own_file] + [os.path.join(prefix, "*") for prefix in self.excluded])
+            self._coverage.set_option("run:disable_warnings", self.COVERAGE_WARNINGS)
+            self._coverage.start()
+            self._switch("gap")
+        else:
+            sys.settrace(self._trace)
+            threading.settrace(self._trace)
+
+    def uninstall(self):
+        if self._tool is not None:
+            sys.monitoring.set_events(self._tool, 0)
+            sys.monitoring.register_callback(self._tool, sys.monitoring.events.PY_START, None)
+            sys.monitoring.free_tool_id(self._tool)
+            self._tool = None
+            return
+        if self._coverage is not None:
+            self._coverage.stop()
+            self._coverage.erase()
+            self._coverage = None
+        sys.settrace(self._previous)
+        threading.settrace(self._previous_thread)
+        self._previous = self._previous_thread = None
+
+    def _relative(self, filename):
+        """ root 下的被测源文件返回相对路径，其他返回 None """
+        rel = self._known.get(filename, False)
+        if rel is False:
+            path = os.path.abspath(filename)
+            rel = None
+            if (not filename.startswith("<") and path.startswith(self.root + os.sep) and path != self.own_file
+                    and not path.startswith(self.excluded)):
+                rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+            self._known[filename] = rel
+        return rel
+
+    def _note(self, filename):
+        rel = self._relative(filename)
+        if rel is not None:
+            self.files.add(rel)
+
+    def _on_start(self, code, offset):
+        self._note(code.co_filename)
+        # 同一个函数在本用例里不再回调，begin/end 时 restart_events 重新打开
+        return sys.monitoring.DISABLE
+
+    def _trace(self, frame, event, arg):
+        if event == "call":
+            self._note(frame.f_code.co_filename)
+        return None
+
+    def _restart(self):
+        if self._tool is not None:
+            sys.monitoring.restart_events()
+
+    def _switch(self, kind):
+        self._context_count += 1
+        self._context = "%s-%s" % (kind, self._context_count)
+        self._coverage.switch_context(self._context)
+
+    def begin(self, test):
+        if self._coverage is not None:
+            if self.hold and self._hold_context is not None:
+                return
+            # 上一段用例之间的上下文算在这个类的每个用例上；异步类的用例交错执行，共用一个上下文
+            self.class_contexts.setdefault(test.__class__, []).append(self._context)
+            self._switch(self.hold and "class" or "test")
+            if self.hold:
+                self._hold_context = self._context
+            return
+        if self.hold:
+            return
+        # 两个用例之间执行的是 setUpClass、setUpModule 等，算在接下来这个类的每个用例上
+        self.class_files.setdefault(test.__class__, set()).update(self.files)
+        self.files = set()
+        self._restart()
+
+    def end(self, test):
+        if self._coverage is not None:
+            # 文件在 collect() 时才知道
+            self._deferred[test.id()] = self.class_contexts.get(test.__class__, []) + [self._hold_context or self._context]
+            if not self.hold:
+                self._switch("gap")
+            return None
+        files = sorted(self.files | self.class_files.get(test.__class__, set()))
+        if not self.hold:
+            self.files = set()
+            self._restart()
+        return files
+
+    def release(self):
+        self.hold = False
+        if self._coverage is not None:
+            self._hold_context = None
+            self._switch("gap")
+            return
+        self.files = set()
+        self._restart()
+
+    def collect(self):
+        """
+        Return {test id: [files]} for the tests whose files end() left to
+        coverage.py, reading its data once. Empty for the other backends.
+        """
+        if self._coverage is None or not self._deferred:
+            return {}
+        self._coverage.stop()
+        data = self._coverage.get_data()
+        for filename in data.measured_files():
+            rel = self._relative(filename)
+            if rel is None:
+                continue
+            for contexts in data.contexts_by_lineno(filename).values():
+                for context in contexts:
+                    self._context_files.setdefault(context, set()).add(rel)
+        self._coverage.erase()
+        self._coverage.start()
+        self._coverage.switch_context(self._context)
+        deferred, self._deferred = self._deferred, {}
+        return dict((test_id, sorted(set().union(*(self._context_files.get(c, ()) for c in contexts))))
+                    for test_id, contexts in deferred.items())
+
+
+# 覆盖索引：全量运行时记录每个用例执行过的源文件，之后只执行受改动影响的用例
+class CoverageMap(object):
+    """
+    Index of the source files each test executed in a recording run, used
+    to select only the tests a change can affect.
+
+    select() keeps the tests that executed a changed file and the tests
+    the index knows nothing about (new tests, or tests recorded without
+    coverage); the rest are skipped with a reason. A changed .py file that
+    no recorded test executed (e.g. a module only read for its constants
+    at import time) could affect anything, so all tests run. Paths are stored
+    relative to `root`, each file once, so the index stays small. A path
+    ending in .gz is compressed.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, root=None):
+        self.path = path
+        self.root = os.path.abspath(root or os.getcwd())
+        # {用例 id: set(相对路径)}
+        self.tests = {}
+        self.recorded_at = None
+        # 最后一次 select() 的统计，用于报告
+        self.stats = {}
+        self._load()
+
+    def _open(self, path, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(path, mode + "t", encoding="utf-8")
+        return open(path, mode, encoding="utf-8")
+
+    def _load(self):
+        try:
+            with self._open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError, EOFError):
+            return
+        if data.get("version") != self.VERSION:
+            return
+        files = data["files"]
+        self.tests = dict((test_id, set(files[i] for i in indexes)) for test_id, indexes in data["tests"].items())
+        self.recorded_at = data.get("recorded_at")
+
+    def update(self, coverage):
+        """ coverage 为 {用例 id: 源文件列表}，同一个用例以本次记录为准 """
+        for test_id, files in coverage.items():
+            self.tests[test_id] = set(files)
+        self.recorded_at = str(datetime.datetime.now())[:19]
+
+    def save(self):
+        files = sorted(set(f for test_files in self.tests.values() for f in test_files))
+        index = dict((f, i) for i, f in enumerate(files))
+        data = {
+            "version": self.VERSION,
+            "recorded_at": self.recorded_at,
+            "files": files,
+            "tests": dict((test_id, sorted(index[f] for f in test_files)) for test_id, test_files in self.tests.items()),
+        }
+        tmp_file = self.path + ".%s.tmp" % os.getpid()
+        with self._open(tmp_file, "w") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_file, self.path)
+
+    def _relative(self, path):
+        path = os.path.abspath(os.path.join(self.root, path))
+        if not path.startswith(self.root + os.sep):
+            return None
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def _module_file(self, module_name):
+        """ 模块源文件相对 root 的路径；已导入的模块按 __file__（包是 __init__.py），没导入的（多进程模式下主进程不导入用例）按模块名推算 """
+        path = getattr(sys.modules.get(module_name), "__file__", None)
+        if path:
+            return self._relative(path)
+        return module_name.replace(".", "/") + ".py"
+
+    def git_changed_files(self, base):
+        """ 与 base（如 "origin/master"）分叉之后改动过的文件，包括还没提交的改动和新文件 """
+        def git(*args):
+            return subprocess.check_output(("git",) + args, cwd=self.root, universal_newlines=True,
+                                           stderr=subprocess.DEVNULL).splitlines()
+        top = git("rev-parse", "--show-toplevel")[0]
+        merge_base = git("merge-base", base, "HEAD")[0]
+        names = git("diff", "--name-only", merge_base) + git("ls-files", "--others", "--exclude-standard")
+        return [os.path.join(top, name) for name in names if name]
+
+    def select(self, tests, changed_files):
+        """ tests 是 TestCase 或用例 id 的列表，返回 (要执行的用例, [(跳过的用例, 原因)]) """
+        changed = set(self._relative(path) for path in changed_files)
+        changed.discard(None)
+        covered = set(f for test_files in self.tests.values() for f in test_files)
+        test_modules = set()
+        for module_name in set(isinstance(t, str) and t.rsplit(".", 2)[0] or t.__class__.__module__ for t in tests):
+            test_modules.add(self._module_file(module_name))
+        # 新的用例文件里的用例本来就会执行，其他没有覆盖记录的源文件无法判断影响范围
+        unknown_sources = sorted(f for f in changed - covered - test_modules if f.endswith(".py"))
+        selected, skipped = [], []
+        affected = unknown = 0
+        for t in tests:
+            test_id = isinstance(t, str) and t or t.id()
+            files = self.tests.get(test_id)
+            if not files:
+                # 新增的用例，或者记录覆盖时没有执行过的用例
+                selected.append(t)
+                unknown += 1
+            elif files & changed or unknown_sources:
+                selected.append(t)
+                affected += 1
+            else:
+                skipped.append((t, "与改动无关：执行过的 %s 个源文件都没有改动（覆盖记录于 %s）" % (len(files), self.recorded_at)))
+        self.stats = dict(changed=len(changed), uncovered=len(changed - covered), affected=affected,
+                          unknown=unknown, skipped=len(skipped), unknown_sources=unknown_sources)
+        return selected, skipped
+
+    def describe(self):
+        stats = self.stats
+        if stats["unknown_sources"]:
+            return "改动的 %s 等 %s 个源文件没有被任何用例执行过，无法判断影响范围，执行全部用例" % (
+                stats["unknown_sources"][0], len(stats["unknown_sources"]))
+        text = "改动 %s 个文件，执行受影响的 %s 个用例和没有覆盖记录的 %s 个用例，跳过 %s 个不受影响的用例" % (
+            stats["changed"], stats["affected"], stats["unknown"], stats["skipped"])
+        if stats["uncovered"]:
+            text += "；%s 个改动的文件没有被任何用例执行过" % stats["uncovered"]
+        return text
+
+
+# 每次运行的机器可读结果：第一行是运行信息，之后每行一个用例，按行读写，几万个用例也不用一次载入整个 JSON
+class RunResults(object):
+    """
+    Results of one run in a JSON Lines file (gzip-compressed when the path
+    ends with .gz): a first {"run": {...}} line, then one object per test
+    with id, status, duration, class, doc and the error summary (the
+    exception line, e.g. "AssertionError: 1 != 2").
+    """
+
+    def __init__(self, info, tests):
+        self.info = info
+        # {用例 id: {"status", "duration", "class", "doc", "error"}}
+        self.tests = tests
+
+    @staticmethod
+    def _open(path, mode):
+        if path.endswith(".gz"):
+            return gzip.open(path, mode + "t", encoding="utf-8")
+        return open(path, mode, encoding="utf-8")
+
+    @classmethod
+    def save(cls, path, info, records):
+        tmp_file = path + ".tmp" + (path.endswith(".gz") and ".gz" or "")
+        with cls._open(tmp_file, "w") as f:
+            f.write(json.dumps({"run": info}, ensure_ascii=False) + "\n")
+            for n, t, o, e, s in records:
+                error = e and n in (1, 2) and _error_summary(e) or ""
+                f.write(json.dumps({
+                    "id": t.id(),
+                    "status": n,
+                    "duration": s,
+                    "class": t.__class__.__name__,
+                    "doc": t.shortDescription() or "",
+                    "error": error,
+                }, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        info = {}
+        tests = {}
+        with cls._open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if "run" in item:
+                    info = item["run"]
+                else:
+                    tests[item.pop("id")] = item
+        return cls(info, tests)
+
+
+# 用例的起止时间和所在进程：分配通道、找关键路径、导出 Chrome trace-event
+class RunTimeline(object):
+    """
+    Per-test start/end times, worker and phases of a run.
+
+    Tests of one worker that overlap in time (async mode) are spread over
+    lanes, so each lane is a sequence of non-overlapping tests. The critical
+    path is the lane that finished last: its tests and the gaps between them
+    are what the total run time is made of.
+    """
+
+    def __init__(self, timeline):
+        self.entries = sorted((dict(entry, id=test_id) for test_id, items in timeline.items() for entry in items),
+                              key=lambda entry: (entry["start"], entry["end"]))
+        self.start = self.entries and self.entries[0]["start"] or 0.0
+        self.end = max([entry["end"] for entry in self.entries] or [self.start])
+        self.rows = self._assign_lanes()
+        self._mark_critical()
+
+    def _assign_lanes(self):
+        lanes = {}
+        workers = []
+        for entry in self.entries:
+            if entry["worker"] not in lanes:
+                lanes[entry["worker"]] = []
+                workers.append(entry["worker"])
+            ends = lanes[entry["worker"]]
+            for i, end in enumerate(ends):
+                if end <= entry["start"]:
+                    ends[i] = entry["end"]
+                    entry["lane"] = i
+                    break
+            else:
+                entry["lane"] = len(ends)
+                ends.append(entry["end"])
+        return [(worker, i) for worker in workers for i in range(len(lanes[worker]))]
+
+    def _mark_critical(self):
+        if not self.entries:
+            return
+        last = max(self.entries, key=lambda entry: entry["end"])
+        for entry in self.entries:
+            entry["critical"] = (entry["worker"], entry["lane"]) == (last["worker"], last["lane"])
+
+    def concurrency(self):
+        """ 同时执行的用例数随时间的变化 [(时间, 用例数)] """
+        changes = sorted([(entry["start"], 1) for entry in self.entries] + [(entry["end"], -1) for entry in self.entries],
+                         key=lambda item: (item[0], item[1]))
+        steps, level = [], 0
+        for t, delta in changes:
+            level += delta
+            if steps and steps[-1][0] == t:
+                steps[-1] = (t, level)
+            else:
+                steps.append((t, level))
+        return steps
+
+    def summary(self):
+        makespan = self.end - self.start
+        busy = sum(entry["end"] - entry["start"] for entry in self.entries)
+        critical = [entry for entry in self.entries if entry.get("critical")]
+        critical_time = sum(entry["end"] - entry["start"] for entry in critical)
+        return {
+            "makespan": makespan,
+            "busy": busy,
+            "parallelism": makespan > 0 and busy / makespan or 0.0,
+            "critical": critical_time,
+            "critical_count": len(critical),
+            "critical_idle": max(makespan - critical_time, 0.0),
+        }
+
+    def trace_events(self, title=None):
+        """ Chrome trace-event 格式：每个进程一个 pid，每个通道一个 tid，用例和阶段是嵌套的完整事件 """
+        pids = {}
+        events = []
+        for worker, lane in self.rows:
+            if worker not in pids:
+                pids[worker] = len(pids) + 1
+                events.append({"ph": "M", "name": "process_name", "pid": pids[worker], "tid": 0, "args": {"name": worker}})
+                events.append({"ph": "M", "name": "process_sort_index", "pid": pids[worker], "tid": 0,
+                               "args": {"sort_index": pids[worker]}})
+            events.append({"ph": "M", "name": "thread_name", "pid": pids[worker], "tid": lane + 1,
+                           "args": {"name": "通道 %s" % (lane + 1)}})
+
+        def us(t):
+            return round((t - self.start) * 1e6, 1)
+
+        for entry in self.entries:
+            pid, tid = pids[entry["worker"]], entry["lane"] + 1
+            status = entry["status"]
+            events.append({
+                "ph": "X", "cat": "test", "name": entry["id"], "pid": pid, "tid": tid,
+                "ts": us(entry["start"]), "dur": round((entry["end"] - entry["start"]) * 1e6, 1),
+                "args": {"status": status is not None and Template_mixin.STATUS[status] or "跳过",
+                         "retry": bool(entry.get("retry")), "critical": bool(entry.get("critical"))},
+            })
+            for name, start, end in entry.get("phases") or ():
+                events.append({"ph": "X", "cat": "phase", "name": name, "pid": pid, "tid": tid,
+                               "ts": us(start), "dur": round((end - start) * 1e6, 1)})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"title": title or "", "start_time": self.start}}
+
+    def save(self, path, title=None):
+        tmp_file = path + ".tmp" + (path.endswith(".gz") and ".gz" or "")
+        opener = path.endswith(".gz") and gzip.open or open
+        with opener(tmp_file, "wt", encoding="utf-8") as f:
+            json.dump(self.trace_events(title), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_file, path)
+
+
+# 运行统计导出为 OpenMetrics 文本，供 node_exporter 的 textfile collector 采集
+class MetricsExporter(object):
+    """
+    Write run statistics as an OpenMetrics textfile: test counts by status,
+    pass ratio, run duration, retry and screenshot counts, and a per-class
+    duration histogram. Only the `max_classes` classes with the most tests
+    get their own `class` label, the rest are summed into class="other",
+    so the series count stays bounded however many tests there are.
+    `labels` are added to every series, e.g. {"job": "nightly"}.
+    """
+
+    PREFIX = "htmlrunner_"
+    BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+    STATUS_NAMES = ("passed", "failed", "error", "flaky", "not_run")
+
+    def __init__(self, path, labels=None, max_classes=20, buckets=BUCKETS):
+        self.path = path
+        self.labels = dict(labels or {})
+        self.max_classes = max_classes
+        self.buckets = tuple(sorted(buckets))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, result, start_time, interval):
+        """ 运行期间每 interval 秒刷新一次文件 """
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.write(result, start_time, running=True)
+                except OSError:
+                    pass
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name="MetricsExporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def write(self, result, start_time, running=False):
+        tmp_file = self.path + ".%s.tmp" % os.getpid()
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(self.render(result, start_time, running))
+        # textfile collector 可能随时读取，必须整体替换
+        os.replace(tmp_file, self.path)
+
+    def render(self, result, start_time, running=False):
+        # 运行期间 result 还在追加，先取一份快照
+        records = list(result.result)
+        counts = [0] * len(self.STATUS_NAMES)
+        classes = {}
+        screenshots = 0
+        for n, t, o, e, s in records:
+            counts[n] += 1
+            if n == 4:
+                continue
+            name = "%s.%s" % (t.__class__.__module__, t.__class__.__name__)
+            classes.setdefault(name, []).append(s)
+            screenshots += len(re.findall(r"errorImg\[", o or ""))
+        retries = sum(len(attempts) - 1 for attempts in list(result.attempts.values()))
+        total = len(records) - counts[4]
+        duration = (datetime.datetime.now() - start_time).total_seconds()
+
+        lines = []
+        self._family(lines, "tests", "gauge", "Tests in the run by final status.",
+                     [(dict(status=status), counts[n]) for n, status in enumerate(self.STATUS_NAMES)])
+        self._family(lines, "pass_ratio", "gauge", "Passed and flaky tests divided by all tests.",
+                     [({}, total and float(counts[0] + counts[3]) / total or 0.0)])
+        self._family(lines, "run_duration_seconds", "gauge", "Wall time of the run so far.", [({}, duration)])
+        self._family(lines, "run_start_timestamp_seconds", "gauge", "Unix time the run started.",
+                     [({}, time.mktime(start_time.timetuple()) + start_time.microsecond / 1e6)])
+        self._family(lines, "run_in_progress", "gauge", "1 while the run is still executing.",
+                     [({}, running and 1 or 0)])
+        self._family(lines, "retries", "gauge", "Extra attempts made by failure retries.", [({}, retries)])
+        self._family(lines, "screenshots", "gauge", "Screenshots attached to test output.", [({}, screenshots)])
+
+        samples = []
+        for name, durations in self._bounded_classes(classes):
+            durations.sort()
+            index = 0
+            for bound in self.buckets:
+                while index < len(durations) and durations[index] <= bound:
+                    index += 1
+                samples.append(("_bucket", dict({"class": name}, le=repr(bound)), index))
+            samples.append(("_bucket", {"class": name, "le": "+Inf"}, len(durations)))
+            samples.append(("_count", {"class": name}, len(durations)))
+            samples.append(("_sum", {"class": name}, sum(durations)))
+        self._family(lines, "test_duration_seconds", "histogram", "Test durations by test class.", samples)
+        lines.append("# EOF\n")
+        return "".join(lines)
+
+    def _bounded_classes(self, classes):
+        ordered = sorted(classes.items(), key=lambda item: (-len(item[1]), item[0]))
+        kept = ordered[:self.max_classes]
+        rest = [s for _, durations in ordered[self.max_classes:] for s in durations]
+        if rest:
+            kept.append(("other", rest))
+        return kept
+
+    def _family(self, lines, name, kind, help_text, samples):
+        name = self.PREFIX + name
+        lines.append("# TYPE %s %s\n" % (name, kind))
+        lines.append("# HELP %s %s\n" % (name, help_text))
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ("",) + sample
+            labels = dict(self.labels, **labels)
+            label_text = ",".join('%s="%s"' % (key, self._escape(value)) for key, value in sorted(labels.items()))
+            lines.append("%s%s%s %s\n" % (name, suffix, label_text and "{" + label_text + "}" or "", self._number(value)))
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @staticmethod
+    def _number(value):
+        if isinstance(value, float):
+            return repr(round(value, 6))
+        return str(value)
+
+
+# 结果根目录的 index.html：页面本身不变，运行记录逐行追加到 runs.js，新增一次运行的开销与已有多少次运行无关
+class RunIndex(object):
+    """
+    Dashboard of all runs under a result root.
+
+    add_run() writes <run dir>/summary.json and appends one addRun({...})
+    line to <root>/runs.js; index.html is written once and renders the runs
+    (totals, pass rate, duration and per-title trend sparklines) from
+    runs.js in the browser. Appends are single writes to a file opened in
+    append mode, so runs finishing at the same time do not corrupt it.
+    mark_runs() rewrites the lines of runs that ResultRetention compacted
+    or archived, so their rows no longer link to a deleted report.
+    """
+
+    INDEX_VERSION = "2"
+
+    INDEX_TMPL = r"""<!DOCTYPE html>
+<!-- RunIndex %(version)s -->
+<html>
+<head>
+    <title>测试报告汇总</title>
+    <meta http-equiv="Content-Type" content="text/html; charset=UTF-8"/>
+    <link href="http://libs.baidu.com/bootstrap/3.0.3/css/bootstrap.min.css" rel="stylesheet">
+<style type="text/css" media="screen">
+body        { font-family: Microsoft YaHei;padding: 20px; }
+.trend      { float: left; margin: 0 30px 20px 0; }
+.trend svg  { display: block; border-bottom: 1px solid #ddd; }
+.passCase   { color: #5cb85c; }
+.failCase   { color: #d9534f; font-weight: bold; }
+#runs_table { clear: both; }
+</style>
+<script type="text/javascript">
+var runs = [];
+function addRun(run) { runs.push(run); }
+</script>
+<script type="text/javascript" src="runs.js"></script>
+</head>
+<body>
+<h1>测试报告汇总</h1>
+<div id="trends"></div>
+<table id="runs_table" class="table table-condensed table-bordered table-hover">
+<thead>
+<tr class="text-center success" style="font-weight: bold;">
+    <td>开始时间</td><td>标题</td><td>总计</td><td>通过</td><td>失败</td><td>错误</td><td>不稳定</td><td>通过率</td><td>耗时</td><td>报告</td>
+</tr>
+</thead>
+<tbody id="runs_body"></tbody>
+</table>
+<a id="more" href="javascript:showMore()">显示更多</a>
+<script type="text/javascript">
+var shown = 0;
+
+function escapeHtml(s) {
+    return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+}
+
+// 折线图：values 按时间先后排列
+function sparkline(values, color) {
+    var width = 240, height = 40, max = Math.max.apply(null, values), min = Math.min.apply(null, values);
+    var points = [];
+    for (var i = 0; i < values.length; i++) {
+        var x = values.length > 1 ? i * width / (values.length - 1) : width / 2;
+        var y = max > min ? height - 2 - (values[i] - min) * (height - 4) / (max - min) : height / 2;
+        points.push(x.toFixed(1) + ',' + y.toFixed(1));
+    }
+    return '<svg width="' + width + '" height="' + height + '"><polyline fill="none" stroke="' + color
+        + '" stroke-width="1.5" points="' + points.join(' ') + '"/></svg>';
+}
+
+function showTrends() {
+    var byTitle = {}, titles = [];
+    for (var i = 0; i < runs.length; i++) {
+        var title = runs[i].title;
+        if (!byTitle[title]) { byTitle[title] = []; titles.push(title); }
+        byTitle[title].push(runs[i]);
+    }
+    var html = [];
+    for (var i = 0; i < titles.length; i++) {
+        var recent = byTitle[titles[i]].slice(-50), rates = [], durations = [];
+        for (var j = 0; j < recent.length; j++) {
+            rates.push(recent[j].passrate);
+            durations.push(recent[j].duration);
+        }
+        var last = recent[recent.length - 1];
+        html.push('<div class="trend"><strong>' + escapeHtml(titles[i]) + '</strong>（最近 ' + recent.length + ' 次）'
+            + '<div>通过率 ' + last.passrate + '%%</div>' + sparkline(rates, '#5cb85c')
+            + '<div>耗时 ' + last.duration + '秒</div>' + sparkline(durations, '#f0ad4e') + '</div>');
+    }
+    document.getElementById('trends').innerHTML = html.join('');
+}
+
+// 压缩后的运行没有报告，归档的运行链接到压缩包
+function reportLink(run) {
+    if (run.archive) { return '<a href="' + encodeURI(run.archive) + '">已归档</a>'; }
+    if (run.compacted) { return '已压缩'; }
+    return '<a href="' + encodeURI(run.report) + '">查看</a>';
+}
+
+// 最新的在前，每次显示 200 条
+function showMore() {
+    var html = [], end = Math.min(shown + 200, runs.length);
+    for (var i = shown; i < end; i++) {
+        var run = runs[runs.length - 1 - i];
+        html.push('<tr class="text-center"><td>' + escapeHtml(run.start_time) + '</td><td>' + escapeHtml(run.title)
+            + '</td><td>' + run.count + '</td><td class="passCase">' + (run.Pass + run.flaky) + '</td><td'
+            + (run.fail ? ' class="failCase"' : '') + '>' + run.fail + '</td><td' + (run.error ? ' class="failCase"' : '')
+            + '>' + run.error + '</td><td>' + run.flaky + '</td><td>' + run.passrate + '%%</td><td>' + run.duration
+            + '秒</td><td>' + reportLink(run) + '</td></tr>');
+    }
+    document.getElementById('runs_body').insertAdjacentHTML('beforeend', html.join(''));
+    shown = end;
+    document.getElementById('more').style.display = (shown < runs.length) ? '' : 'none';
+}
+
+showTrends();
+showMore();
+</script>
+</body>
+</html>
+"""  # variables: (version)
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, "index.html")
+        self.runs_path = os.path.join(root, "runs.js")
+
+    def add_run(self, run_dir, report_path, info):
+        summary = dict(info, report=os.path.relpath(report_path, self.root).replace(os.sep, "/"))
+        tmp_file = os.path.join(run_dir, "summary.json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, os.path.join(run_dir, "summary.json"))
+        line = "addRun(%s);\n" % json.dumps(summary, ensure_ascii=False).replace("</", "<\\/")
+        with open(self.runs_path, "a", encoding="utf-8") as f:
+            f.write(line)
+        self._write_index()
+
+    def mark_runs(self, changes):
+        """ changes 为 {运行文件夹: 要合并进该运行记录的字段}，例如 {"compacted": True} 或 {"archive": 压缩包的相对路径} """
+        if not changes or not os.path.isfile(self.runs_path):
+            return
+        changes = dict((os.path.normcase(os.path.abspath(run_dir)), fields) for run_dir, fields in changes.items())
+        with open(self.runs_path, "rb") as f:
+            data = f.read()
+        lines = data.decode("utf-8").splitlines(True)
+        changed = False
+        for i, line in enumerate(lines):
+            if not (line.startswith("addRun(") and line.rstrip().endswith(");")):
+                continue
+            try:
+                summary = json.loads(line.rstrip()[len("addRun("):-2])
+            except ValueError:
+                continue
+            run_dir = os.path.dirname(os.path.join(self.root, summary.get("report") or ""))
+            fields = changes.get(os.path.normcase(os.path.abspath(run_dir)))
+            if fields:
+                summary.update(fields)
+                lines[i] = "addRun(%s);\n" % json.dumps(summary, ensure_ascii=False).replace("</", "<\\/")
+                changed = True
+        if not changed:
+            return
+        # 写临时文件再替换；读取之后其他运行追加的行在替换前补到临时文件末尾
+        tmp_file = self.runs_path + ".%s.tmp" % os.getpid()
+        with open(tmp_file, "wb") as f:
+            f.write("".join(lines).encode("utf-8"))
+            with open(self.runs_path, "rb") as current:
+                current.seek(len(data))
+                f.write(current.read())
+        os.replace(tmp_file, self.runs_path)
+        self._write_index()
+
+    def _write_index(self):
+        """ 只有 index.html 不存在或版本不同时才写 """
+        marker = "<!-- RunIndex %s -->" % self.INDEX_VERSION
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                f.readline()
+                if f.readline().strip() == marker:
+                    return
+        tmp_file = self.index_path + ".%s.tmp" % os.getpid()
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(self.INDEX_TMPL % dict(version=self.INDEX_VERSION))
+        os.replace(tmp_file, self.index_path)
+
+
+# 两次运行的差异报告：新增失败、已修复、新出现和消失的用例、耗时变化明显的用例
+class RunDiff(Template_mixin):
+    """
+    Compare two RunResults and write an HTML report of what changed,
+    using the styles of the normal report. Durations count as changed when
+    they differ by more than `duration_ratio` and the longer one is at
+    least `min_duration` seconds. Tests that were not run (status 4) in the
+    new run are listed under 未执行 and are neither fixed nor faster.
+    """
+
+    def __init__(self, old, new, stream=sys.stdout, title=None, duration_ratio=0.5, min_duration=0.1):
+        self.old = old
+        self.new = new
+        self.stream = stream
+        self.title = title or "运行差异报告"
+        self.duration_ratio = duration_ratio
+        self.min_duration = min_duration
+
+    def compare(self):
+        """ 返回 [(分类名, [(用例 id, 旧结果, 新结果)])]，旧结果或新结果为 None 表示该次运行里没有这个用例 """
+        sections = [("新增失败", []), ("已修复", []), ("仍然失败", []), ("新出现", []), ("已消失", []),
+                    ("未执行", []), ("变慢", []), ("变快", [])]
+        groups = dict(sections)
+        old_tests, new_tests = self.old.tests, self.new.tests
+        for test_id, new in new_tests.items():
+            old = old_tests.get(test_id)
+            if old is None:
+                groups["新出现"].append((test_id, None, new))
+                continue
+            # 跳过/未执行的用例没有结果和有意义的耗时：新运行里未执行的单独列出，旧运行里未执行的只看新结果是否失败
+            if new["status"] == 4:
+                groups["未执行"].append((test_id, old, new))
+                continue
+            if old["status"] == 4:
+                if new["status"] in (1, 2):
+                    groups["新增失败"].append((test_id, old, new))
+                continue
+            old_failed = old["status"] in (1, 2)
+            new_failed = new["status"] in (1, 2)
+            if new_failed and not old_failed:
+                groups["新增失败"].append((test_id, old, new))
+            elif old_failed and not new_failed:
+                groups["已修复"].append((test_id, old, new))
+            elif old_failed and new_failed:
+                groups["仍然失败"].append((test_id, old, new))
+            longer = max(old["duration"], new["duration"])
+            if longer >= self.min_duration and abs(new["duration"] - old["duration"]) > self.duration_ratio * min(old["duration"], new["duration"]):
+                groups[new["duration"] > old["duration"] and "变慢" or "变快"].append((test_id, old, new))
+        for test_id, old in old_tests.items():
+            if test_id not in new_tests:
+                groups["已消失"].append((test_id, old, None))
+        return sections
+
+    def generateReport(self):
+        sections = self.compare()
+        info = self.new.info
+        summary = '，'.join('%s %s' % (name, len(items)) for name, items in sections if items) or '无变化'
+        attrs = [
+            ('旧运行', self._describe_run(self.old.info)),
+            ('新运行', self._describe_run(info)),
+            ('变化', summary),
+        ]
+        heading = self.HEADING_TMPL % dict(
+            title=saxutils.escape(self.title),
+            parameters=''.join(self.HEADING_ATTRIBUTE_TMPL % dict(name=saxutils.escape(name), value=saxutils.escape(value))
+                               for name, value in attrs),
+            description="",
+            chart=self._generate_chart(info.get("Pass", 0), info.get("fail", 0), info.get("error", 0), info.get("flaky", 0),
+                                       info.get("not_run", 0)),
+        )
+        report = ''.join(self._generate_section(name, items) for name, items in sections if items)
+        output = self.HTML_TMPL % dict(
+            title=saxutils.escape(self.title),
+            generator='HTMLTestRunner %s' % __version__,
+            stylesheet=self.STYLESHEET_TMPL,
+            heading=heading,
+            report=report,
+            ending=self.ENDING_TMPL,
+        )
+        self.stream.write(output.encode('utf8'))
+
+    @staticmethod
+    def _describe_run(info):
+        return '%s，共 %s，失败 %s，错误 %s' % (info.get("start_time", "未知"), info.get("count", 0),
+                                           info.get("fail", 0), info.get("error", 0))
+
+    def _generate_section(self, name, items):
+        rows = []
+        for test_id, old, new in items:
+            current = new or old
+            change = ""
+            if old is not None and new is not None:
+                change = "%+.2f秒" % (new["duration"] - old["duration"])
+            rows.append(self.DIFF_ROW_TMPL % dict(
+                style=new is not None and self.STATUS_STYLE[new["status"]] or "",
+                name=saxutils.escape(test_id),
+                doc=saxutils.escape(current["doc"]),
+                old=old is not None and self.STATUS[old["status"]] or "-",
+                new=new is not None and self.STATUS[new["status"]] or "-",
+                old_time=old is not None and "%s秒" % old["duration"] or "-",
+                new_time=new is not None and "%s秒" % new["duration"] or "-",
+                change=change,
+                error=saxutils.escape(new is not None and new["error"] or ""),
+            ))
+        return self.DIFF_SECTION_TMPL % dict(name=name, count=len(items), rows=''.join(rows))
+
+
+def diff_main(argv=None):
+    """ python -m src.lib.HTMLTestReportCN diff 旧结果 新结果 -o diff.html """
+    parser = argparse.ArgumentParser(prog="HTMLTestReportCN diff", description="比较两次运行的结果文件，生成差异报告")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("-o", "--output", default="diff.html")
+    parser.add_argument("--title")
+    parser.add_argument("--duration-ratio", type=float, default=0.5, help="耗时变化超过这个比例才列出")
+    args = parser.parse_args(argv)
+    with open(args.output, "wb") as fp:
+        RunDiff(RunResults.load(args.old), RunResults.load(args.new), fp, args.title, args.duration_ratio).generateReport()
+    print("差异报告已生成：%s" % args.output)
+    return 0
+
+
+# 截图缩略图：报告里只显示小图，点击后才加载原图
+THUMB_SIZE = (320, 200)
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+
+def _png_chunks(data):
+    pos = len(_PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        yield kind, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def _unfilter_row(kind, raw, prev, bpp):
+    if kind == 0:
+        return bytearray(raw)
+    if kind == 2:
+        return bytearray(map((255).__and__, map(int.__add__, raw, prev)))
+    row = bytearray(raw)
+    if kind == 1:
+        # Sub 可以按通道做前缀和，全在 C 层完成
+        for c in range(bpp):
+            row[c::bpp] = bytes(map((255).__and__, itertools.accumulate(raw[c::bpp])))
+        return row
+    for i in range(len(row)):
+        left = row[i - bpp] if i >= bpp else 0
+        if kind == 3:
+            row[i] = (row[i] + ((left + prev[i]) >> 1)) & 255
+        else:
+            up = prev[i]
+            upper_left = prev[i - bpp] if i >= bpp else 0
+            p = left + up - upper_left
+            pa, pb, pc = abs(p - left), abs(p - up), abs(p - upper_left)
+            if pa <= pb and pa <= pc:
+                predictor = left
+            elif pb <= pc:
+                predictor = up
+            else:
+                predictor = upper_left
+            row[i] = (row[i] + predictor) & 255
+    return row
+
+
+def _read_png(path):
+    """
+    Decode an 8-bit, non-interlaced grey/RGB(A) PNG into (width, height,
+    channels, rows). Returns None for anything else (palette, 16-bit,
+    interlaced), which the caller treats as "no thumbnail".
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(_PNG_SIGNATURE):
+        return None
+    header, idat = None, []
+    for kind, body in _png_chunks(data):
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+    if header is None:
+        return None
+    width, height, depth, color, _, _, interlace = header
+    if depth != 8 or interlace or color not in _PNG_CHANNELS:
+        return None
+    bpp = _PNG_CHANNELS[color]
+    stride = width * bpp
+    raw = zlib.decompress(b"".join(idat))
+    rows, prev = [], bytes(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        prev = _unfilter_row(raw[start], raw[start + 1:start + 1 + stride], prev, bpp)
+        rows.append(prev)
+    return width, height, bpp, rows
+
+
+def _write_png(path, width, height, rows):
+    def chunk(kind, body):
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+    raw = b"".join(b"\x00" + bytes(row) for row in rows)
+    with open(path, "wb") as f:
+        f.write(_PNG_SIGNATURE)
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 9)))
+        f.write(chunk(b"IEND", b""))
+
+
+def _thumbnail_size(width, height, size):
+    scale = min(size[0] / float(width), size[1] / float(height), 1.0)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def make_thumbnail(src, dst, size=THUMB_SIZE):
+    """
+    Write a PNG thumbnail of image `src` to `dst`, fitting inside `size`.
+    Uses Pillow when installed, otherwise a stdlib PNG decoder with
+    nearest-neighbour scaling. Returns False if the image could not be
+    read, so the report falls back to a plain link.
+    """
+    try:
+        if Image is not None:
+            with Image.open(src) as img:
+                img = img.convert("RGB")
+                img.thumbnail(size)
+                img.save(dst, "PNG", optimize=True)
+            return True
+        png = _read_png(src)
+        if png is None:
+            return False
+        width, height, bpp, rows = png
+        out_w, out_h = _thumbnail_size(width, height, size)
+        # 每个输出像素取对应源像素的 RGB 三个字节（灰度图重复同一字节），用 itemgetter 一次取完一行
+        indexes = []
+        for x in range(out_w):
+            base = int((x + 0.5) * width / out_w) * bpp
+            indexes.extend((base, base, base) if bpp < 3 else (base, base + 1, base + 2))
+        pick = operator.itemgetter(*indexes)
+        out_rows = [pick(rows[int((y + 0.5) * height / out_h)]) for y in range(out_h)]
+        _write_png(dst, out_w, out_h, out_rows)
+        return True
+    except (OSError, ValueError, zlib.error, struct.error):
+        return False
+
+
+def thumbnail_name(img_name):
+    return os.path.splitext(img_name)[0] + ".png"
+
+
+def make_missing_thumbnails(dir_path):
+    """
+    Create the thumbnails that get_screenshot() left out for the
+    screenshots in <dir_path>/image. Without Pillow, decoding a large PNG
+    takes seconds, so the runner does it after the tests instead of
+    inside a test (and its timeout).
+    """
+    img_dir = os.path.join(dir_path, "image")
+    if not os.path.isdir(img_dir):
+        return
+    thumb_dir = os.path.join(img_dir, "thumb")
+    for name in os.listdir(img_dir):
+        if os.path.splitext(name)[1].lower() not in (".png", ".jpg", ".webp"):
+            continue
+        thumb = os.path.join(thumb_dir, thumbnail_name(name))
+        if not os.path.isfile(thumb):
+            os.makedirs(thumb_dir, exist_ok=True)
+            make_thumbnail(os.path.join(img_dir, name), thumb)
+
+
 # 集成创建文件夹、保存截图、获得截图名字等方法，与HTMLTestReportCN交互从而实现嵌入截图  -- Gelomen
 class DirAndFiles(object):
 
@@ -1261,22 +5291,23 @@ class DirAndFiles(object):
         self.title = "Test Report"
 
     def create_dir(self, title=None):
-        i = 1.0
-
         if title is not None:
             self.title = title
 
-        dir_path = self.path + self.title + "V" + str(round(i, 1))
-        # 判断文件夹是否存在，不存在则创建
+        # 从 V1.0 开始取第一个没被占用的版本号；被保留策略归档的运行也算占用，避免和归档重名
+        archive_dir = os.path.join(self.path, ResultRetention.ARCHIVE_DIR)
+        i = 1.0
         while True:
-            is_dir = os.path.isdir(dir_path)
-            if is_dir:
-                i += 0.1
-                dir_path = self.path + self.title + "V" + str(round(i, 1))
-            else:
-                break
-
-        os.makedirs(dir_path)
+            name = self.title + "V" + str(round(i, 1))
+            dir_path = self.path + name
+            if not os.path.isfile(os.path.join(archive_dir, name + ".tar.gz")):
+                try:
+                    os.makedirs(dir_path)
+                    break
+                except FileExistsError:
+                    # 已有的运行，或同时启动的另一次运行刚用了这个版本号
+                    pass
+            i += 0.1
 
         # 测试报告路径
         report_path = dir_path + "/" + self.title + "V" + str(round(i, 1)) + ".html"
@@ -1286,7 +5317,14 @@ class DirAndFiles(object):
         GlobalMsg.set_value("report_path", report_path)
 
     @staticmethod
-    def get_screenshot(browser):
+    def get_screenshot(browser, image_format="png", quality=80):
+        """
+        Save a screenshot of `browser` to image/N.png plus, with Pillow
+        installed, a thumbnail in image/thumb/ (without Pillow the runner
+        makes it after the tests). With Pillow, `image_format` "jpeg" or
+        "webp" re-encodes the full image (at `quality`) to keep the result
+        folder small.
+        """
         i = 1
 
         # 通过全局变量获取文件夹路径
@@ -1300,9 +5338,9 @@ class DirAndFiles(object):
 
         img_path = img_dir + "/" + str(i) + ".png"
 
-        # 有可能同个测试步骤出错，截图名字一样导致覆盖文件，所以名字存在则增加id
+        # 有可能同个测试步骤出错，截图名字一样导致覆盖文件，所以名字存在则增加id（压缩过的原图不再是 .png）
         while True:
-            is_file = os.path.isfile(img_path)
+            is_file = any(os.path.isfile(img_dir + "/" + str(i) + ext) for ext in (".png", ".jpg", ".webp"))
             if is_file:
                 i += 1
                 img_path = img_dir + "/" + str(i) + ".png"
@@ -1312,6 +5350,21 @@ class DirAndFiles(object):
         browser.get_screenshot_as_file(img_path)
         img_name = str(i) + ".png"
 
+        # 没装 Pillow 时纯 Python 解码大截图要几秒，不在用例里做，由 HTMLTestRunner 在执行完后补上
+        if Image is not None:
+            thumb_dir = img_dir + "/thumb"
+            if not os.path.isdir(thumb_dir):
+                os.makedirs(thumb_dir, exist_ok=True)
+            make_thumbnail(img_path, thumb_dir + "/" + thumbnail_name(img_name))
+
+        # 原图压缩需要 Pillow，没装则保留 PNG
+        if Image is not None and image_format.lower() in ("jpeg", "jpg", "webp"):
+            ext = ".webp" if image_format.lower() == "webp" else ".jpg"
+            with Image.open(img_path) as img:
+                img.convert("RGB").save(img_dir + "/" + str(i) + ext, quality=quality)
+            os.remove(img_path)
+            img_name = str(i) + ext
+
         browser_type = browser.capabilities["browserName"]
         browser_version = browser.capabilities["version"]
         browser_msg = browser_type + "(" + browser_version + ")"
@@ -1319,6 +5372,603 @@ class DirAndFiles(object):
         print("errorImg[" + img_name + "]errorImg, browser[" + browser_msg + "]browser")
 
 
+# WebDriver 会话池：每个用例租用一个已经启动的浏览器，用完重置后放回，不再每个用例重新启动浏览器
+class WebDriverPool(object):
+    """
+    A pool of reusable WebDriver sessions created by `factory`.
+
+    lease() returns an idle session (creating one while fewer than `size`
+    exist, waiting otherwise); release() resets it - extra windows closed,
+    cookies and web storage cleared, `start_url` loaded - and puts it back.
+    A session that fails the health check on lease, fails to reset, or has
+    been leased `max_uses` times is quit and replaced.
+
+    Worker processes each build their own pool, so with the default size of
+    1 a run holds as many browsers as it has workers. Lease and wait times
+    of each test are shown in the report when lease() is given the test.
+    """
+
+    def __init__(self, factory, size=1, start_url="about:blank", max_uses=100):
+        self.factory = factory
+        self.size = size
+        self.start_url = start_url
+        self.max_uses = max_uses
+        self.condition = threading.Condition()
+        self.idle = []
+        self.created = 0
+        self.uses = {}
+        self.leases = {}
+        # 工作进程退出时不会执行 atexit，用 multiprocessing 的 Finalize 在主进程和工作进程里都能关闭浏览器；
+        # 回调只引用空闲列表和锁，不引用池本身，池没有别的引用时仍能被回收
+        multiprocessing.util.Finalize(self, WebDriverPool._close_drivers, args=(self.idle, self.condition), exitpriority=10)
+
+    def lease(self, test=None, timeout=None):
+        start = time.time()
+        with self.condition:
+            while not self.idle and self.created >= self.size:
+                if not self.condition.wait(timeout):
+                    raise RuntimeError("等待浏览器会话超过 %s 秒" % timeout)
+            driver = self.idle and self.idle.pop() or None
+            if driver is None:
+                # 先占住名额，在锁外启动浏览器
+                self.created += 1
+        info = {"wait": time.time() - start, "created": driver is None, "recycled": 0}
+        if driver is not None and not self._healthy(driver):
+            self._discard(driver, reserve=True)
+            info["recycled"] += 1
+            driver = None
+        if driver is None:
+            driver = self._create()
+            info["created"] = True
+        self.uses[id(driver)] = self.uses.get(id(driver), 0) + 1
+        info["start"] = time.time()
+        self.leases[id(driver)] = (test, info)
+        return driver
+
+    def release(self, driver):
+        test, info = self.leases.pop(id(driver), (None, None))
+        if info is not None:
+            info["lease"] = time.time() - info.pop("start")
+        if self.uses.get(id(driver), 0) >= self.max_uses or not self._reset(driver):
+            self._discard(driver)
+            if info is not None:
+                info["recycled"] += 1
+        else:
+            with self.condition:
+                self.idle.append(driver)
+                self.condition.notify()
+        # 由 _TestResult.stopTest 收集进报告
+        if test is not None:
+            test._webdriver_lease = info
+
+    def close(self):
+        """ 关闭所有空闲的会话 """
+        closed = self._close_drivers(self.idle, self.condition)
+        with self.condition:
+            for driver in closed:
+                self.uses.pop(id(driver), None)
+            self.created -= len(closed)
+            self.condition.notify_all()
+
+    @staticmethod
+    def _close_drivers(idle, condition):
+        """ 原地清空空闲列表并关闭其中的会话，返回关闭的会话 """
+        with condition:
+            closed = idle[:]
+            del idle[:]
+        for driver in closed:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        return closed
+
+    def _create(self):
+        try:
+            return self.factory()
+        except BaseException:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            raise
+
+    def _discard(self, driver, reserve=False):
+        """ 关闭会话；reserve 为 True 时保留名额，由调用方马上新建一个 """
+        self.uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        if not reserve:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+
+    @staticmethod
+    def _healthy(driver):
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, driver):
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.delete_all_cookies()
+            # about:blank 等页面没有 storage，清理失败不影响复用
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except Exception:
+                pass
+            driver.get(self.start_url)
+            return True
+        except Exception:
+            return False
+
+
+# 结果目录的保留策略：保留最近的运行和失败的运行，较旧的运行压缩为摘要和缩略图，更旧的打包归档
+class ResultRetention(object):
+    """
+    Retention policy for the run folders under a result root.
+
+    A run is kept in full when it is one of the newest `keep_runs`, is
+    younger than `keep_days`, failed (with `keep_failing`), or is the run
+    in progress. Other runs are compacted - everything but summary.json,
+    the results file and image/thumb/ is deleted - and runs older than
+    `archive_after_days` are packed into <root>/archive/<run>.tar.gz.
+
+    Runs without summary.json or a results file are treated as failing,
+    since their status is unknown, and are skipped entirely while younger
+    than `busy_hours` because they may still be writing. A lock file keeps
+    two prunes from running at the same time. Rows of compacted and
+    archived runs in <root>/runs.js are updated through RunIndex.mark_runs.
+    """
+
+    ARCHIVE_DIR = "archive"
+    LOCK_FILE = ".retention.lock"
+    # 压缩时保留的文件
+    KEEP_FILES = ("summary.json", "results.jsonl", "results.jsonl.gz")
+    THUMB_DIR = os.path.join("image", "thumb")
+
+    def __init__(self, root=None, keep_runs=20, keep_days=None, keep_failing=True, archive_after_days=None,
+                 busy_hours=24):
+        self.root = root or DirAndFiles().path
+        self.keep_runs = keep_runs
+        self.keep_days = keep_days
+        self.keep_failing = keep_failing
+        self.archive_after_days = archive_after_days
+        self.busy_hours = busy_hours
+
+    def runs(self):
+        """ 返回结果目录下的运行，最新的在前 """
+        runs = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name == self.ARCHIVE_DIR:
+                continue
+            summary = self._read_summary(entry.path)
+            start = None
+            if summary and summary.get("start_time"):
+                try:
+                    start = time.mktime(time.strptime(summary["start_time"], "%Y-%m-%d %H:%M:%S"))
+                except ValueError:
+                    pass
+            runs.append({
+                "name": entry.name,
+                "path": entry.path,
+                "summary": summary,
+                "time": start or entry.stat().st_mtime,
+                "failing": summary is None or bool(summary.get("fail") or summary.get("error")),
+                "compacted": bool(summary and summary.get("compacted")),
+            })
+        runs.sort(key=lambda run: (run["time"], run["name"]), reverse=True)
+        return runs
+
+    @staticmethod
+    def _read_summary(run_dir):
+        path = os.path.join(run_dir, "summary.json")
+        if os.path.isfile(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    return json.load(f)
+            except ValueError:
+                return None
+        # 没有 summary.json 时用结果文件的第一行
+        for name in ("results.jsonl.gz", "results.jsonl"):
+            path = os.path.join(run_dir, name)
+            if os.path.isfile(path):
+                try:
+                    return RunResults.load(path).info
+                except (OSError, ValueError):
+                    return None
+        return None
+
+    def plan(self, now=None):
+        """ 返回 [(操作, 运行)]，操作为 "keep"、"compact" 或 "archive" """
+        now = now or time.time()
+        current = GlobalMsg.get_value("dir_path")
+        actions = []
+        for index, run in enumerate(self.runs()):
+            age_days = (now - run["time"]) / 86400.0
+            busy = run["summary"] is None and age_days * 24 < self.busy_hours
+            keep = (busy
+                    or (current and os.path.abspath(current) == os.path.abspath(run["path"]))
+                    or (self.keep_runs is None and self.keep_days is None)
+                    or (self.keep_runs is not None and index < self.keep_runs)
+                    or (self.keep_days is not None and age_days < self.keep_days)
+                    or (self.keep_failing and run["failing"]))
+            if keep:
+                actions.append(("keep", run))
+            elif self.archive_after_days is not None and age_days >= self.archive_after_days:
+                actions.append(("archive", run))
+            elif not run["compacted"]:
+                actions.append(("compact", run))
+            else:
+                actions.append(("keep", run))
+        return actions
+
+    def apply(self, dry_run=False):
+        """ 执行保留策略，返回执行的 [(操作, 运行)]；另一个进程正在执行时返回 None """
+        lock = self._lock()
+        if lock is None:
+            return None
+        try:
+            actions = [(action, run) for action, run in self.plan() if action != "keep"]
+            if not dry_run:
+                changes = {}
+                for action, run in actions:
+                    if action == "compact":
+                        changes[run["path"]] = self.compact(run, update_index=False)
+                    else:
+                        changes[run["path"]] = self.archive(run, update_index=False)
+                # runs.js 只重写一次
+                RunIndex(self.root).mark_runs(changes)
+            return actions
+        finally:
+            os.remove(lock)
+
+    def compact(self, run, update_index=True):
+        """ 只留下摘要、结果文件和缩略图；返回写进 runs.js 的字段 """
+        for dir_path, dir_names, file_names in os.walk(run["path"], topdown=False):
+            relative = os.path.relpath(dir_path, run["path"])
+            if relative == self.THUMB_DIR or relative.startswith(self.THUMB_DIR + os.sep):
+                continue
+            for name in file_names:
+                if relative == "." and name in self.KEEP_FILES:
+                    continue
+                os.remove(os.path.join(dir_path, name))
+            if relative != "." and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+        summary = dict(run["summary"] or {}, compacted=True)
+        tmp_file = os.path.join(run["path"], "summary.json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, os.path.join(run["path"], "summary.json"))
+        fields = {"compacted": True}
+        if update_index:
+            RunIndex(self.root).mark_runs({run["path"]: fields})
+        return fields
+
+    def archive(self, run, update_index=True):
+        """ 打包成 archive/<运行>.tar.gz，写完后才删除原文件夹；返回写进 runs.js 的字段 """
+        archive_dir = os.path.join(self.root, self.ARCHIVE_DIR)
+        os.makedirs(archive_dir, exist_ok=True)
+        RunBundle().write(run["path"], os.path.join(archive_dir, run["name"] + ".tar.gz"))
+        shutil.rmtree(run["path"])
+        fields = {"archive": "%s/%s.tar.gz" % (self.ARCHIVE_DIR, run["name"])}
+        if update_index:
+            RunIndex(self.root).mark_runs({run["path"]: fields})
+        return fields
+
+    def _lock(self):
+        path = os.path.join(self.root, self.LOCK_FILE)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # 超过一小时的锁文件是中途退出留下的
+                try:
+                    if time.time() - os.path.getmtime(path) < 3600:
+                        return None
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            os.close(fd)
+            return path
+        return None
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return unit == "B" and "%d %s" % (size, unit) or "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f GB" % size
+
+
+# 把一次运行的报告、截图和结果打成一个压缩包，方便从 CI 机器上拷走或长期保存
+class RunBundle(object):
+    """
+    Pack a run folder into a single tar archive. Files are grouped by type
+    so similar content sits together in the compression window, and files
+    with identical content (repeated screenshots, copied assets) are stored
+    once and added again as hard links. `compression` is "gz" or "xz".
+    """
+
+    SUFFIXES = {"gz": ".tar.gz", "xz": ".tar.xz"}
+
+    def __init__(self, compression="gz", level=9):
+        if compression not in self.SUFFIXES:
+            raise ValueError("compression must be one of %s" % ", ".join(sorted(self.SUFFIXES)))
+        self.compression = compression
+        self.level = level
+        # 最后一次 write() 的统计：文件数、重复的文件数、原始大小、重复文件省下的大小、压缩包大小
+        self.stats = {}
+
+    def write(self, run_dir, path=None):
+        run_dir = os.path.normpath(run_dir)
+        name = os.path.basename(run_dir)
+        if path is None:
+            path = run_dir + self.SUFFIXES[self.compression]
+        options = self.compression == "xz" and {"preset": self.level} or {"compresslevel": self.level}
+        seen = {}
+        stats = dict(files=0, duplicates=0, size=0, duplicate_size=0)
+        tmp_file = path + ".%s.tmp" % os.getpid()
+        with tarfile.open(tmp_file, "w:" + self.compression, **options) as tar:
+            tar.add(run_dir, arcname=name, recursive=False)
+            for file_path, arcname in self._members(run_dir, name):
+                info = tar.gettarinfo(file_path, arcname)
+                if not info.isfile():
+                    tar.addfile(info)
+                    continue
+                digest = self._digest(file_path)
+                stats["files"] += 1
+                stats["size"] += info.size
+                if digest in seen:
+                    # 内容相同的文件只存一份，其余作为硬链接
+                    info.type = tarfile.LNKTYPE
+                    info.linkname = seen[digest]
+                    stats["duplicates"] += 1
+                    stats["duplicate_size"] += info.size
+                    info.size = 0
+                    tar.addfile(info)
+                    continue
+                seen[digest] = arcname
+                with open(file_path, "rb") as f:
+                    tar.addfile(info, f)
+        os.replace(tmp_file, path)
+        stats["bundle_size"] = os.path.getsize(path)
+        self.stats = stats
+        return path
+
+    def size_report(self):
+        """ 最后一次 write() 的大小说明，例如 “12 个文件，3 个重复（省 1.2 MB），原始 5.0 MB，压缩包 1.1 MB（22%）” """
+        stats = self.stats
+        if not stats:
+            return ""
+        return "%s 个文件，%s 个重复（省 %s），原始 %s，压缩包 %s（%.0f%%）" % (
+            stats["files"], stats["duplicates"], _format_size(stats["duplicate_size"]), _format_size(stats["size"]),
+            _format_size(stats["bundle_size"]), stats["size"] and 100.0 * stats["bundle_size"] / stats["size"] or 100.0)
+
+    @staticmethod
+    def _members(run_dir, name):
+        dirs, files = [], []
+        for dir_path, dir_names, file_names in os.walk(run_dir):
+            dir_names.sort()
+            relative = os.path.relpath(dir_path, run_dir)
+            prefix = relative != "." and os.path.join(name, relative) or name
+            for dir_name in dir_names:
+                dirs.append((os.path.join(dir_path, dir_name), os.path.join(prefix, dir_name)))
+            for file_name in file_names:
+                files.append((os.path.join(dir_path, file_name), os.path.join(prefix, file_name)))
+        # 目录先写，文件按扩展名分组：HTML、JSON 等文本放在一起压缩效果最好
+        files.sort(key=lambda item: (os.path.splitext(item[0])[1].lower(), item[1]))
+        return dirs + files
+
+    @staticmethod
+    def _digest(file_path):
+        sha = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+
+def bundle_main(argv=None):
+    """ python -m src.lib.HTMLTestReportCN bundle 运行文件夹 [-o 压缩包] [--xz] """
+    parser = argparse.ArgumentParser(prog="HTMLTestReportCN bundle", description="把一次运行的报告和截图打成一个压缩包")
+    parser.add_argument("run_dir")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("--xz", action="store_true", help="用 xz 压缩，更小但更慢")
+    args = parser.parse_args(argv)
+    bundle = RunBundle(args.xz and "xz" or "gz")
+    path = bundle.write(args.run_dir, args.output)
+    print("压缩包已生成：%s（%s）" % (path, bundle.size_report()))
+    return 0
+
+
+# 测试发现缓存：按文件记录用例 id，以 路径 + mtime + 文件大小 作为键，文件没变就不用再 import
+class DiscoveryCache(object):
+    """
+    Cache of test ids per test file, keyed by path, mtime and size.
+
+    unittest's discover() imports every module just to list its tests.
+    DiscoveryCache walks the tree the same way but only imports the files
+    that changed since the cache was written, so listing, selecting and
+    sharding tests costs a few stat() calls. load_suite() then imports only
+    the modules whose tests are actually scheduled.
+    """
+
+    CACHE_VERSION = 2
+
+    def __init__(self, start_dir=".", pattern="test*.py", top_level_dir=None, cache_file=None, processes=1):
+        self.start_dir = os.path.abspath(start_dir)
+        # 大于 1 时，需要重新收集的模块分给多个进程并行导入
+        self.processes = processes
+        self.pattern = pattern
+        self.top_level_dir = os.path.abspath(top_level_dir or start_dir)
+        if cache_file is None:
+            cache_file = os.path.join(self.start_dir, ".discovery_cache.json")
+        self.cache_file = cache_file
+        self.loader = unittest.TestLoader()
+        # {相对路径: {"mtime": ..., "size": ..., "module": ..., "tests": [...], "resources": {用例 id: [资源]}, "error": ...}}
+        self.entries = {}
+        self.refreshed = False
+
+    def _load(self):
+        try:
+            with open(self.cache_file, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != self.CACHE_VERSION or data.get("pattern") != self.pattern:
+            return {}
+        return data.get("files", {})
+
+    def _save(self):
+        # 导入失败的文件不写入缓存，下次启动重新导入
+        files = dict((path, entry) for path, entry in self.entries.items() if not entry.get("error"))
+        data = {"version": self.CACHE_VERSION, "pattern": self.pattern, "files": files}
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+    def _walk(self, dir_path):
+        """ 与 unittest 的 discover 规则一致：匹配 pattern 的模块，以及带 __init__.py 的子包 """
+        for name in sorted(os.listdir(dir_path)):
+            full_path = os.path.join(dir_path, name)
+            if os.path.isfile(full_path):
+                module_name, ext = os.path.splitext(name)
+                if ext == ".py" and module_name.isidentifier() and fnmatch.fnmatch(name, self.pattern):
+                    yield full_path
+            elif os.path.isdir(full_path) and os.path.isfile(os.path.join(full_path, "__init__.py")):
+                for path in self._walk(full_path):
+                    yield path
+
+    def _module_name(self, full_path):
+        rel_path = os.path.relpath(os.path.splitext(full_path)[0], self.top_level_dir)
+        return rel_path.replace(os.sep, ".")
+
+    def _stale_files(self):
+        """ 遍历目录，返回 (缓存里仍然有效的条目, 需要重新收集的 [(相对路径, 条目)]) """
+        cached = self._load()
+        entries = {}
+        stale = []
+        for full_path in self._walk(self.start_dir):
+            rel_path = os.path.relpath(full_path, self.start_dir).replace(os.sep, "/")
+            stat = os.stat(full_path)
+            entry = cached.get(rel_path)
+            if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                entries[rel_path] = entry
+            else:
+                stale.append((rel_path, {"mtime": stat.st_mtime_ns, "size": stat.st_size,
+                                         "module": self._module_name(full_path)}))
+        return entries, stale
+
+    def refresh(self):
+        """ 只重新导入 mtime 或大小有变化的文件，然后写回缓存 """
+        if self.top_level_dir not in sys.path:
+            sys.path.insert(0, self.top_level_dir)
+        self.entries, stale = self._stale_files()
+        modules = [entry["module"] for _, entry in stale]
+        if self.processes > 1 and len(modules) > 1:
+            # 每个进程导入互不重叠的一批模块，只把用例 id 和导入异常传回来
+            processes = min(self.processes, len(modules))
+            chunksize = max(1, len(modules) // (processes * 4))
+            with multiprocessing.Pool(processes, _init_collector, (self.top_level_dir,)) as pool:
+                collected = pool.map(_collect_module, modules, chunksize)
+        else:
+            collected = [_collect_module(module_name) for module_name in modules]
+        for (rel_path, entry), (tests, error, test_resources) in zip(stale, collected):
+            entry["tests"], entry["error"], entry["resources"] = tests, error, test_resources
+            self.entries[rel_path] = entry
+        self._save()
+        self.refreshed = True
+        return self
+
+    def test_ids(self):
+        """ 按发现顺序列出所有用例 id，不导入未改动的模块 """
+        if not self.refreshed:
+            self.refresh()
+        ids = []
+        for rel_path in sorted(self.entries):
+            ids.extend(self.entries[rel_path]["tests"] or [])
+        return ids
+
+    def resources(self):
+        """ 声明了资源的用例 {用例 id: (资源名, ...)}，传给 HTMLTestRunner 的 test_resources """
+        if not self.refreshed:
+            self.refresh()
+        found = {}
+        for entry in self.entries.values():
+            for test_id, names in (entry.get("resources") or {}).items():
+                found[test_id] = tuple(names)
+        return found
+
+    def import_errors(self):
+        """ 返回 [(模块名, 异常信息)] """
+        if not self.refreshed:
+            self.refresh()
+        return [(entry["module"], entry["error"]) for _, entry in sorted(self.entries.items()) if entry.get("error")]
+
+    @staticmethod
+    def select(test_ids, patterns):
+        """ 按 unittest -k 的规则筛选：不含通配符的 pattern 视为 *pattern* """
+        patterns = ["*%s*" % p if "*" not in p else p for p in patterns]
+        return [i for i in test_ids if any(fnmatch.fnmatchcase(i, p) for p in patterns)]
+
+    @staticmethod
+    def shard(test_ids, index, total):
+        """ 按用例类的 crc32 分片，同一个类总是落在同一个分片里，index 从 0 开始 """
+        return [i for i in test_ids if zlib.crc32(i.rsplit(".", 1)[0].encode("utf-8")) % total == index]
+
+    def load_suite(self, test_ids=None):
+        """ 只导入被选中用例所在的模块，构造 TestSuite；导入失败的模块在报告里显示为错误行 """
+        if test_ids is None:
+            test_ids = self.test_ids()
+        suite = self.loader.suiteClass()
+        for test_id in test_ids:
+            suite.addTests(self.loader.loadTestsFromName(test_id))
+        for module_name, error in self.import_errors():
+            suite.addTest(_make_import_error_test(module_name, error))
+        return suite
+
+
+def _init_collector(top_level_dir):
+    if top_level_dir not in sys.path:
+        sys.path.insert(0, top_level_dir)
+
+
+def _collect_module(module_name):
+    """ 导入模块并返回 (用例 id 列表, None, {用例 id: 资源})；导入失败时返回 (None, 异常信息, None) """
+    try:
+        module = importlib.import_module(module_name)
+    except Exception:
+        return None, traceback.format_exc(), None
+    tests = [t for t in _iter_tests(unittest.TestLoader().loadTestsFromModule(module))
+             if not isinstance(t, unittest.loader._FailedTest)]
+    test_resources = dict((t.id(), _test_resources(t)) for t in tests if _test_resources(t))
+    return [t.id() for t in tests], None, test_resources
+
+
+def _make_import_error_test(module_name, error):
+    """ 与 unittest 的 _FailedTest 类似：执行时抛出导入异常，报告里显示为一条错误 """
+    def testImport(self):
+        raise ImportError("Failed to import test module: %s\n%s" % (module_name, error))
+
+    cls = type(module_name.rsplit(".", 1)[-1], (unittest.TestCase,),
+               {"__doc__": "导入失败: %s" % module_name, "__module__": module_name, "testImport": testImport,
+                "_retryable": False})
+    return cls("testImport")
+
+
 ##############################################################################
 # Facilities for running tests from the command line
 ##############################################################################
@@ -1348,4 +5998,8 @@ main = TestProgram
 ##############################################################################
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["diff"]:
+        sys.exit(diff_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["bundle"]:
+        sys.exit(bundle_main(sys.argv[2:]))
     main(module=None)
@@ -0,0 +1,210 @@
+# coding=utf-8
+
+""""" 报告生成性能基准：用合成的测试结果测量 结果收集、sortResult、generateReport 的耗时、内存和 HTML 大小 """""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+# 与报告相关的三项耗时在时间上取多次中的最小值，内存和大小只测一次
+TIME_METRICS = ("collect_s", "sort_s", "report_s")
+SIZE_METRICS = ("collect_peak_mb", "report_peak_mb", "html_mb")
+
+
+class SyntheticSuite(object):
+    """ 按规模生成合成用例：多个类、不同长度的输出、一部分失败/错误、一部分带截图标记 """
+
+    def __init__(self, count, classes=50, output_size=200, screenshot_ratio=0.1, fail_ratio=0.1, error_ratio=0.05, seed=1):
+        self.count = count
+        self.classes = max(1, min(classes, count))
+        self.output_size = output_size
+        self.screenshot_ratio = screenshot_ratio
+        self.fail_ratio = fail_ratio
+        self.error_ratio = error_ratio
+        self.random = random.Random(seed)
+
+    def _make_class(self, index):
+        def runTest(self):
+            """ 合成用例 """
+        return type("BenchClass%d" % index, (unittest.TestCase,), {
+            "__doc__": "合成用例类 %d" % index,
+            "__module__": "benchmark_%d" % (index % 10),
+            "runTest": runTest,
+        })
+
+    @staticmethod
+    def _exc_info(exc_type, message):
+        try:
+            raise exc_type(message)
+        except exc_type:
+            return sys.exc_info()
+
+    def cases(self):
+        """ 生成 (用例, 结果代码, 输出, exc_info) """
+        classes = [self._make_class(i) for i in range(self.classes)]
+        failure = self._exc_info(AssertionError, "合成的断言失败")
+        error = self._exc_info(RuntimeError, "合成的错误")
+        for i in range(self.count):
+            test = classes[i % self.classes]()
+            # 输出长度在 0 到 2 倍 output_size 之间变化
+            output = "x" * self.random.randint(0, self.output_size * 2)
+            roll = self.random.random()
+            if roll < self.error_ratio:
+                n, err = 2, error
+            elif roll < self.error_ratio + self.fail_ratio:
+                n, err = 1, failure
+            else:
+                n, err = 0, None
+            if n and self.random.random() < self.screenshot_ratio:
+                output += "\nerrorImg[%d.png]errorImg, browser[chrome(99.0)]browser" % i
+            yield test, n, output, err
+
+
+class ReporterBenchmark(object):
+
+    def __init__(self, scales, repeat=3, **suite_options):
+        self.scales = scales
+        self.repeat = repeat
+        self.suite_options = suite_options
+
+    @staticmethod
+    def collect(suite):
+        """ 走 _TestResult 真实的 startTest/add*/stopTest 流程收集结果 """
+        result = HTMLTestReportCN._TestResult(verbosity=1)
+        stderr0 = sys.stderr
+        sys.stderr = open(os.devnull, "w")
+        try:
+            for test, n, output, err in suite.cases():
+                result.startTest(test)
+                sys.stdout.write(output)
+                if n == 0:
+                    result.addSuccess(test)
+                elif n == 1:
+                    result.addFailure(test, err)
+                else:
+                    result.addError(test, err)
+                result.stopTest(test)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr0
+        return result
+
+    @staticmethod
+    def _measure(func, *args):
+        """ 返回 (返回值, 耗时秒, 内存峰值 MB) """
+        tracemalloc.start()
+        start = time.perf_counter()
+        value = func(*args)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return value, elapsed, peak / 1024.0 / 1024.0
+
+    @staticmethod
+    def _timed(func, *args):
+        start = time.perf_counter()
+        value = func(*args)
+        return value, time.perf_counter() - start
+
+    def run_scale(self, count):
+        metrics = dict((name, float("inf")) for name in TIME_METRICS)
+        for i in range(self.repeat):
+            suite = SyntheticSuite(count, **self.suite_options)
+            stream = io.BytesIO()
+            runner = HTMLTestReportCN.HTMLTestRunner(stream=stream, title="Reporter Benchmark")
+            result, collect_s = self._timed(self.collect, suite)
+            _, sort_s = self._timed(runner.sortResult, result.result)
+            runner.stopTime = runner.startTime
+            _, report_s = self._timed(runner.generateReport, None, result)
+            metrics["collect_s"] = min(metrics["collect_s"], collect_s)
+            metrics["sort_s"] = min(metrics["sort_s"], sort_s)
+            metrics["report_s"] = min(metrics["report_s"], report_s)
+
+            if i == 0:
+                # 内存单独测一次，tracemalloc 会拖慢计时
+                result, _, collect_peak = self._measure(self.collect, SyntheticSuite(count, **self.suite_options))
+                stream = io.BytesIO()
+                runner = HTMLTestReportCN.HTMLTestRunner(stream=stream, title="Reporter Benchmark")
+                runner.stopTime = runner.startTime
+                _, _, report_peak = self._measure(runner.generateReport, None, result)
+                html = stream.getvalue()
+                metrics["collect_peak_mb"] = collect_peak
+                metrics["report_peak_mb"] = report_peak
+                metrics["html_mb"] = len(html) / 1024.0 / 1024.0
+                metrics["rows"] = html.count(b"<tr")
+        return dict((name, round(value, 4)) for name, value in metrics.items())
+
+    def run(self):
+        results = {}
+        for count in self.scales:
+            results[str(count)] = self.run_scale(count)
+            print("%8s 用例: %s" % (count, json.dumps(results[str(count)], sort_keys=True)))
+        return {"python": sys.version.split()[0], "options": self.suite_options, "results": results}
+
+    @staticmethod
+    def compare(current, baseline, threshold):
+        """ 与基线比较，返回超过阈值的回退 [(规模, 指标, 基线值, 当前值)] """
+        regressions = []
+        for count, metrics in current["results"].items():
+            base = baseline.get("results", {}).get(count)
+            if not base:
+                continue
+            for name in TIME_METRICS + SIZE_METRICS:
+                if name in base and base[name] > 0 and metrics[name] > base[name] * (1 + threshold):
+                    regressions.append((count, name, base[name], metrics[name]))
+        return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTMLTestReportCN 报告生成性能基准")
+    parser.add_argument("--scales", default="1000,10000", help="用例数量，逗号分隔，例如 1000,10000,100000")
+    parser.add_argument("--classes", type=int, default=50, help="用例类的数量")
+    parser.add_argument("--output-size", type=int, default=200, help="每个用例输出的平均字符数")
+    parser.add_argument("--screenshot-ratio", type=float, default=0.1, help="失败和错误用例中带截图标记的比例")
+    parser.add_argument("--repeat", type=int, default=3, help="耗时取几次中的最小值")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "reporter_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为新的基线")
+    parser.add_argument("--threshold", type=float, default=0.2, help="超过基线多少比例算回退")
+    args = parser.parse_args(argv)
+
+    benchmark = ReporterBenchmark(
+        [int(count) for count in args.scales.split(",")],
+        repeat=args.repeat,
+        classes=args.classes,
+        output_size=args.output_size,
+        screenshot_ratio=args.screenshot_ratio,
+    )
+    current = benchmark.run()
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print("基线已保存到 %s" % args.baseline)
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("没有找到基线文件 %s，使用 --save-baseline 生成" % args.baseline)
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("options") != current["options"]:
+        print("注意：基线的合成参数与本次不同，结果可能不可比")
+    regressions = ReporterBenchmark.compare(current, baseline, args.threshold)
+    for count, name, base, value in regressions:
+        print("回退：%s 用例的 %s 从 %s 变为 %s" % (count, name, base, value))
+    if not regressions:
+        print("与基线相比没有超过 %d%% 的回退" % (args.threshold * 100))
+    return regressions and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,6 @@
 
 """"" 运行 “.” (当前)目录下的所有测试用例，并生成HTML测试报告 """""
 
-import unittest
 from src.lib import HTMLTestReportCN
 
 
@@ -12,21 +11,63 @@ class RunAllTests(object):
         self.test_case_path = "."
         self.title = "自动化测试报告"
         self.description = "测试报告"
+        # 大于 0 时用多进程导入模块和执行用例，例如 os.cpu_count()
+        self.workers = 0
+        # 失败和错误的用例最多重试的次数，重试通过的用例在报告里标记为“不稳定”
+        self.retries = 0
+        # 完整保留最近多少次运行的报告和截图，失败的运行总是完整保留，更早的只留摘要和缩略图；为 None 时不清理，例如 30
+        self.keep_runs = None
+        # 为 True 时每次运行结束把报告文件夹打成一个 .tar.gz，方便从 CI 机器上拷走
+        self.bundle = False
+        # 用 @resources("browser") 等声明了资源的用例，每种资源同时最多执行几个，例如 {"browser": 2}
+        self.resource_limits = {}
+        # 执行顺序，例如 ("failed", "changed", "duration")：上次失败的用例优先，其次是改动过的文件里的用例，其余按历史耗时从短到长；
+        # 为 None 时按发现顺序
+        self.order = None
+        # 失败和错误的用例累计达到这个数量时提前终止，剩下的用例在报告里显示为“跳过/未执行”；为 None 时执行全部用例
+        self.max_failures = None
+        # 为 git 分支名（如 "origin/master"）时只执行受改动影响的用例（需要事先记录过覆盖索引）；为 None 时执行全部用例
+        self.diff_base = None
+        # 为 True 时记录每个用例执行过的源文件，供 diff_base 选择用例；记录会明显拖慢用例，只在定时的全量运行里打开
+        self.record_coverage = False
 
     def run(self):
-        test_suite = unittest.TestLoader().discover(self.test_case_path)
+        # 通过发现缓存列出用例，只导入有改动的文件，未改动的文件直接读缓存
+        discovery = HTMLTestReportCN.DiscoveryCache(self.test_case_path, processes=max(1, self.workers))
+        if self.workers > 0:
+            # 多进程模式下主进程不导入用例模块，导入失败的模块交给工作进程加载，在报告里显示为错误
+            test_suite = discovery.test_ids() + [module for module, _ in discovery.import_errors()]
+        else:
+            test_suite = discovery.load_suite()
 
         # 启动测试时创建文件夹并获取报告的名字
         daf = HTMLTestReportCN.DirAndFiles()
         daf.create_dir(title=self.title)
         report_path = HTMLTestReportCN.GlobalMsg.get_value("report_path")
+        # 机器可读的结果，可以用 python -m src.lib.HTMLTestReportCN diff 比较两次运行
+        results_path = HTMLTestReportCN.GlobalMsg.get_value("dir_path") + "/results.jsonl.gz"
 
         fp = open(report_path, "wb")
 
-        runner = HTMLTestReportCN.HTMLTestRunner(stream=fp, title=self.title, description=self.description, tester=input("请输入你的名字："))
+        runner = HTMLTestReportCN.HTMLTestRunner(stream=fp, title=self.title, description=self.description, tester=input("请输入你的名字："),
+                                                 workers=self.workers, preload=["selenium.webdriver"],
+                                                 retries=self.retries, history_path=daf.path + "history.db",
+                                                 results_path=results_path, index_root=daf.path,
+                                                 resource_limits=self.resource_limits, test_resources=discovery.resources(),
+                                                 order=self.order, max_failures=self.max_failures,
+                                                 coverage_path=daf.path + "coverage_map.json.gz",
+                                                 record_coverage=self.record_coverage, diff_base=self.diff_base)
         runner.run(test_suite)
         fp.close()
 
+        if self.bundle:
+            bundle = HTMLTestReportCN.RunBundle()
+            path = bundle.write(HTMLTestReportCN.GlobalMsg.get_value("dir_path"))
+            print("压缩包已生成：%s（%s）" % (path, bundle.size_report()))
+
+        if self.keep_runs is not None:
+            HTMLTestReportCN.ResultRetention(daf.path, keep_runs=self.keep_runs).apply()
+
 
 if __name__ == "__main__":
     RunAllTests().run()
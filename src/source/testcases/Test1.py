@@ -4,20 +4,22 @@
 
 import unittest
 from selenium import webdriver
-from src.lib.HTMLTestReportCN import DirAndFiles
+from src.lib.HTMLTestReportCN import DirAndFiles, WebDriverPool
+
+# 浏览器只在第一次租用时启动，之后的用例复用同一个会话
+pool = WebDriverPool(lambda: webdriver.Chrome(executable_path="../../lib/chromedriver.exe"))
 
 
 class TestClass(unittest.TestCase):
     """ UI自动化测试 """
 
     def setUp(self):
-        self.browser = webdriver.Chrome(executable_path="../../lib/chromedriver.exe")
+        self.browser = pool.lease(self)
+        # 用 addCleanup 归还，setUp 后面的步骤出错时也会执行
+        self.addCleanup(pool.release, self.browser)
         self.browser.get("https://www.baidu.com")
         self.daf = DirAndFiles()
 
-    def tearDown(self):
-        self.browser.quit()
-
     def test1_find_input(self):
         """ UI自动化测试1 """
         try:
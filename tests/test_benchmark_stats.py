@@ -0,0 +1,60 @@
+# coding=utf-8
+
+""""" 性能用例的 Welch t 检验与基线比较 """""
+
+import math
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+def _stats(mean, stdev, samples):
+    return {"mean": mean, "stdev": stdev, "samples": samples}
+
+
+class WelchTest(unittest.TestCase):
+
+    def test_known_p_value(self):
+        # 方差相同、各 6 个样本时 df = 10；t = 2 的双侧 p 值为 0.0733880
+        p = HTMLTestReportCN._welch_test(_stats(3.0, math.sqrt(3), 6), _stats(1.0, math.sqrt(3), 6))
+        self.assertAlmostEqual(p, 0.0733880, places=6)
+
+    def test_symmetric(self):
+        a, b = _stats(1.2, 0.3, 8), _stats(1.0, 0.1, 12)
+        self.assertAlmostEqual(HTMLTestReportCN._welch_test(a, b), HTMLTestReportCN._welch_test(b, a), places=12)
+
+    def test_equal_means(self):
+        self.assertAlmostEqual(HTMLTestReportCN._welch_test(_stats(1.0, 0.2, 5), _stats(1.0, 0.5, 9)), 1.0)
+
+    def test_zero_variance(self):
+        self.assertEqual(HTMLTestReportCN._welch_test(_stats(1.0, 0, 5), _stats(1.0, 0, 5)), 1.0)
+        self.assertEqual(HTMLTestReportCN._welch_test(_stats(1.1, 0, 5), _stats(1.0, 0, 5)), 0.0)
+
+    def test_single_sample(self):
+        self.assertEqual(HTMLTestReportCN._welch_test(_stats(2.0, 0.1, 1), _stats(1.0, 0.1, 5)), 1.0)
+
+
+class BaselineCompareTest(unittest.TestCase):
+
+    def _baseline(self, **entry):
+        baseline = HTMLTestReportCN.BenchmarkBaseline("/nonexistent/baseline.json", alpha=0.05, threshold=0.05)
+        if entry:
+            baseline.entries["t::b"] = entry
+        return baseline
+
+    def test_new(self):
+        self.assertEqual(self._baseline().compare("t::b", _stats(1.0, 0.1, 10))[0], "新增")
+
+    def test_regression_and_faster(self):
+        baseline = self._baseline(mean=1.0, stdev=0.01, samples=20)
+        self.assertEqual(baseline.compare("t::b", _stats(1.2, 0.01, 20))[0], "回退")
+        self.assertEqual(baseline.compare("t::b", _stats(0.8, 0.01, 20))[0], "变快")
+
+    def test_noise_is_not_regression(self):
+        # 差异显著但没超过相对阈值，或超过阈值但不显著，都算通过
+        self.assertEqual(self._baseline(mean=1.0, stdev=0.001, samples=50).compare("t::b", _stats(1.02, 0.001, 50))[0], "通过")
+        self.assertEqual(self._baseline(mean=1.0, stdev=0.5, samples=3).compare("t::b", _stats(1.2, 0.5, 3))[0], "通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# coding=utf-8
+
+""""" 覆盖索引：按改动选择用例，以及 coverage.py 按上下文记录每个用例的文件 """""
+
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+import types
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+class CoverageMapSelectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.coverage = HTMLTestReportCN.CoverageMap(os.path.join(self.root, "map.json"), self.root)
+        self.coverage.update({"suite.test_login.T.test_a": ["app/login.py"], "suite.test_login.T.test_b": ["app/other.py"]})
+
+    def test_changed_source(self):
+        selected, skipped = self.coverage.select(["suite.test_login.T.test_a", "suite.test_login.T.test_b"], ["app/login.py"])
+        self.assertEqual(selected, ["suite.test_login.T.test_a"])
+        self.assertEqual([t for t, reason in skipped], ["suite.test_login.T.test_b"])
+
+    def test_uncovered_source_runs_everything(self):
+        selected, skipped = self.coverage.select(["suite.test_login.T.test_a", "suite.test_login.T.test_b"], ["app/consts.py"])
+        self.assertEqual(len(selected), 2)
+        self.assertEqual(self.coverage.stats["unknown_sources"], ["app/consts.py"])
+
+    def test_test_module_resolved_through_sys_modules(self):
+        # 包里的用例模块是 __init__.py，按模块名推算的 suite/pkg.py 不对
+        module = types.ModuleType("suite.pkg")
+        module.__file__ = os.path.join(self.root, "suite", "pkg", "__init__.py")
+        sys.modules["suite.pkg"] = module
+        self.addCleanup(sys.modules.pop, "suite.pkg")
+        tests = ["suite.pkg.T.test_new", "suite.test_login.T.test_b"]
+        selected, skipped = self.coverage.select(tests, ["suite/pkg/__init__.py"])
+        self.assertEqual(self.coverage.stats["unknown_sources"], [])
+        self.assertEqual(selected, ["suite.pkg.T.test_new"])
+        self.assertEqual(self.coverage._module_file("suite.not_imported"), "suite/not_imported.py")
+
+
+@unittest.skipUnless(HTMLTestReportCN.coverage_py is not None and getattr(sys, "monitoring", None) is None,
+                     "需要 coverage.py，且 Python 低于 3.12")
+class CoverageContextsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, body in (("a", "def f():\n    return 1\n"), ("b", "def f():\n    return 2\n"),
+                           ("sample_cov_tests", """
+                               import unittest
+                               import a, b
+
+                               class T(unittest.TestCase):
+                                   @classmethod
+                                   def setUpClass(cls):
+                                       b.f()
+
+                                   def test_a(self):
+                                       a.f()
+
+                                   def test_none(self):
+                                       pass
+                               """)):
+            with open(os.path.join(self.root, name + ".py"), "w") as f:
+                f.write(textwrap.dedent(body))
+        sys.path.insert(0, self.root)
+        self.addCleanup(sys.path.remove, self.root)
+        for name in ("a", "b", "sample_cov_tests"):
+            self.addCleanup(sys.modules.pop, name, None)
+
+    def test_files_per_test(self):
+        import sample_cov_tests
+        result = HTMLTestReportCN._TestResult(verbosity=0)
+        tracer = result.file_tracer = HTMLTestReportCN._FileTracer(self.root)
+        tracer.install()
+        try:
+            unittest.TestLoader().loadTestsFromTestCase(sample_cov_tests.T)(result)
+            self.assertEqual(result.coverage, {})
+            files = tracer.collect()
+        finally:
+            tracer.uninstall()
+        files = dict((test_id.rsplit(".", 1)[-1], test_files) for test_id, test_files in files.items())
+        # setUpClass 执行的 b.py 算在类的每个用例上
+        self.assertEqual(files, {"test_a": ["a.py", "b.py", "sample_cov_tests.py"],
+                                 "test_none": ["b.py", "sample_cov_tests.py"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# coding=utf-8
+
+""""" 失败聚类：按异常签名分组，只归一化异常信息，不归一化调用栈 """""
+
+import io
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+def _traceback(line, message, chained=None):
+    text = (
+        'Traceback (most recent call last):\n'
+        '  File "/src/tests/test_api.py", line %s, in test_call\n'
+        '    self.client.call()\n'
+        '  File "/src/app/client.py", line 88, in call\n'
+        '    raise ValueError(message)\n'
+        '%s\n' % (line, message)
+    )
+    if chained:
+        text = chained + "\nDuring handling of the above exception, another exception occurred:\n\n" + text
+    return text
+
+
+class FailureSignatureTest(unittest.TestCase):
+
+    def test_message_noise_is_ignored(self):
+        a = HTMLTestReportCN._failure_signature(_traceback(10, "ValueError: id 123 at 0x7f00ab12"))
+        b = HTMLTestReportCN._failure_signature(_traceback(10, "ValueError: id 456 at 0x7f00cd34"))
+        self.assertEqual(a[0], b[0])
+        self.assertEqual(a[1], "ValueError: id 123 at 0x7f00ab12")
+
+    def test_frames_are_not_normalized(self):
+        # 不同行号的调用点是不同的原因
+        a = HTMLTestReportCN._failure_signature(_traceback(10, "ValueError: boom"))
+        b = HTMLTestReportCN._failure_signature(_traceback(20, "ValueError: boom"))
+        self.assertNotEqual(a[0], b[0])
+
+    def test_only_last_chained_exception(self):
+        a = HTMLTestReportCN._failure_signature(_traceback(10, "ValueError: boom", chained=_traceback(1, "KeyError: 'a'")))
+        b = HTMLTestReportCN._failure_signature(_traceback(10, "ValueError: boom", chained=_traceback(2, "KeyError: 'b'")))
+        self.assertEqual(a[0], b[0])
+
+
+class ClusterFailuresTest(unittest.TestCase):
+
+    def test_grouping(self):
+        same = _traceback(10, "ValueError: id 1")
+        records = [
+            (1, "a", "", same, 0.1),
+            (1, "b", "", _traceback(10, "ValueError: id 2"), 0.1),
+            (2, "c", "", same, 0.1),
+            (1, "d", "", _traceback(30, "ValueError: id 3"), 0.1),
+            (0, "e", "", "", 0.1),
+            (3, "f", "", same, 0.1),
+        ]
+        clusters = HTMLTestReportCN._cluster_failures(records)
+        self.assertEqual([(c["cid"], c["n"], [t for t, e in c["members"]]) for c in clusters],
+                         [(1, 1, ["a", "b"]), (2, 2, ["c"]), (3, 1, ["d"])])
+
+
+class ReportClusterTest(unittest.TestCase):
+
+    def test_clusters_computed_by_generate_report(self):
+        class Fails(unittest.TestCase):
+
+            def test_a(self):
+                self.fail("id %s" % id(self))
+
+            # 同一个函数，调用栈相同，只有异常信息里的数字不同
+            test_b = test_a
+
+        class Attributes(HTMLTestReportCN.HTMLTestRunner):
+
+            def getReportAttributes(self, result):
+                # 自定义属性时去掉失败用例合集，用例表格里的聚类不受影响
+                return [(name, value) for name, value in HTMLTestReportCN.HTMLTestRunner.getReportAttributes(self, result)
+                        if name != "失败用例合集"]
+
+        stream = io.BytesIO()
+        runner = Attributes(stream=stream, verbosity=0)
+        runner.run(unittest.TestLoader().loadTestsFromTestCase(Fails))
+        self.assertEqual([len(c["members"]) for c in runner.clusters], [2])
+        self.assertIn("cluster_1", stream.getvalue().decode("utf-8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# coding=utf-8
+
+""""" 日志捕获：默认关闭，开启后只设置自己的 handler 级别，不改 logger 级别 """""
+
+import io
+import logging
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+def _logging_suite():
+    class Logs(unittest.TestCase):
+
+        def test_logs(self):
+            logger = logging.getLogger("tests.log_capture")
+            logger.debug("调试")
+            logger.info("信息")
+            logger.warning("警告")
+
+    return unittest.TestLoader().loadTestsFromTestCase(Logs)
+
+
+def _levels(result):
+    return [record.levelno for records in result.logs.values() for record in records]
+
+
+class LogCaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_level = logging.getLogger().level
+        self.addCleanup(logging.getLogger().setLevel, self.root_level)
+        self.addCleanup(logging.getLogger("tests.log_capture").setLevel, logging.NOTSET)
+
+    def test_off_by_default(self):
+        runner = HTMLTestReportCN.HTMLTestRunner(stream=io.BytesIO(), verbosity=0)
+        result = runner.run(_logging_suite())
+        self.assertIsNone(result.log_handler)
+        self.assertEqual(result.logs, {})
+
+    def test_root_level_untouched(self):
+        logging.getLogger().setLevel(logging.WARNING)
+        runner = HTMLTestReportCN.HTMLTestRunner(stream=io.BytesIO(), verbosity=0,
+                                                 log_level=logging.DEBUG, log_keep_level=logging.DEBUG)
+        result = runner.run(_logging_suite())
+        self.assertEqual(logging.getLogger().level, logging.WARNING)
+        # 根 logger 是 WARNING，低于它的日志在到达 handler 之前就被丢掉
+        self.assertEqual(_levels(result), [logging.WARNING])
+
+    def test_handler_level(self):
+        logging.getLogger("tests.log_capture").setLevel(logging.DEBUG)
+        runner = HTMLTestReportCN.HTMLTestRunner(stream=io.BytesIO(), verbosity=0,
+                                                 log_level=logging.INFO, log_keep_level=logging.DEBUG)
+        result = runner.run(_logging_suite())
+        self.assertEqual(_levels(result), [logging.INFO, logging.WARNING])
+        self.assertNotIn(result.log_handler, logging.getLogger().handlers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+# coding=utf-8
+
+""""" _ParallelRunner 的单元划分、派发顺序，以及真实工作进程下的执行 """""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from src.lib import HTMLTestReportCN
+from src.lib.HTMLTestReportCN import _ParallelRunner, _TestResult, _Worker
+
+
+class _FakeConn(object):
+    """ 记录派发给工作进程的消息 """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def _worker(wid, modules=()):
+    worker = _Worker(wid, None, _FakeConn())
+    worker.modules = set(modules)
+    return worker
+
+
+def _runner(entries, resource_limits=None, test_resources=None, ordered=False):
+    runner = _ParallelRunner(_TestResult(0), 2, {}, resource_limits, test_resources, ordered)
+    runner.pending = runner._make_units(entries, runner._limited_resources)
+    return runner
+
+
+class MakeUnitsTest(unittest.TestCase):
+
+    def test_one_unit_per_class(self):
+        units = _ParallelRunner._make_units(["m.A.test_1", "m.B.test_1", "m.A.test_2"])
+        self.assertEqual(units, [("m.A", ["m.A.test_1", "m.A.test_2"]), ("m.B", ["m.B.test_1"])])
+
+    def test_resources_split_a_class(self):
+        resources = {"m.A.test_1": ("browser",)}
+        units = _ParallelRunner._make_units(["m.A.test_1", "m.A.test_2"], lambda e: resources.get(e, ()))
+        self.assertEqual(units, [("m.A", ["m.A.test_1"]), ("m.A", ["m.A.test_2"])])
+
+
+class DispatchTest(unittest.TestCase):
+
+    def test_prefers_module_already_imported(self):
+        runner = _runner(["a.A.test_1", "b.B.test_1"])
+        worker = _worker(0, ["b"])
+        self.assertTrue(runner._dispatch(worker, [worker]))
+        self.assertEqual(worker.unit[0], "b.B")
+        self.assertEqual(worker.conn.sent, [("run", ["b.B.test_1"])])
+
+    def test_avoids_module_claimed_by_other_worker(self):
+        runner = _runner(["a.A.test_1", "b.B.test_1"])
+        worker, other = _worker(0), _worker(1, ["a"])
+        runner._dispatch(worker, [worker, other])
+        self.assertEqual(worker.unit[0], "b.B")
+
+    def test_ordered_keeps_dispatch_order(self):
+        runner = _runner(["a.A.test_1", "b.B.test_1"], ordered=True)
+        worker = _worker(0, ["b"])
+        runner._dispatch(worker, [worker])
+        self.assertEqual(worker.unit[0], "a.A")
+
+    def test_limited_resource_first_and_released(self):
+        resources = {"c.C.test_1": ("browser",), "c.C.test_2": ("browser",)}
+        runner = _runner(["a.A.test_1", "c.C.test_1", "c.C.test_2"], {"browser": 1}, resources)
+        first, second = _worker(0), _worker(1)
+        runner._dispatch(first, [first, second])
+        self.assertEqual(first.unit, ("c.C", ["c.C.test_1", "c.C.test_2"]))
+        self.assertEqual(runner.in_use, {"browser": 1})
+        runner._handle(first, ("idle",))
+        self.assertEqual(runner.in_use, {"browser": 0})
+
+    def test_skips_unit_while_resource_is_full(self):
+        resources = {"c.C.test_1": ("browser",), "c.D.test_1": ("browser",)}
+        runner = _runner(["c.C.test_1", "c.D.test_1", "a.A.test_1"], {"browser": 1}, resources)
+        first, second = _worker(0), _worker(1)
+        runner._dispatch(first, [first, second])
+        runner._dispatch(second, [first, second])
+        self.assertEqual(first.unit[0], "c.C")
+        self.assertEqual(second.unit[0], "a.A")
+        third = _worker(2)
+        self.assertFalse(runner._dispatch(third, [first, second, third]))
+
+    def test_async_mode_splits_limits(self):
+        resources = dict(("c.C.test_%s" % i, ("browser",)) for i in range(5))
+        resources["c.D.test_1"] = ("browser",)
+        runner = _runner(sorted(resources), {"browser": 5}, resources)
+        runner.options = {"async_mode": True}
+        first, second = _worker(0), _worker(1)
+        runner._dispatch(first, [first, second])
+        # 上限 5 分给 2 个进程，每个单元最多 2 个名额
+        self.assertEqual(first.conn.sent, [("run", ["c.C.test_%s" % i for i in range(5)], {"browser": 2})])
+        runner._dispatch(second, [first, second])
+        # 单元只有一个用例，只占 1 个名额
+        self.assertEqual(second.conn.sent, [("run", ["c.D.test_1"], {"browser": 1})])
+        self.assertEqual(runner.in_use, {"browser": 3})
+        runner._handle(first, ("idle",))
+        self.assertEqual(runner.in_use, {"browser": 1})
+
+
+class WorkerRunTest(unittest.TestCase):
+    """ 用两个真实的工作进程执行一个临时模块里的用例 """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        with open(os.path.join(self.root, "parallel_sample.py"), "w") as f:
+            f.write(textwrap.dedent("""
+                import unittest
+
+                class First(unittest.TestCase):
+                    def test_pass(self):
+                        print("first")
+
+                    def test_fail(self):
+                        self.assertEqual(1, 2)
+
+                class Second(unittest.TestCase):
+                    def test_error(self):
+                        raise ValueError("boom")
+                """))
+        self.addCleanup(sys.modules.pop, "parallel_sample", None)
+
+    def test_records_come_back_from_workers(self):
+        sys.path.insert(0, self.root)
+        self.addCleanup(sys.path.remove, self.root)
+        runner = HTMLTestReportCN.HTMLTestRunner(stream=io.BytesIO(), verbosity=0, workers=2,
+                                                 top_level_dir=self.root)
+        result = _TestResult(0)
+        ids = ["parallel_sample.First.test_pass", "parallel_sample.First.test_fail",
+               "parallel_sample.Second.test_error"]
+        _ParallelRunner(result, 2, runner._worker_options()).run(ids)
+        records = dict((t.id(), (n, o)) for n, t, o, e, s in result.result)
+        self.assertEqual(records["parallel_sample.First.test_pass"], (0, "first\n"))
+        self.assertEqual(records["parallel_sample.First.test_fail"][0], 1)
+        self.assertEqual(records["parallel_sample.Second.test_error"][0], 2)
+        workers = set(e["worker"] for entries in result.timeline.values() for e in entries)
+        self.assertLessEqual(workers, {"进程 1", "进程 2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# coding=utf-8
+
+""""" 结果目录的保留策略，以及新运行的版本号 """""
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+class RetentionTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp() + os.sep
+        self.addCleanup(shutil.rmtree, self.root)
+        # 其他用例可能设置过当前运行的文件夹
+        self.addCleanup(HTMLTestReportCN.GlobalMsg.set_value, "dir_path", HTMLTestReportCN.GlobalMsg.get_value("dir_path"))
+        HTMLTestReportCN.GlobalMsg.set_value("dir_path", None)
+
+    def make_run(self, name, days_ago, fail=0):
+        run_dir = os.path.join(self.root, name)
+        os.makedirs(os.path.join(run_dir, "image", "thumb"))
+        start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() - days_ago * 86400))
+        with open(os.path.join(run_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"start_time": start, "fail": fail, "error": 0}, f)
+        for path in ("report.html", "results.jsonl", os.path.join("image", "1.png"), os.path.join("image", "thumb", "1.png")):
+            with open(os.path.join(run_dir, path), "w") as f:
+                f.write(name)
+        return run_dir
+
+    @staticmethod
+    def files(run_dir):
+        return sorted(os.path.relpath(os.path.join(d, name), run_dir).replace(os.sep, "/")
+                      for d, _, names in os.walk(run_dir) for name in names)
+
+
+class ResultRetentionTest(RetentionTestBase):
+
+    def test_apply(self):
+        self.make_run("newest", 0)
+        self.make_run("failing", 5, fail=1)
+        old = self.make_run("old", 10)
+        ancient = self.make_run("ancient", 100)
+        retention = HTMLTestReportCN.ResultRetention(self.root, keep_runs=1, archive_after_days=90)
+        actions = retention.apply()
+        self.assertEqual([(action, run["name"]) for action, run in actions], [("compact", "old"), ("archive", "ancient")])
+        self.assertEqual(self.files(old), ["image/thumb/1.png", "results.jsonl", "summary.json"])
+        with open(os.path.join(old, "summary.json"), encoding="utf-8") as f:
+            self.assertTrue(json.load(f)["compacted"])
+        self.assertFalse(os.path.exists(ancient))
+        with tarfile.open(os.path.join(self.root, "archive", "ancient.tar.gz")) as tar:
+            self.assertIn("image/1.png", [name.split("/", 1)[-1] for name in tar.getnames()])
+        self.assertEqual(len(self.files(os.path.join(self.root, "failing"))), 5)
+        # 已压缩的运行不再处理
+        self.assertEqual(retention.apply(), [])
+
+    def test_dry_run_and_lock(self):
+        old = self.make_run("old", 10)
+        self.make_run("newest", 0)
+        retention = HTMLTestReportCN.ResultRetention(self.root, keep_runs=1)
+        self.assertEqual([action for action, run in retention.apply(dry_run=True)], ["compact"])
+        self.assertEqual(len(self.files(old)), 5)
+        open(os.path.join(self.root, retention.LOCK_FILE), "w").close()
+        self.assertIsNone(retention.apply())
+
+    def test_busy_run_without_summary(self):
+        run_dir = self.make_run("writing", 0)
+        os.remove(os.path.join(run_dir, "summary.json"))
+        os.remove(os.path.join(run_dir, "results.jsonl"))
+        plan = HTMLTestReportCN.ResultRetention(self.root, keep_runs=0, keep_failing=False).plan()
+        # 没有摘要又刚创建的运行可能还在写入，不处理
+        self.assertEqual([(action, run["name"]) for action, run in plan], [("keep", "writing")])
+
+
+class CreateDirTest(RetentionTestBase):
+
+    def test_first_free_version(self):
+        daf = HTMLTestReportCN.DirAndFiles()
+        daf.path = self.root
+        os.makedirs(self.root + "ReportV1.0")
+        os.makedirs(self.root + "ReportV1.2")
+        os.makedirs(os.path.join(self.root, "archive"))
+        open(os.path.join(self.root, "archive", "ReportV1.1.tar.gz"), "w").close()
+        daf.create_dir("Report")
+        self.assertEqual(HTMLTestReportCN.GlobalMsg.get_value("dir_path"), self.root + "ReportV1.3")
+        self.assertEqual(HTMLTestReportCN.GlobalMsg.get_value("report_path"), self.root + "ReportV1.3/ReportV1.3.html")
+        shutil.rmtree(self.root + "ReportV1.0")
+        daf.create_dir("Report")
+        self.assertEqual(HTMLTestReportCN.GlobalMsg.get_value("dir_path"), self.root + "ReportV1.0")
+
+
+if __name__ == "__main__":
+    unittest.main()
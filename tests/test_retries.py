@@ -0,0 +1,57 @@
+# coding=utf-8
+
+""""" 失败重试：重试通过记为不稳定，用例行保留每次执行的输出 """""
+
+import io
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+def _flaky_suite(fail_times):
+    """ 在函数里定义，避免被当成本模块的用例收集；前 fail_times 次执行失败 """
+    calls = []
+
+    class Flaky(unittest.TestCase):
+
+        def test_flaky(self):
+            calls.append(1)
+            print("第 %s 次输出" % len(calls))
+            self.assertGreater(len(calls), fail_times, "还没到第 %s 次" % (fail_times + 1))
+
+    return unittest.TestLoader().loadTestsFromTestCase(Flaky)
+
+
+def _run(suite, retries):
+    runner = HTMLTestReportCN.HTMLTestRunner(stream=io.BytesIO(), verbosity=0, retries=retries)
+    return runner.run(suite)
+
+
+class RetryTest(unittest.TestCase):
+
+    def test_pass_on_retry_is_flaky_and_keeps_all_output(self):
+        result = _run(_flaky_suite(1), retries=2)
+        n, t, o, e, s = result.result[0]
+        self.assertEqual(n, 3)
+        self.assertEqual(result.flaky_count, 1)
+        self.assertEqual(result.failure_count, 0)
+        self.assertIn("第 1 次输出", o)
+        self.assertIn("还没到第 2 次", o)
+        self.assertIn("第 2 次输出", o)
+        self.assertEqual(e, "")
+        self.assertEqual(len(result.attempts[t.id()]), 2)
+
+    def test_still_failing_keeps_last_traceback(self):
+        result = _run(_flaky_suite(5), retries=1)
+        n, t, o, e, s = result.result[0]
+        self.assertEqual(n, 1)
+        self.assertEqual(result.failure_count, 1)
+        self.assertIn("第 1 次输出", o)
+        self.assertIn("第 2 次输出", o)
+        self.assertIn("AssertionError", e)
+        self.assertEqual(o.count("AssertionError"), 1)
+        self.assertEqual(result.failures, [(t, e)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# coding=utf-8
+
+""""" 运行文件夹打包：重复文件存为硬链接，输出大小统计 """""
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+class RunBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.run_dir = os.path.join(self.tmp, "ReportV1.0")
+        os.makedirs(os.path.join(self.run_dir, "image"))
+        files = {"report.html": b"<html>" * 1000, "image/1.png": b"\x89PNG" + bytes(range(256)) * 8,
+                 "image/2.png": b"\x89PNG" + bytes(range(256)) * 8}
+        for name, data in files.items():
+            with open(os.path.join(self.run_dir, name), "wb") as f:
+                f.write(data)
+
+    def test_write_and_size_report(self):
+        bundle = HTMLTestReportCN.RunBundle()
+        path = bundle.write(self.run_dir)
+        self.assertEqual(path, self.run_dir + ".tar.gz")
+        stats = bundle.stats
+        self.assertEqual((stats["files"], stats["duplicates"]), (3, 1))
+        self.assertEqual(stats["size"], 6000 + 2 * 2052)
+        self.assertEqual(stats["duplicate_size"], 2052)
+        self.assertEqual(stats["bundle_size"], os.path.getsize(path))
+        self.assertTrue(bundle.size_report().startswith("3 个文件，1 个重复（省 2.0 KB），原始 9.9 KB，压缩包 "))
+        with tarfile.open(path) as tar:
+            links = [member.name for member in tar.getmembers() if member.islnk()]
+            self.assertEqual(len(links), 1)
+            tar.extractall(os.path.join(self.tmp, "out"))
+        with open(os.path.join(self.tmp, "out", links[0]), "rb") as f:
+            self.assertEqual(len(f.read()), 2052)
+
+    def test_size_report_before_write(self):
+        self.assertEqual(HTMLTestReportCN.RunBundle().size_report(), "")
+
+    def test_bad_compression(self):
+        self.assertRaises(ValueError, HTMLTestReportCN.RunBundle, "zip")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# coding=utf-8
+
+""""" 结果文件的读写和两次运行的差异 """""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+def _test(status, duration, error=""):
+    return {"status": status, "duration": duration, "class": "T", "doc": "", "error": error}
+
+
+def _groups(old, new):
+    diff = HTMLTestReportCN.RunDiff(HTMLTestReportCN.RunResults({}, old), HTMLTestReportCN.RunResults({}, new),
+                                    stream=io.BytesIO())
+    return dict((name, [test_id for test_id, o, n in items]) for name, items in diff.compare() if items)
+
+
+class RunDiffTest(unittest.TestCase):
+
+    def test_status_changes(self):
+        old = {"broke": _test(0, 0.1), "fixed": _test(1, 0.1), "still": _test(2, 0.1), "gone": _test(0, 0.1)}
+        new = {"broke": _test(1, 0.1, "AssertionError: x"), "fixed": _test(3, 0.1), "still": _test(1, 0.1),
+               "added": _test(0, 0.1)}
+        self.assertEqual(_groups(old, new), {"新增失败": ["broke"], "已修复": ["fixed"], "仍然失败": ["still"],
+                                             "新出现": ["added"], "已消失": ["gone"]})
+
+    def test_not_run(self):
+        # 新运行里没执行的既不算修复也不算变快；旧运行里没执行的只看新结果是否失败
+        old = {"a": _test(1, 2.0), "b": _test(4, 0), "c": _test(4, 0)}
+        new = {"a": _test(4, 0), "b": _test(1, 3.0), "c": _test(0, 3.0)}
+        self.assertEqual(_groups(old, new), {"未执行": ["a"], "新增失败": ["b"]})
+
+    def test_durations(self):
+        old = {"slow": _test(0, 1.0), "fast": _test(0, 1.0), "tiny": _test(0, 0.01), "noise": _test(0, 1.0)}
+        new = {"slow": _test(0, 2.0), "fast": _test(0, 0.5), "tiny": _test(0, 0.05), "noise": _test(0, 1.3)}
+        self.assertEqual(_groups(old, new), {"变慢": ["slow"], "变快": ["fast"]})
+
+    def test_report(self):
+        stream = io.BytesIO()
+        HTMLTestReportCN.RunDiff(HTMLTestReportCN.RunResults({"count": 1}, {"a": _test(0, 0.1)}),
+                                 HTMLTestReportCN.RunResults({"count": 1}, {"a": _test(1, 0.1, "AssertionError: <x>")}),
+                                 stream=stream).generateReport()
+        html = stream.getvalue().decode("utf-8")
+        self.assertIn("新增失败", html)
+        self.assertIn("AssertionError: &lt;x&gt;", html)
+
+
+class RunResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_round_trip(self):
+        class Sample(unittest.TestCase):
+
+            def test_ok(self):
+                """ 通过 """
+
+            def test_fail(self):
+                self.assertEqual(1, 2)
+
+        result = HTMLTestReportCN._TestResult(verbosity=0)
+        unittest.TestLoader().loadTestsFromTestCase(Sample)(result)
+        for name in ("results.jsonl", "results.jsonl.gz"):
+            path = os.path.join(self.tmp, name)
+            HTMLTestReportCN.RunResults.save(path, {"count": 2}, result.result)
+            loaded = HTMLTestReportCN.RunResults.load(path)
+            self.assertEqual(loaded.info, {"count": 2})
+            tests = dict((test_id.rsplit(".", 1)[-1], item) for test_id, item in loaded.tests.items())
+            self.assertEqual(tests["test_ok"]["status"], 0)
+            self.assertEqual(tests["test_ok"]["doc"], "通过")
+            self.assertEqual(tests["test_fail"]["status"], 1)
+            self.assertEqual(tests["test_fail"]["error"], "AssertionError: 1 != 2")
+
+
+if __name__ == "__main__":
+    unittest.main()
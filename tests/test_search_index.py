@@ -0,0 +1,65 @@
+# coding=utf-8
+
+""""" 报告内嵌的搜索索引：分词和按行段编码的倒排表 """""
+
+import unittest
+
+from src.lib import HTMLTestReportCN
+
+
+def _decode(encoded):
+    """ 与报告页面里 searchPrefix 相同的解码：[间隔, 长度, ...] -> 行号集合 """
+    rows = set()
+    doc = 0
+    for gap, length in zip(encoded[::2], encoded[1::2]):
+        doc += gap
+        rows.update(range(doc, doc + length))
+        doc += length
+    return rows
+
+
+def _rows(data, token):
+    return _decode(data["postings"][data["keys"].index(token)])
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def test_tokens(self):
+        self.assertEqual(HTMLTestReportCN._SEARCH_TOKEN.findall("test_login2 登录，失败"),
+                         ["test", "login2", "登", "录", "失", "败"])
+
+    def test_rows_and_groups(self):
+        index = HTMLTestReportCN._SearchIndex()
+        first = len(index.docs)
+        index.add("pt1.1", "test_a", ["test_a", "Login ok"])
+        index.add("ft1.2", "test_b", ["test_b", "AssertionError: login failed"])
+        index.add_group(first, ["tests", "LoginTest"])
+        first = len(index.docs)
+        index.add("pt2.1", "test_a", ["test_a", ""])
+        index.add_group(first, ["tests", "LogoutTest"])
+        data = index.data()
+        self.assertEqual(data["docs"], [["pt1.1", "test_a"], ["ft1.2", "test_b"], ["pt2.1", "test_a"]])
+        self.assertEqual(data["keys"], sorted(data["keys"]))
+        self.assertEqual(_rows(data, "tests"), {0, 1, 2})
+        self.assertEqual(_rows(data, "test"), {0, 1, 2})
+        self.assertEqual(_rows(data, "login"), {0, 1})
+        self.assertEqual(_rows(data, "logintest"), {0, 1})
+        self.assertEqual(_rows(data, "failed"), {1})
+        self.assertEqual(_rows(data, "b"), {1})
+        self.assertEqual(_rows(data, "a"), {0, 2})
+
+    def test_overlapping_marks(self):
+        index = HTMLTestReportCN._SearchIndex()
+        for i in range(7):
+            index.add("pt1.%s" % i, "t%s" % i, i in (0, 1, 5) and ["shared"] or [])
+        index._mark(["shared"], 2, 3)
+        self.assertEqual(_rows(index.data(), "shared"), {0, 1, 2, 5})
+        index.add_group(0, ["shared"])
+        self.assertEqual(_rows(index.data(), "shared"), set(range(7)))
+
+    def test_merge_runs(self):
+        self.assertEqual(HTMLTestReportCN._merge_runs([(0, 2), (1, 3), (3, 4), (6, 8)]), [0, 4, 6, 8])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+# coding=utf-8
+
+""""" 截图缩略图：标准库的 PNG 解码（五种过滤方式）和最近邻缩放 """""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+from src.lib import HTMLTestReportCN
+
+
+def _paeth(left, up, upper_left):
+    p = left + up - upper_left
+    pa, pb, pc = abs(p - left), abs(p - up), abs(p - upper_left)
+    if pa <= pb and pa <= pc:
+        return left
+    return up if pb <= pc else upper_left
+
+
+def _filter_row(kind, row, prev, bpp):
+    """ PNG 编码端的过滤，解码应还原出 row """
+    out = bytearray()
+    for i, value in enumerate(row):
+        left = row[i - bpp] if i >= bpp else 0
+        up = prev[i]
+        upper_left = prev[i - bpp] if i >= bpp else 0
+        predictor = (0, left, up, (left + up) >> 1, _paeth(left, up, upper_left))[kind]
+        out.append((value - predictor) & 255)
+    return bytes(out)
+
+
+def _write_png(path, width, height, color, rows, kinds):
+    def chunk(kind, body):
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+    bpp = {0: 1, 2: 3, 4: 2, 6: 4}[color]
+    raw = b""
+    prev = bytes(width * bpp)
+    for y, row in enumerate(rows):
+        kind = kinds[y % len(kinds)]
+        raw += bytes([kind]) + _filter_row(kind, row, prev, bpp)
+        prev = row
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color, 0, 0, 0)))
+        # 分成两个 IDAT 块
+        data = zlib.compress(raw)
+        f.write(chunk(b"IDAT", data[:len(data) // 2]))
+        f.write(chunk(b"IDAT", data[len(data) // 2:]))
+        f.write(chunk(b"IEND", b""))
+
+
+def _pixels(width, height, bpp):
+    return [bytes((x * 7 + y * 13 + c * 71) & 255 for x in range(width) for c in range(bpp)) for y in range(height)]
+
+
+class ThumbnailTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_read_png_filters_and_colors(self):
+        for color, bpp in ((0, 1), (2, 3), (4, 2), (6, 4)):
+            rows = _pixels(9, 10, bpp)
+            _write_png(self.path("a.png"), 9, 10, color, rows, kinds=(0, 1, 2, 3, 4))
+            width, height, channels, decoded = HTMLTestReportCN._read_png(self.path("a.png"))
+            self.assertEqual((width, height, channels), (9, 10, bpp))
+            self.assertEqual([bytes(row) for row in decoded], rows, "color type %s" % color)
+
+    def test_unsupported(self):
+        with open(self.path("a.png"), "wb") as f:
+            f.write(b"not a png")
+        self.assertIsNone(HTMLTestReportCN._read_png(self.path("a.png")))
+        with mock.patch.object(HTMLTestReportCN, "Image", None):
+            self.assertFalse(HTMLTestReportCN.make_thumbnail(self.path("a.png"), self.path("t.png")))
+
+    def test_make_thumbnail_without_pillow(self):
+        rows = _pixels(64, 40, 3)
+        _write_png(self.path("a.png"), 64, 40, 2, rows, kinds=(4, 1))
+        with mock.patch.object(HTMLTestReportCN, "Image", None):
+            self.assertTrue(HTMLTestReportCN.make_thumbnail(self.path("a.png"), self.path("t.png"), size=(16, 16)))
+        width, height, channels, thumb = HTMLTestReportCN._read_png(self.path("t.png"))
+        self.assertEqual((width, height, channels), (16, 10, 3))
+        # 最近邻：输出像素 (x, y) 取源像素 ((x + 0.5) * 4, (y + 0.5) * 4)
+        self.assertEqual(bytes(thumb[1][3 * 2:3 * 2 + 3]), rows[6][3 * 10:3 * 10 + 3])
+
+    def test_small_image_is_not_enlarged(self):
+        self.assertEqual(HTMLTestReportCN._thumbnail_size(100, 50, (320, 200)), (100, 50))
+        self.assertEqual(HTMLTestReportCN._thumbnail_size(1920, 1080, (320, 200)), (320, 180))
+        self.assertEqual(HTMLTestReportCN._thumbnail_size(5000, 10, (320, 200)), (320, 1))
+
+    def test_make_missing_thumbnails(self):
+        os.makedirs(self.path("run/image/thumb"))
+        _write_png(self.path("run/image/1.png"), 8, 8, 6, _pixels(8, 8, 4), kinds=(0,))
+        _write_png(self.path("run/image/2.png"), 8, 8, 2, _pixels(8, 8, 3), kinds=(0,))
+        with open(self.path("run/image/thumb/2.png"), "wb") as f:
+            f.write(b"existing")
+        with mock.patch.object(HTMLTestReportCN, "Image", None):
+            HTMLTestReportCN.make_missing_thumbnails(self.path("run"))
+        self.assertIsNotNone(HTMLTestReportCN._read_png(self.path("run/image/thumb/1.png")))
+        with open(self.path("run/image/thumb/2.png"), "rb") as f:
+            self.assertEqual(f.read(), b"existing")
+
+
+if __name__ == "__main__":
+    unittest.main()
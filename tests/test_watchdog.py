@@ -0,0 +1,108 @@
+# coding=utf-8
+
+""""" 超时看门狗：预算计算、按需创建，以及信号和线程两种打断方式 """""
+
+import io
+import threading
+import time
+import unittest
+import warnings
+
+from src.lib import HTMLTestReportCN
+from src.lib.HTMLTestReportCN import _Watchdog, class_timeout, timeout
+
+
+def _sample_suite():
+    """ 在函数里定义，避免被当成本模块的用例收集 """
+
+    @class_timeout(0.5)
+    class Sample(unittest.TestCase):
+
+        @timeout(0.2)
+        def test_hang(self):
+            while True:
+                time.sleep(0.01)
+
+        def test_after(self):
+            pass
+
+    loader = unittest.TestLoader()
+    return Sample, loader.loadTestsFromTestCase(Sample)
+
+
+def _run(suite, **kwargs):
+    runner = HTMLTestReportCN.HTMLTestRunner(stream=io.BytesIO(), verbosity=0, **kwargs)
+    return runner.run(suite)
+
+
+class BudgetTest(unittest.TestCase):
+
+    def test_method_timeout_wins_over_default(self):
+        cls, suite = _sample_suite()
+        watchdog = _Watchdog(timeout=10)
+        self.assertEqual(watchdog.budget(cls("test_hang"))[0], 0.2)
+        self.assertEqual(watchdog.budget(cls("test_after"))[0], 0.5)
+
+    def test_class_budget_is_reduced_by_time_spent(self):
+        cls, suite = _sample_suite()
+        watchdog = _Watchdog()
+        watchdog.class_spent[cls] = 0.45
+        seconds, reason = watchdog.budget(cls("test_hang"))
+        self.assertAlmostEqual(seconds, 0.05)
+        self.assertIn("Sample", reason)
+
+    def test_needed_only_with_a_budget(self):
+        cls, suite = _sample_suite()
+        self.assertFalse(_Watchdog.needed(None, None, [self]))
+        self.assertTrue(_Watchdog.needed(1, None))
+        self.assertTrue(_Watchdog.needed(None, None, [cls("test_after")]))
+
+
+class InterruptTest(unittest.TestCase):
+
+    def test_no_watchdog_without_timeout(self):
+        result = _run(unittest.TestSuite([BudgetTest("test_needed_only_with_a_budget")]))
+        self.assertIsNone(result.watchdog)
+        self.assertEqual(result.result[0][0], 0)
+
+    def test_signal_interrupts_hung_test(self):
+        cls, suite = _sample_suite()
+        start = time.time()
+        result = _run(suite)
+        self.assertLess(time.time() - start, 2)
+        status = dict((t.id().rsplit(".", 1)[-1], (n, e)) for n, t, o, e, s in result.result)
+        self.assertEqual(status["test_hang"][0], 2)
+        self.assertIn("TestTimeoutError", status["test_hang"][1])
+        self.assertEqual(status["test_after"][0], 0)
+
+    def test_thread_fallback_interrupts_python_code(self):
+        cls, suite = _sample_suite()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(_run(suite)))
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        status = dict((t.id().rsplit(".", 1)[-1], (n, e)) for n, t, o, e, s in results[0].result)
+        self.assertEqual(status["test_hang"][0], 2)
+        self.assertIn("卡住时的调用栈", status["test_hang"][1])
+
+    def test_warns_without_guarded_parts(self):
+        cls, suite = _sample_suite()
+        saved = unittest.TestCase._callTestMethod
+        del unittest.TestCase._callTestMethod
+        self.addCleanup(setattr, unittest.TestCase, "_callTestMethod", saved)
+        watchdog = _Watchdog()
+        test = cls("test_after")
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.assertEqual(watchdog.start(test), 0.5)
+            watchdog.stop(test)
+        self.assertEqual([w.category for w in caught], [RuntimeWarning])
+        self.assertNotIn("_callSetUp", test.__dict__)
+
+    def test_timeout_error_message(self):
+        self.assertEqual(str(HTMLTestReportCN.TestTimeoutError("超时")), "超时")
+
+
+if __name__ == "__main__":
+    unittest.main()
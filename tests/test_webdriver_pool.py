@@ -0,0 +1,67 @@
+# coding=utf-8
+
+""""" WebDriverPool：会话复用、回收，以及池被回收时关闭浏览器 """""
+
+import gc
+import unittest
+import weakref
+
+from src.lib import HTMLTestReportCN
+
+
+class _FakeDriver(object):
+
+    def __init__(self):
+        self.quit_called = False
+        self.window_handles = ["main"]
+        self.current_url = "about:blank"
+        self.switch_to = self
+
+    def window(self, handle):
+        pass
+
+    def delete_all_cookies(self):
+        pass
+
+    def execute_script(self, script):
+        pass
+
+    def get(self, url):
+        self.current_url = url
+
+    def quit(self):
+        self.quit_called = True
+
+
+class WebDriverPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.drivers = []
+
+    def _factory(self):
+        driver = _FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+    def test_reuse_and_max_uses(self):
+        pool = HTMLTestReportCN.WebDriverPool(self._factory, max_uses=2)
+        for _ in range(3):
+            pool.release(pool.lease())
+        self.assertEqual(len(self.drivers), 2)
+        self.assertTrue(self.drivers[0].quit_called)
+        pool.close()
+        self.assertTrue(self.drivers[1].quit_called)
+        self.assertEqual(pool.created, 0)
+
+    def test_finalizer_does_not_keep_pool_alive(self):
+        pool = HTMLTestReportCN.WebDriverPool(self._factory)
+        pool.release(pool.lease())
+        ref = weakref.ref(pool)
+        del pool
+        gc.collect()
+        self.assertIsNone(ref())
+        self.assertTrue(self.drivers[0].quit_called)
+
+
+if __name__ == "__main__":
+    unittest.main()